@@ -0,0 +1,59 @@
+""" Combine benchmark
+
+    Times the combine transformation keyed on the raw person fields (the default when it
+pays off, only the entry of a merged row is transformed) against combining the
+transformed records (is_same_person on every pair) over a range of patient cluster
+sizes (consecutive rows per patient). Keying is forced for the types combining the
+records by default (see schema.keyed_pays).
+
+    python -m benchmarks.bench_combine [rows] [clusters...]
+"""
+import sys
+import time
+from csv_to_json.csv_reader import parse_row
+from csv_to_json.transformers import AllergyToJson, ProblemToJson
+from .generate import Generator
+
+TRANSFORMERS = {
+    "allergy": AllergyToJson,
+    "problem": ProblemToJson,
+}
+
+def unkeyed(transformer):
+    """ The transformer class combining the transformed records (the combine is overridden) """
+    class Unkeyed(transformer):
+        def combine(self, trans, next_trans) -> bool:
+            return super().combine(trans, next_trans)
+    return Unkeyed
+
+def force_keyed(transformer):
+    """ The transformer class combining keyed on the raw person fields whatever the schema """
+    class Keyed(transformer):
+        keyed = True
+    return Keyed
+
+def best(fn, repeat: int = 9) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    clusters = [int(c) for c in sys.argv[2:]] or [1, 2, 5, 10, 50]
+    for record_type, transformer in TRANSFORMERS.items():
+        field_cnt = getattr(transformer, "__fields__")
+        print(f"{record_type} keyed by default: {transformer(combine=True).keyed}")
+        for cluster in clusters:
+            line = Generator(record_type, 0.1, 2, cluster).line
+            parsed = [parse_row(line(i), field_cnt) for i in range(1, rows + 1)]
+            keyed, combined = force_keyed(transformer)(combine=True), unkeyed(transformer)(combine=True)
+            keyed_secs = best(lambda: list(keyed.transformation(iter(parsed))))
+            secs = best(lambda: list(combined.transformation(iter(parsed))))
+            print(f"{record_type} cluster {cluster}: records {secs * 1000:.1f}ms, keyed {keyed_secs * 1000:.1f}ms "
+                f"({secs / keyed_secs:.2f}x)")
+
+if __name__ == "__main__":
+    main()
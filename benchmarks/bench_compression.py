@@ -0,0 +1,47 @@
+""" Compression benchmark
+
+    Converts a synthetic allergy CSV (see generate.py) stored plain and compressed
+with each codec (zstd when available) to plain and compressed JSON, reporting the
+throughput and the size on disk of the input / output.
+
+    python -m benchmarks.bench_compression [size MB]
+"""
+import os
+import shutil
+import sys
+import tempfile
+from timeit import repeat
+from csv_to_json import compressed
+from csv_to_json.compressed import open_file
+from csv_to_json.transformers import AllergyToJson
+from .generate import generate
+
+CODECS = [("", None), (".gz", 1), (".gz", 6), (".bz2", 9), (".zst", 3)]
+
+def main():
+    size = float(sys.argv[1]) if len(sys.argv) > 1 else 10
+    codecs = [(ext, level) for ext, level in CODECS if ext != ".zst" or compressed.zstd is not None]
+    workdir = tempfile.mkdtemp(prefix="csv_to_json_bench")
+    try:
+        src = os.path.join(workdir, "allergy.csv")
+        rows = generate(src, "allergy", int(size * 1024 * 1024), 0.1, 2, 3)
+        csv_size = os.path.getsize(src)
+        transformer = AllergyToJson()
+
+        print(f"rows: {rows} ({csv_size / 1024 / 1024:.1f} MB)")
+        for ext, level in codecs:
+            path = src + ext
+            if ext:
+                with open(src, "rb") as f_csv, open_file(path, "wb", level) as f_out:
+                    shutil.copyfileobj(f_csv, f_out)
+            dest = os.path.join(workdir, "allergy.json" + ext)
+
+            secs = min(repeat(lambda: transformer.convert_file(path, dest, level=level), number=1, repeat=3))
+            name = f"{ext[1:]} {level}" if ext else "plain"
+            print(f"{name}: {secs:.3f}s ({rows / secs:,.0f} rows/s, {csv_size / secs / 1024 / 1024:.1f} MB/s) "
+                f"csv {os.path.getsize(path) / 1024 / 1024:.1f} MB, json {os.path.getsize(dest) / 1024 / 1024:.1f} MB")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
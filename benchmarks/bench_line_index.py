@@ -0,0 +1,55 @@
+""" Line index benchmark
+
+    Times re-extracting a few rows from the end of a generated allergy CSV by streaming
+the whole file against seeking through the line index (see csv_to_json/line_index.py),
+for a line range and for a patient. The time to build the index is reported alongside.
+
+    python -m benchmarks.bench_line_index [size MB]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+from itertools import islice
+from csv_to_json.csv_reader import mmap_reader
+from csv_to_json.csv_transfomer import person_key
+from csv_to_json.line_index import index_file, select_lines, select_people
+from csv_to_json.transformers import AllergyToJson
+from .generate import generate
+
+def best(fn, repeat: int = 3) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def main():
+    size = float(sys.argv[1]) if len(sys.argv) > 1 else 50
+    workdir = tempfile.mkdtemp(prefix="csv_to_json_bench")
+    try:
+        src = os.path.join(workdir, "allergy.csv")
+        rows = generate(src, "allergy", int(size * 1024 * 1024), 0.1, 2, 3)
+        transformer = AllergyToJson()
+        first = rows - 100
+        patient = transformer.transform(next(islice(mmap_reader(src, 19), first, None)))["patient"]
+        key = person_key({"patient": patient})
+
+        secs = best(lambda: index_file(src, transformer), 1)
+        print(f"{rows} rows, index built in {secs:.2f}s ({os.path.getsize(src + '.index.json') / 1024:.0f}KB)")
+
+        stream = best(lambda: list(islice(mmap_reader(src, 19), first, first + 100)))
+        seek = best(lambda: list(select_lines(transformer, src, first + 2, first + 101)))
+        print(f"100 lines: streamed {stream * 1000:.1f}ms, indexed {seek * 1000:.2f}ms ({stream / seek:.0f}x)")
+
+        transform = transformer.transform
+        stream = best(lambda: [row for row in mmap_reader(src, 19) if person_key(transform(row)) == key])
+        seek = best(lambda: list(select_people(transformer, src, [patient])))
+        print(f"patient: streamed {stream * 1000:.1f}ms, indexed {seek * 1000:.2f}ms ({stream / seek:.0f}x)")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
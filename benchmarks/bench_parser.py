@@ -0,0 +1,49 @@
+""" Line parser benchmark
+
+    Compares the nested split_escaped / parse_fields passes against the single pass
+parse_line tokenizer using the sample rows in tests/resources, along with the
+str.split fast path taken by lines without quotes.
+
+    python -m benchmarks.bench_parser [repeat]
+"""
+import sys
+from timeit import repeat
+from csv_to_json.csv_reader import parse_fields, parse_line, split_escaped, split_line
+
+RESOURCES = ["tests/resources/allergy.csv", "tests/resources/problem.csv", "tests/resources/test_csv_reader.csv"]
+
+def nested(line: str):
+    """ The original nested parse """
+    return list(map(parse_fields, split_escaped(line, ",")))
+
+def load_lines():
+    lines = []
+    for path in RESOURCES:
+        with open(path) as f:
+            lines.extend(line.rstrip("\n") for line in f)
+    return lines
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    lines = load_lines()
+
+    def run(parse):
+        return min(repeat(lambda: [parse(line) for line in lines], number=number, repeat=3))
+
+    base, single = run(nested), run(parse_line)
+    rows = number * len(lines)
+    print(f"rows: {rows}")
+    print(f"nested split_escaped: {base:.3f}s ({rows / base:,.0f} rows/s)")
+    print(f"single pass parse_line: {single:.3f}s ({rows / single:,.0f} rows/s)")
+    print(f"speedup: {base / single:.2f}x")
+
+    lines = [line.replace("\"", "") for line in lines]
+    base, single, fast = run(nested), run(parse_line), run(split_line)
+    print("without quotes")
+    print(f"nested split_escaped: {base:.3f}s ({rows / base:,.0f} rows/s)")
+    print(f"single pass parse_line: {single:.3f}s ({rows / single:,.0f} rows/s)")
+    print(f"fast path split_line: {fast:.3f}s ({rows / fast:,.0f} rows/s)")
+    print(f"speedup: {base / fast:.2f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+""" Row representation benchmark
+
+    Reads a synthetic allergy CSV (see generate.py) with the default reader, the
+interning reader and tuple rows, reporting the throughput of streaming the rows
+(parse + transform) and the peak RSS of keeping them all in memory. Each variant runs
+in its own process so the peak RSS isn't shared.
+
+    python -m benchmarks.bench_rows [size MB]
+"""
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple
+from csv_to_json.csv_reader import reader
+from csv_to_json.transformers import AllergyToJson
+from .generate import generate
+
+VARIANTS = ["lists", "interned", "tuples"]
+
+def rows(path: str, variant: str):
+    """ The rows of the CSV for the variant """
+    r = reader(path, 19)
+    if variant == "interned":
+        return r.intern()
+    if variant == "tuples":
+        return (tuple(tuple(map(tuple, f)) for f in row) for row in r)
+    return r
+
+def run(path: str, variant: str) -> Tuple[float, int, int]:
+    """ Worker: the seconds to stream the rows, the row count and peak RSS (KB) once kept """
+    transform = AllergyToJson().transform
+    start = time.perf_counter()
+    cnt = 0
+    for row in rows(path, variant):
+        transform(row)
+        cnt += 1
+    secs = time.perf_counter() - start
+
+    kept: List = list(rows(path, variant))
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    del kept
+    return secs, cnt, rss
+
+def main():
+    size = float(sys.argv[1]) if len(sys.argv) > 1 else 20
+    workdir = tempfile.mkdtemp(prefix="csv_to_json_bench")
+    try:
+        path = os.path.join(workdir, "allergy.csv")
+        generate(path, "allergy", int(size * 1024 * 1024), 0.1, 2, 3)
+        base = None
+        for variant in VARIANTS:
+            with ProcessPoolExecutor(1) as pool:
+                secs, cnt, rss = pool.submit(run, path, variant).result()
+            base = base or secs
+            print(f"{variant}: {secs:.3f}s ({cnt / secs:,.0f} rows/s, {base / secs:.2f}x) "
+                f"peak RSS {rss / 1024:.0f} MB")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+""" Compiled parsing benchmark
+
+    Parses a synthetic allergy CSV (see generate.py) with the pure Python and the
+compiled (_speedups.pyx, python setup.py build_ext --inplace) line parsing, reporting
+the throughput of parse_row alone and of the reader (reading + parsing).
+
+    python -m benchmarks.bench_speedups [size MB]
+"""
+import os
+import shutil
+import sys
+import tempfile
+from timeit import repeat
+from csv_to_json import csv_reader
+from csv_to_json.csv_reader import PURE, reader
+from .generate import generate
+
+def best(func) -> float:
+    return min(repeat(func, number=1, repeat=3))
+
+def main():
+    size = float(sys.argv[1]) if len(sys.argv) > 1 else 20
+    try:
+        from csv_to_json import _speedups
+    except ImportError:
+        sys.exit("The compiled parsing isn't built (python setup.py build_ext --inplace)")
+
+    workdir = tempfile.mkdtemp(prefix="csv_to_json_bench")
+    try:
+        path = os.path.join(workdir, "allergy.csv")
+        rows = generate(path, "allergy", int(size * 1024 * 1024), 0.1, 2, 3)
+        with open(path) as f:
+            lines = f.readlines()
+
+        base = None
+        for name, parse_row in [("pure", PURE["parse_row"]), ("compiled", _speedups.parse_row)]:
+            parse = best(lambda: [parse_row(line, 19) for line in lines])
+            csv_reader.parse_row = parse_row
+            read = best(lambda: sum(1 for _ in reader(path, 19)))
+            base = base or read
+            print(f"{name}: parse_row {rows / parse:,.0f} rows/s, reader {rows / read:,.0f} rows/s "
+                f"({base / read:.2f}x)")
+        csv_reader.parse_row = _speedups.parse_row
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
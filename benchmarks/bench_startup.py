@@ -0,0 +1,64 @@
+""" Start up benchmark
+
+    Times converting small CSV files (the test resources) with a transform.py process
+per file (cold start) against the persistent service (transform.py --serve) started
+once and sent a job per file. The import time of the package is reported alongside
+the bare interpreter start up.
+
+    python -m benchmarks.bench_startup [files]
+"""
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from csv_to_json.daemon import submit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPT = os.path.join(ROOT, "transform.py")
+RESOURCE = os.path.join(ROOT, "tests", "resources", "allergys.csv")
+
+def timed(cmd) -> float:
+    start = time.perf_counter()
+    subprocess.run(cmd, check=True, cwd=ROOT)
+    return time.perf_counter() - start
+
+def main():
+    files = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    workdir = tempfile.mkdtemp(prefix="csv_to_json_bench")
+    try:
+        in_dir, out_dir = os.path.join(workdir, "in"), os.path.join(workdir, "out")
+        os.makedirs(in_dir)
+        os.makedirs(out_dir)
+
+        python = min(timed([sys.executable, "-c", "pass"]) for _ in range(10))
+        imports = min(timed([sys.executable, "-c", "import csv_to_json.transformers"]) for _ in range(10))
+        print(f"python start up: {python * 1000:.1f}ms, package import: {(imports - python) * 1000:.1f}ms")
+
+        secs = 0.0
+        for i in range(files):
+            shutil.copy(RESOURCE, os.path.join(in_dir, f"allergy{i}.csv"))
+            secs += timed([sys.executable, SCRIPT, "ALLERGY", in_dir, out_dir])
+        print(f"process per file: {secs / files * 1000:.1f}ms per file")
+
+        sock = os.path.join(workdir, "csv_to_json.sock")
+        server = subprocess.Popen([sys.executable, SCRIPT, "ALLERGY", in_dir, out_dir, "--serve", sock], cwd=ROOT)
+        try:
+            while not os.path.exists(sock):
+                time.sleep(0.01)
+            secs = 0.0
+            for i in range(files):
+                shutil.copy(RESOURCE, os.path.join(in_dir, f"allergy{i}.csv"))
+                start = time.perf_counter()
+                submit(sock, f"allergy{i}.csv")
+                secs += time.perf_counter() - start
+            print(f"service: {secs / files * 1000:.2f}ms per file")
+        finally:
+            server.terminate()
+            server.wait()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+""" JSON writer benchmark
+
+    Compares the original json.dumps writer (two writes per record) against the
+buffered writer using the stdlib and orjson (when installed) backends.
+
+    python -m benchmarks.bench_writer [records]
+"""
+import io
+import json
+import sys
+from timeit import repeat
+from csv_to_json.csv_reader import reader
+from csv_to_json.json_writer import JsonWriter, load_orjson
+from csv_to_json.transformers import AllergyToJson
+
+def dumps_writer(records, f):
+    """ The original writer """
+    write, dumps = f.write, json.dumps
+    it = iter(records)
+    write(dumps(next(it)))
+    for record in it:
+        write("\n")
+        write(dumps(record))
+
+def load_records(cnt: int):
+    transformer = AllergyToJson()
+    with open("tests/resources/allergy.csv") as f:
+        record = transformer.transform(next(reader(f, 19)))
+    return [record] * cnt
+
+def main():
+    cnt = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    records = load_records(cnt)
+
+    def run(write):
+        return min(repeat(lambda: write(records, io.StringIO()), number=1, repeat=3))
+
+    results = [("json.dumps", run(dumps_writer)),
+        ("buffered json", run(lambda r, f: JsonWriter(f).write(r)))]
+    if load_orjson() is not None:
+        results.append(("buffered orjson", run(lambda r, f: JsonWriter(f, backend="orjson").write(r))))
+
+    base = results[0][1]
+    print(f"records: {cnt}")
+    for name, secs in results:
+        print(f"{name}: {secs:.3f}s ({cnt / secs:,.0f} records/s, {base / secs:.2f}x)")
+
+if __name__ == "__main__":
+    main()
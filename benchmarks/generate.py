@@ -0,0 +1,115 @@
+""" Synthetic CSV generator
+
+    Writes allergy / problem CSVs of roughly the requested size. The rows are built
+from the record type's schema so every column gets a value of the right shape.
+
+    - quotes: fraction of the text subfields that are quoted and contain delimiters
+    - repeats: number of repeats (~) in the repeating fields (ids, reactions, comments...)
+    - cluster: number of consecutive rows for each patient (combined in combine mode)
+
+    python -m benchmarks.generate allergy allergy.csv --size 100 --quotes 0.1 --repeats 2 --cluster 3
+"""
+import argparse
+import random
+from typing import Dict, List
+from csv_to_json.schema import load_schema
+
+SUBFIELDS = {
+    "string": 1,
+    "code": 3,
+    "codes": 3,
+    "ids": 3,
+    "name": 3,
+    "physician": 5,
+    "reactions": 6,
+    "comments": 6,
+}
+
+# Converters with repeating values
+REPEATING = ("codes", "ids", "reactions", "comments")
+
+WORDS = ["Amoxicillin", "Penicillin", "Hospital MRN", "SNOMED", "Active", "Severe", "Chronic",
+    "Abdominal swelling", "ER visit", "Gould M.D.", "NPI", "RXCUI", "20180724", "19500701143000"]
+QUOTED = ["\"swelling to \"\"chest\"\", head\"", "\"since ~fall 2010, periodic|persistent\"",
+    "\"Bad, swelling\"", "\"a~b|c\""]
+
+class Generator:
+    """ Generates the CSV lines for a record type """
+
+    def __init__(self, record_type: str, quotes: float = 0.0, repeats: int = 2, cluster: int = 1, seed: int = 0):
+        self.schema = load_schema(record_type)
+        self.quotes = quotes
+        self.repeats = repeats
+        self.cluster = cluster
+        self.random = random.Random(seed)
+        self.converters = dict((c.index, c.converter) for c in self.schema.columns)
+
+    def text(self) -> str:
+        """ A subfield, quoted (containing delimiters) for the quote density """
+        rnd = self.random
+        if self.quotes and rnd.random() < self.quotes:
+            return rnd.choice(QUOTED)
+        return rnd.choice(WORDS)
+
+    def field(self, converter: str) -> str:
+        """ A field of the converter's shape """
+        text = self.text
+        cnt = self.repeats if converter in REPEATING else 1
+        subfields = SUBFIELDS.get(converter, 1)
+        return "~".join("|".join(text() for _ in range(subfields)) for _ in range(cnt))
+
+    def patient(self, i: int) -> Dict[int, str]:
+        """ The patient fields (the combine key) """
+        return {
+            1: f"{i}|Hospital MRN|MRN",
+            2: f"ZZLast{i}|Jane|Marie",
+            3: "19500701143000",
+            4: "362|Female"
+        }
+
+    def line(self, seq: int) -> str:
+        """ The CSV line of the sequence number (starting at 1) """
+        field, converters = self.field, self.converters
+        patient = self.patient((seq - 1) // self.cluster)
+        row: List[str] = [str(seq)]
+        for i in range(1, self.schema.fields):
+            if i in patient:
+                row.append(patient[i])
+            elif i in converters:
+                row.append(field(converters[i]))
+            else:
+                row.append("")
+        return ",".join(row)
+
+def generate(path: str, record_type: str, size: int, quotes: float = 0.0, repeats: int = 2,
+        cluster: int = 1, seed: int = 0) -> int:
+    """ Writes a CSV of roughly the size (bytes) returning the number of rows """
+    line = Generator(record_type, quotes, repeats, cluster, seed).line
+    rows = written = 0
+    with open(path, "w", newline="\n") as f:
+        write = f.write
+        write("SEQ|" + record_type.upper() + "\n")
+        while written < size:
+            rows += 1
+            data = line(rows) + "\n"
+            write(data)
+            written += len(data)
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description="Synthetic CSV generator")
+    parser.add_argument("type", help="record type (allergy, problem)")
+    parser.add_argument("path", help="CSV file to write")
+    parser.add_argument("--size", type=float, default=10, help="size (MB) of the CSV")
+    parser.add_argument("--quotes", type=float, default=0.1, help="fraction of quoted subfields")
+    parser.add_argument("--repeats", type=int, default=2, help="repeats in the repeating fields")
+    parser.add_argument("--cluster", type=int, default=1, help="consecutive rows per patient")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    args = parser.parse_args()
+
+    rows = generate(args.path, args.type.lower(), int(args.size * 1024 * 1024), args.quotes, args.repeats,
+        args.cluster, args.seed)
+    print(f"rows: {rows}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+""" Benchmark suite
+
+    Generates synthetic allergy / problem CSVs (see generate.py) and times each stage
+on its own: the reader, the transformer, the JSON writer and transform.py end to end,
+in identity and combine mode (along with the columnar and memoized transforms). The
+results are written as JSON so runs on different commits can be compared. The overhead
+of validating the rows (the median of the validated / text reader ratios timed in
+alternation, so timing noise hits both) is checked against a budget.
+
+    python -m benchmarks.suite --size 20 --output results.json
+    python -m benchmarks.suite --size 20 --compare results.json
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List
+from csv_to_json.csv_reader import reader, mmap_reader
+from csv_to_json.json_writer import JsonWriter
+from csv_to_json.transformers import AllergyToJson, ProblemToJson
+from csv_to_json.validation import ValidatingReader
+
+TRANSFORMERS = {
+    "allergy": AllergyToJson,
+    "problem": ProblemToJson,
+}
+
+MODES = ("identity", "combine")
+
+# Columnar engine batch size
+BATCH_SIZE = 64
+# Memoized transform LRU entries
+MEMO_SIZE = 1024
+# Validated reader slowdown (vs the text reader) reported as a regression
+VALIDATE_BUDGET = 0.15
+# Alternated text | validated reader runs (the overhead is their median ratio)
+VALIDATE_ROUNDS = 9
+
+def best(fn: Callable[[], object], repeat: int) -> float:
+    """ The best time (seconds) of the repeated runs """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def overhead(fn: Callable[[], object], base: Callable[[], object], rounds: int) -> float:
+    """ The median slowdown of fn against base, timed in alternation """
+    ratios = []
+    for _ in range(rounds):
+        base_secs = best(base, 1)
+        ratios.append(best(fn, 1) / base_secs - 1)
+    return statistics.median(ratios)
+
+def result(stage: str, record_type: str, mode: str, secs: float, rows: int, size: int) -> Dict:
+    return {
+        "stage": stage,
+        "type": record_type,
+        "mode": mode,
+        "seconds": round(secs, 6),
+        "rows": rows,
+        "rows_per_sec": round(rows / secs, 1) if secs else None,
+        "mb_per_sec": round(size / secs / 1024 / 1024, 3) if secs else None
+    }
+
+def commit() -> str:
+    """ The current git commit (if any) """
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+            check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+def end_to_end(record_type: str, src: str, combine: bool, workdir: str) -> float:
+    """ Times transform.py converting the CSV (transform.py removes the CSV so a copy is used) """
+    in_dir, out_dir = os.path.join(workdir, "in"), os.path.join(workdir, "out")
+    for d in (in_dir, out_dir):
+        shutil.rmtree(d, ignore_errors=True)
+        os.makedirs(d)
+    shutil.copy(src, in_dir)
+
+    script = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "transform.py")
+    cmd = [sys.executable, script, record_type, in_dir, out_dir] + (["-C"] if combine else [])
+    start = time.perf_counter()
+    subprocess.run(cmd, check=True)
+    return time.perf_counter() - start
+
+def run(size: int, repeat: int, quotes: float, repeats: int, cluster: int, seed: int) -> List[Dict]:
+    """ Runs the benchmarks for both record types """
+    from .generate import generate
+
+    results = []
+    workdir = tempfile.mkdtemp(prefix="csv_to_json_bench")
+    try:
+        for record_type, transformer in TRANSFORMERS.items():
+            src = os.path.join(workdir, f"{record_type}.csv")
+            rows = generate(src, record_type, size, quotes, repeats, cluster, seed)
+            field_cnt = getattr(transformer, "__fields__")
+            nbytes = os.path.getsize(src)
+
+            def read():
+                with open(src) as f:
+                    return list(reader(f, field_cnt))
+            results.append(result("reader", record_type, "text", best(read, repeat), rows, nbytes))
+            results.append(result("reader", record_type, "mmap",
+                best(lambda: list(mmap_reader(src, field_cnt)), repeat), rows, nbytes))
+            required = transformer().required_fields()
+
+            def validated():
+                with open(src) as f:
+                    return list(ValidatingReader(reader(f, field_cnt), required, lambda *_: None))
+            results.append(dict(result("reader", record_type, "validated", best(validated, repeat), rows, nbytes),
+                overhead=round(overhead(validated, read, VALIDATE_ROUNDS), 4)))
+
+            parsed = read()
+            columnar = transformer(batch_size=BATCH_SIZE)
+            secs = best(lambda: list(columnar.transformation(iter(parsed))), repeat)
+            results.append(result("transform", record_type, "columnar", secs, rows, nbytes))
+            memoized = transformer(memo_size=MEMO_SIZE)
+            secs = best(lambda: list(memoized.transformation(iter(parsed))), repeat)
+            results.append(result("transform", record_type, "memo", secs, rows, nbytes))
+            for mode in MODES:
+                trans = transformer(combine=mode == "combine")
+                secs = best(lambda: list(trans.transformation(iter(parsed))), repeat)
+                results.append(result("transform", record_type, mode, secs, rows, nbytes))
+
+                records = list(trans.transformation(iter(parsed)))
+                secs = best(lambda: JsonWriter(io.StringIO()).write(records), repeat)
+                results.append(result("json", record_type, mode, secs, len(records), nbytes))
+
+                secs = min(end_to_end(record_type, src, mode == "combine", workdir) for _ in range(repeat))
+                results.append(result("end_to_end", record_type, mode, secs, rows, nbytes))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+def compare(results: List[Dict], baseline: List[Dict], threshold: float) -> List[str]:
+    """ Compares the results to the baseline returning the regressions (slower than the threshold) """
+    base = dict(((r["stage"], r["type"], r["mode"]), r["seconds"]) for r in baseline)
+    regressions = []
+    for r in results:
+        key = (r["stage"], r["type"], r["mode"])
+        if key in base and base[key]:
+            ratio = r["seconds"] / base[key]
+            print(f"{' '.join(key)}: {base[key]:.3f}s -> {r['seconds']:.3f}s ({ratio:.2f}x)", file=sys.stderr)
+            if ratio > 1 + threshold:
+                regressions.append(" ".join(key))
+    return regressions
+
+def validation_overhead(results: List[Dict], budget: float) -> List[str]:
+    """ The record types whose validated reader is slower than the text reader by more than
+    the budget (the median overhead, see overhead) """
+    over = []
+    for r in results:
+        if r["stage"] == "reader" and r["mode"] == "validated":
+            print(f"{r['type']} validation overhead: {r['overhead']:.1%}", file=sys.stderr)
+            if r["overhead"] > budget:
+                over.append(f"reader {r['type']} validated")
+    return over
+
+def main():
+    parser = argparse.ArgumentParser(description="CSV to JSON benchmark suite")
+    parser.add_argument("--size", type=float, default=10, help="size (MB) of each generated CSV")
+    parser.add_argument("--repeat", type=int, default=3, help="runs of each benchmark (best is kept)")
+    parser.add_argument("--quotes", type=float, default=0.1, help="fraction of quoted subfields")
+    parser.add_argument("--repeats", type=int, default=2, help="repeats in the repeating fields")
+    parser.add_argument("--cluster", type=int, default=3, help="consecutive rows per patient")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument("--output", help="file to write the JSON results to (default stdout)")
+    parser.add_argument("--compare", help="JSON results to compare against")
+    parser.add_argument("--threshold", type=float, default=0.1, help="slowdown reported as a regression")
+    parser.add_argument("--validate-budget", type=float, default=VALIDATE_BUDGET,
+        help="validation overhead (vs the text reader) reported as a regression")
+    args = parser.parse_args()
+
+    report = {
+        "commit": commit(),
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "params": {"size_mb": args.size, "quotes": args.quotes, "repeats": args.repeats,
+            "cluster": args.cluster, "seed": args.seed},
+        "results": run(int(args.size * 1024 * 1024), args.repeat, args.quotes, args.repeats, args.cluster,
+            args.seed)
+    }
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    regressions = validation_overhead(report["results"], args.validate_budget)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions += compare(report["results"], json.load(f)["results"], args.threshold)
+    if regressions:
+        print(f"regressions: {', '.join(regressions)}", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
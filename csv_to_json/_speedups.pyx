@@ -0,0 +1,77 @@
+# cython: language_level=3, boundscheck=False, wraparound=False, profile=False
+""" Compiled CSV Line Parsing
+
+    Optional C implementation of the line parsing of csv_reader.py, built by setup.py
+when Cython is available (csv_reader falls back to the pure Python functions otherwise).
+The lines are scanned once with a C level character loop, quoted or not, slicing the
+subfields as the delimiters are found. The rows are identical to the pure Python
+parse_line / split_line / parse_row. """
+from cpython.list cimport PyList_Append
+
+cdef inline str _strip_quotes(str data):
+    """ Removes escape quotes from the data (see csv_reader.strip_quotes) """
+    cdef Py_ssize_t n = len(data)
+    if n and data[0] == u'"' and data[n - 1] == u'"':
+        return data[1:n - 1].replace(u'""', u'"')
+    return data
+
+cdef list _parse(str line, Py_ssize_t end):
+    """ Parses the first end characters of the line into its fields, repeats and subfields """
+    cdef list row = [], field = [], repeat = []
+    cdef Py_ssize_t i, pos = 0, rep = 0
+    cdef bint escape = False, quoted = False
+    cdef Py_UCS4 c
+    cdef str sub
+
+    for i in range(end):
+        c = line[i]
+        if c == u'"':
+            escape = not escape
+            quoted = True
+            continue
+        if escape or (c != u',' and c != u'|' and c != u'~'):
+            continue
+
+        sub = line[pos:i]
+        PyList_Append(repeat, _strip_quotes(sub) if quoted else sub)
+        pos, quoted = i + 1, False
+        if c == u'|':
+            continue
+
+        # Empty repeats are dropped
+        if i != rep:
+            PyList_Append(field, repeat)
+        repeat = []
+        rep = pos
+        if c == u',':
+            PyList_Append(row, field)
+            field = []
+
+    sub = line[pos:end]
+    PyList_Append(repeat, _strip_quotes(sub) if quoted else sub)
+    if end != rep:
+        PyList_Append(field, repeat)
+    PyList_Append(row, field)
+    return row
+
+def parse_line(str line):
+    """ Parses a csv line into its fields, repeats and subfields """
+    return _parse(line, len(line))
+
+def split_line(str line):
+    """ Parses a csv line that doesn't contain any quotes (the same loop as parse_line) """
+    return _parse(line, len(line))
+
+def parse_row(str line, Py_ssize_t field_cnt):
+    """ Parses the csv line (line ending included) into a row padded to the field count """
+    cdef Py_ssize_t end = len(line)
+    cdef list row
+    if end and (line[end - 1] == u'\n' or line[end - 1] == u'\r'):
+        end -= 1
+        if end and (line[end - 1] == u'\n' or line[end - 1] == u'\r') and line[end - 1] != line[end]:
+            end -= 1
+
+    row = _parse(line, end)
+    while len(row) < field_cnt:
+        PyList_Append(row, [])
+    return row
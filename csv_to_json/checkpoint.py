@@ -0,0 +1,97 @@
+""" Checkpointed CSV Transformation
+
+    Files are converted in line aligned segments (person aligned when combining, see
+parallel.chunk_ranges) appended to a temp file next to the JSON file. After each
+segment the temp file is synced and the manifest records the source offset, the
+records and the size of the temp file written so far. A failed run resumes from the
+last segment recorded (the temp file truncated to its recorded size). Once converted
+the temp file is renamed to the JSON file.
+
+    The manifest also keeps the content hash of each converted file so unchanged
+files (ex. when the CSV files aren't removed) are skipped.
+
+    Compressed JSON files are appended one compressed member | frame per segment, a
+valid gzip / bz2 / zstd stream. """
+import hashlib
+import json
+import os
+from typing import Dict, Optional
+from .compressed import compression, strip_compression, open_file
+from .csv_reader import reader, range_reader
+from .csv_transfomer import CsvToJson
+from .parallel import CHUNK_SIZE, chunk_ranges
+
+MANIFEST = ".csv_to_json.manifest.json"
+
+def file_hash(path: str, block_size: int = 1024 * 1024) -> str:
+    """ The sha256 of the file's content """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _sync(path: str) -> None:
+    """ Flushes the file to disk """
+    fd = os.open(path, os.O_RDWR)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+class Manifest:
+    """ The conversion state of each CSV file, saved atomically on update """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.entries: Dict[str, Dict] = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.entries = json.load(f)
+
+    def get(self, src: str) -> Optional[Dict]:
+        return self.entries.get(src)
+
+    def update(self, src: str, entry: Dict) -> None:
+        self.entries[src] = entry
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.entries, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+def convert_checkpointed(transformer: CsvToJson, src: str, dest: str, manifest: Manifest,
+        segment_size: int = CHUNK_SIZE, level: Optional[int] = None) -> bool:
+    """ Converts the CSV file to the JSON file resuming a previous (failed) conversion.
+    Returns False when skipped since the file was already converted """
+    digest, tmp = file_hash(src), "".join([strip_compression(dest), ".tmp", compression(dest)])
+    entry = manifest.get(src)
+    if entry is None or entry["hash"] != digest or entry["dest"] != dest:
+        entry = {"dest": dest, "hash": digest, "status": "partial", "offset": 0, "records": 0, "output_size": 0}
+    elif entry["status"] == "done" and os.path.exists(dest):
+        return False
+    elif entry["status"] != "partial" or not os.path.exists(tmp) or os.path.getsize(tmp) < entry["output_size"]:
+        entry = dict(entry, status="partial", offset=0, records=0, output_size=0)
+
+    with open(tmp, "ab") as f:
+        f.truncate(entry["output_size"])
+
+    offset, field_cnt, stats = entry["offset"], getattr(transformer, "__fields__"), transformer.stats
+    files = stats.files if stats is not None else 0
+    ranges = [(start, end) for start, end in chunk_ranges(transformer, src, segment_size) if end > offset]
+    for start, end in ranges:
+        start = max(start, offset)
+        rows = reader(src, field_cnt) if compression(src) else range_reader(src, field_cnt, start, end)
+        with open_file(tmp, "a", level) as f_json:
+            records = transformer.rows_to_json(rows, f_json, entry["records"])
+        _sync(tmp)
+        entry = dict(entry, offset=end, records=records, output_size=os.path.getsize(tmp))
+        manifest.update(src, entry)
+
+    os.replace(tmp, dest)
+    manifest.update(src, dict(entry, status="done"))
+    if stats is not None:
+        # Each segment is counted as a file by rows_to_json, the file is counted once
+        stats.files = files + 1
+    return True
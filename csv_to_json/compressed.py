@@ -0,0 +1,59 @@
+""" Compressed Files
+
+    Files are (de)compressed by extension while streaming: gzip (.gz), bz2 (.bz2) and
+zstd (.zst) when a zstd module is available (compression.zstd on Python 3.14+ or
+zstandard). Files without a compression extension are opened as is. """
+from typing import IO, Optional
+
+try:
+    from compression import zstd
+except ImportError:
+    try:
+        import zstandard as zstd
+    except ImportError:
+        zstd = None
+
+EXTENSIONS = (".gz", ".bz2", ".zst")
+
+def compression(path: str) -> str:
+    """ The compression extension of the path ("" when not compressed) """
+    for ext in EXTENSIONS:
+        if path.endswith(ext):
+            return ext
+    return ""
+
+def strip_compression(path: str) -> str:
+    """ The path without its compression extension """
+    ext = compression(path)
+    return path[:-len(ext)] if ext else path
+
+def open_file(path: str, mode: str = "r", level: Optional[int] = None) -> IO:
+    """ Opens the file (de)compressing by extension. The level only applies when
+    writing a compressed file (the codec's default when not specified). Text files are
+    written as UTF-8 (read in the locale's encoding) """
+    ext = compression(path)
+    encoding = "utf-8" if "b" not in mode and ("w" in mode or "a" in mode) else None
+    if not ext:
+        return open(path, mode, encoding=encoding)
+    if ext == ".zst":
+        if zstd is None:
+            raise ValueError(f"zstd isn't available to open {path} (pip install zstandard)")
+        if "r" in mode or level is None:
+            return zstd.open(path, _text(mode), encoding=encoding)
+        # Only zstandard takes a compression context, compression.zstd (which also has a
+        # ZstdCompressor) takes the level
+        if zstd.__name__ == "zstandard":
+            return zstd.open(path, _text(mode), cctx=zstd.ZstdCompressor(level=level), encoding=encoding)
+        return zstd.open(path, _text(mode), level=level, encoding=encoding)
+
+    if ext == ".gz":
+        import gzip as codec
+    else:
+        import bz2 as codec
+    if level is None:
+        return codec.open(path, _text(mode), encoding=encoding)
+    return codec.open(path, _text(mode), compresslevel=level, encoding=encoding)
+
+def _text(mode: str) -> str:
+    """ The compressed file modes default to binary, the builtin open to text """
+    return mode if "b" in mode or "t" in mode else mode + "t"
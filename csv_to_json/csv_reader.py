@@ -1,8 +1,19 @@
 """ CSV Reader """
 # cython: profile=False
 
-from typing import Iterator, List, Dict, TextIO
+import locale
+import mmap
+import os
+import re
+from functools import partial
+from itertools import chain
+from typing import Iterator, List, Dict, Optional, TextIO, Union
 from abc import ABCMeta, abstractmethod
+from .compressed import open_file
+
+_TOKENS = re.compile(r'[",~|]')
+
+INTERN_SIZE = 64 * 1024
 
 class CsvReader(metaclass=ABCMeta):
     """ A simple CSV parser specific to our delimiters 
@@ -16,14 +27,57 @@ class CsvReader(metaclass=ABCMeta):
     def __init__(self, f: TextIO, field_cnt: int):
         self.f = f
         self.field_cnt = field_cnt 
+        self.fast_lines = 0
+        self.quoted_lines = 0
+        self.header = False
     
     def __iter__(self):
         return self
 
+    def parse(self, line: str) -> List[List[List[str]]]:
+        """ Parses the line (line ending included) into a row padded to the field count.
+
+            Lines without quotes take the str.split fast path, only lines containing 
+        a quote go through the escape aware parser. The lines taking each path are 
+        counted (fast_lines / quoted_lines). The compiled parsing (when built) scans
+        both in a single C loop. """
+        if "\"" in line:
+            self.quoted_lines += 1
+        else:
+            self.fast_lines += 1
+        return parse_row(line, self.field_cnt)
+
+    def intern(self, size: int = INTERN_SIZE) -> "CsvReader":
+        """ Interns the subfields of the parsed rows through a cache bounded to the size
+        (cleared once full). Repeated values (authorities, coding methods, etc.) then share
+        a single str which cuts the memory of rows kept around (~50% for the sample rows) 
+        at the cost of parsing speed (~2.5x slower), so its opt-in. """
+        parse, cache = self.parse, {}
+        setdefault = cache.setdefault
+
+        def interned(line: str) -> List[List[List[str]]]:
+            if len(cache) >= size:
+                cache.clear()
+            return intern_row(parse(line), setdefault)
+        self.parse = interned
+        return self
+
+    def first_line(self) -> int:
+        """ The line number (1 based) of the first row """
+        return 2 if self.header else 1
+
+    def close(self) -> None:
+        """ Closes the file read (files passed to the reader are left open) """
+
     @abstractmethod
     def __next__(self):
         raise StopIteration()
 
+    @abstractmethod
+    def bytes_read(self) -> int:
+        """ The number of bytes read from the file """
+        return 0
+
 def strip_quotes(data:str) -> str:
     """ Removes escape quotes from the data """
     return data[1:-1].replace("\"\"", "\"") if data.startswith("\"") and data.endswith("\"") else data
@@ -44,6 +98,77 @@ def parse_fields(field:str) -> List[List[str]]:
     """ Parses the fields from the csv field accounting for repeating fields along with subfields """
     return list(list(map(strip_quotes, split_escaped(i, "|"))) for i in split_escaped(field, "~") if i)
 
+def parse_line(line: str) -> List[List[List[str]]]:
+    """ Parses a csv line into its fields, repeats and subfields in a single pass.
+
+        Only the delimiter / quote positions are visited (found by the regex engine) 
+    which replaces the nested split_escaped / parse_fields passes. Produces the same 
+    rows as splitting the line on the field delimiter and calling parse_fields. """
+    row, field, repeat = [], [], []
+    append = repeat.append
+    pos = rep = 0
+    escape = quoted = False
+    for m in _TOKENS.finditer(line):
+        i = m.start()
+        c = line[i]
+        if c == "\"":
+            escape = not escape
+            quoted = True
+            continue
+        if escape:
+            continue
+
+        append(strip_quotes(line[pos:i]) if quoted else line[pos:i])
+        pos, quoted = i + 1, False
+        if c == "|":
+            continue
+
+        # Empty repeats are dropped
+        if i != rep:
+            field.append(repeat)
+        repeat = []
+        append = repeat.append
+        rep = pos
+        if c == ",":
+            row.append(field)
+            field = []
+
+    append(strip_quotes(line[pos:]) if quoted else line[pos:])
+    if len(line) != rep:
+        field.append(repeat)
+    row.append(field)
+    return row
+
+def split_line(line: str) -> List[List[List[str]]]:
+    """ Parses a csv line that doesn't contain any quotes. Without quotes there is 
+    nothing to escape so the (C level) str.split produces the same row as parse_line """
+    return [[r.split("|") for r in f.split("~") if r] for f in line.split(",")]
+
+def intern_row(row: List[List[List[str]]], setdefault) -> List[List[List[str]]]:
+    """ Replaces the subfields of the row with the cached (setdefault of the cache) equal str """
+    return [[list(map(setdefault, r, r)) for r in f] for f in row]
+
+def parse_row(line: str, field_cnt: int) -> List[List[List[str]]]:
+    """ Parses the csv line (line ending included) into a row padded to the field count """
+    if line.endswith("\n\r") or line.endswith("\r\n"):
+        line = line[:-2]
+    elif line.endswith("\n") or line.endswith("\r"):
+        line = line[:-1]
+
+    row = parse_line(line) if "\"" in line else split_line(line)
+    for _ in range(len(row), field_cnt):
+        row.append([])
+    return row
+
+# The pure Python parsing, parse_row (the readers' parsing) is replaced by the compiled
+# parsing (_speedups.pyx) when built
+PURE = {"parse_line": parse_line, "split_line": split_line, "parse_row": parse_row}
+try:
+    from ._speedups import parse_row
+    COMPILED = True
+except ImportError:
+    COMPILED = False
+
 def csv_to_dict(data: List[List], fields: List[str]) -> Dict[str, str]:
     """ Converts the raw csv column to a dict with the specified field names """
     try:
@@ -55,37 +180,121 @@ def csv_to_list(data: List[List], fields: List[str]) -> List[Dict[str, str]]:
     """ Converts the raw csv column to a list of dicts with the specified field names """
     return list(dict(zip(fields, f)) for f in data if f)
 
-def reader(f: TextIO, field_cnt: int) -> CsvReader:
+def reader(f: Union[str, TextIO], field_cnt: int) -> CsvReader:
     """ Replaces the native CSV reader since it strips quotes when the field 
     doesn't contain a comma... Disabling quoting breaks when the field does 
     contain a comma but fixes when the sub delimiters are present. 
     
         The header will be skipped if present in the CSV file. Looking for 
-    the SEQ header should be sufficient to skip
+    the SEQ header should be sufficient to skip. The first line is read ahead
+    instead of seeking back so streams (compressed files) can be read.
+
+        A path is opened (decompressing by extension, ex. .csv.gz) and closed
+    once read.
     """
-    inst = _CsvReaderImpl(f, field_cnt)
+    if isinstance(f, str):
+        f = open_file(f)
+        inst = _CsvReaderImpl(f, field_cnt)
+        inst.owned = True
+    else:
+        inst = _CsvReaderImpl(f, field_cnt)
 
-    pos = f.tell()
-    has_header = f.read(4).upper().startswith("SEQ|")
-    if has_header:
-       f.readline()
+    line = f.readline()
+    if line and not line.upper().startswith("SEQ|"):
+        inst.readline = partial(next, chain((line,), iter(f.readline, "")), "")
     else:
-        f.seek(pos)
+        inst.header = bool(line)
     return inst
 
+def mmap_reader(path: str, field_cnt: int) -> CsvReader:
+    """ Reads the CSV file through a memory map instead of the text layer. Lines are 
+    found on the mapped bytes and only decoded once located. The header will be 
+    skipped if present in the CSV file. """
+    return range_reader(path, field_cnt, 0, os.path.getsize(path))
+
+def range_reader(path: str, field_cnt: int, start: int, end: int) -> CsvReader:
+    """ Reads the rows of the lines starting within the byte range [start, end) of the 
+    memory mapped CSV file. The start must be aligned to the beginning of a line. The 
+    header is skipped when reading from the beginning of the file. """
+    m = map_file(path) if start < end else None
+    r = _MmapCsvReaderImpl(m, field_cnt, start, end if m is not None else start)
+    if m is not None:
+        m.seek(start)
+        if not start:
+            line = m.readline()
+            if not line.upper().startswith(b"SEQ|"):
+                m.seek(0)
+            else:
+                r.pos = len(line)
+                r.header = True
+    return r
+
+def map_file(path: str) -> Optional[mmap.mmap]:
+    """ Memory maps the file read only (empty files can't be mapped) """
+    with open(path, "rb") as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else None
+
 class _CsvReaderImpl(CsvReader):    
 
+    def __init__(self, f: TextIO, field_cnt: int):
+        super().__init__(f, field_cnt)
+        self.readline = f.readline
+        self.owned = False
+        self.closed_pos = 0
+
     def __next__(self):
-        line = self.f.readline()
+        line = self.readline()
         if not line:
+            self.close()
             raise StopIteration()
+        return self.parse(line)
 
-        if line.endswith("\n\r"):
-            line = line[:-2]
-        elif line.endswith("\n") or line.endswith("\r"):
-            line = line[:-1]
-        
-        row = list(map(parse_fields, split_escaped(line, ",")))
-        for _ in range(len(row), self.field_cnt):
-            row.append([])
-        return row
+    def close(self) -> None:
+        if self.owned and not self.f.closed:
+            self.closed_pos = self.bytes_read()
+            self.f.close()
+
+    def bytes_read(self) -> int:
+        """ The position of the underlying binary file (in memory text files count characters,
+        compressed files the decompressed bytes) """
+        try:
+            return getattr(self.f, "buffer", self.f).tell()
+        except (OSError, ValueError):
+            return self.closed_pos
+
+class _MmapCsvReaderImpl(CsvReader):
+    """ Reads the lines of a byte range from a memory mapped file, closing the map once
+    read. The delimiters are ASCII so lines are split on the mapped bytes and decoded 
+    whole (a single decode per line is cheaper than decoding each subfield) """
+
+    def __init__(self, m: mmap.mmap, field_cnt: int, start: int, end: int):
+        super().__init__(m, field_cnt)
+        self.start = start
+        self.pos = start
+        self.end = end
+        self.encoding = locale.getpreferredencoding(False)
+
+    def __next__(self):
+        line = self.f.readline() if self.pos < self.end else b""
+        if not line:
+            self.close()
+            raise StopIteration()
+        self.pos += len(line)
+        return self.parse(line.decode(self.encoding))
+
+    def close(self) -> None:
+        if self.f is not None and not self.f.closed:
+            self.f.close()
+            self.end = self.pos
+
+    def bytes_read(self) -> int:
+        return self.pos - self.start
+
+    def first_line(self) -> int:
+        """ The line number of the first row, counting the lines before the range start """
+        if not self.start:
+            return super().first_line()
+        lines, block = 1, 16 * 1024 * 1024
+        for pos in range(0, self.start, block):
+            lines += self.f[pos:min(pos + block, self.start)].count(b"\n")
+        return lines
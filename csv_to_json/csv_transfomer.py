@@ -1,8 +1,32 @@
-""" CSV Transformation Base """
-import json
+""" CSV Transformation Base
+
+    Besides converting CSV files to JSON files, the records are available in memory
+(no JSON round trip) through the same reader, transform and combine machinery:
+iter_records yields the records lazily, iter_batches yields lists of records (or
+columns, see to_columns) and aiter_records / aiter_batches are their async variants.
+
+    Only what a conversion needs is imported: grouping, sharding, stats and validation
+are imported when enabled (start up, see benchmarks/bench_startup.py). """
 from abc import ABCMeta, abstractmethod
-from typing import Union, List, Dict, TextIO
-from .csv_reader import reader, csv_to_list, csv_to_dict
+from contextlib import contextmanager
+from functools import partial
+from itertools import chain, islice
+from json import dumps
+from time import perf_counter
+from typing import TYPE_CHECKING, AsyncIterator, Callable, Hashable, Iterator, Optional, Union, List, Dict, TextIO
+from .compressed import compression, open_file
+from .csv_reader import CsvReader, reader, mmap_reader, csv_to_list, csv_to_dict
+from .json_writer import BUFFER_SIZE, JsonWriter
+
+if TYPE_CHECKING:
+    from .sharding import ShardWriter
+    from .stats import Stats
+
+# Records transformed per executor call by the async iterators
+ASYNC_BATCH_SIZE = 1024
+
+# Quarantine callback of the rejected rows (line number, error and line)
+Reject = Callable[[int, str, str], None]
 
 def is_same_person(trans: Dict, next_trans: Dict) -> bool:
     """ Whether the person is the same for both transformations """
@@ -11,6 +35,11 @@ def is_same_person(trans: Dict, next_trans: Dict) -> bool:
     return patient["name"] == next_patient["name"] and patient["birth_date"] == next_patient["birth_date"] and\
         patient["admin_sex"] == next_patient["admin_sex"]
 
+def person_key(trans: Dict) -> str:
+    """ The key of the person, equal for the transformations is_same_person matches """
+    patient = trans["patient"]
+    return dumps([patient["name"], patient["birth_date"], patient["admin_sex"]], sort_keys=True)
+
 def identity_transform(orig: Dict[str, str], org_key: str, dest: Dict) -> None:
     """ Identity transform from one field in a dict to another """
     try:
@@ -124,27 +153,98 @@ def transform_reactions(data: List[List], dest: Dict) -> None:
     if reactions:
         dest["reactions"] = reactions
 
+def to_columns(records: List[Dict]) -> Dict[str, List]:
+    """ The records as columns: the values of each top level key in record order (None
+    where a record doesn't have the key) """
+    columns: Dict[str, List] = {}
+    for i, record in enumerate(records):
+        for key, value in record.items():
+            column = columns.get(key)
+            if column is None:
+                column = columns[key] = [None] * len(records)
+            column[i] = value
+    return columns
+
+def _identity(trans: Dict) -> Dict:
+    return trans
+
+def _skip(line_no: int, error: str, line: str) -> None:
+    """ Drops the rejected row (counted by the stats) """
+
+def _stats() -> "Stats":
+    """ New stats (imported when enabled) """
+    from .stats import Stats
+    return Stats()
+
+def _tell(f: TextIO) -> int:
+    """ The position of the file (0 when it can't be determined) """
+    try:
+        return f.tell()
+    except (OSError, ValueError):
+        return 0
+
 class CsvToJson(metaclass=ABCMeta):
     """ Base CSV to JSON transformer """
 
-    def __init__(self, combine:bool = False):
-        self.transformation = self.__combine_transform if combine else self.__idenity_transform
+    def __init__(self, combine:bool = False, json_backend: str = "json", buffer_size: int = BUFFER_SIZE,
+            stats: bool = False, pipeline: bool = False, group: bool = False, group_budget: Optional[int] = None,
+            group_dir: Optional[str] = None, batch_size: int = 0, memo_size: int = 0, shard_records: int = 0,
+            shard_size: int = 0, validate: bool = False):
+        self.combined = combine or group
+        self.grouped = group
+        self.group_budget = group_budget
+        self.group_dir = group_dir
+        self.json_backend = json_backend
+        self.buffer_size = buffer_size
+        self.stats = _stats() if stats else None
+        self.pipelined = pipeline
+        self.batch_size = batch_size
+        self.memo_size = memo_size
+        self.shard_records = shard_records
+        self.shard_size = shard_size
+        self.validate = validate
+        self.transformation = self.__bind_transformation()
+
+    def __getstate__(self):
+        """ The bound transformation can't be pickled (process pools) so its rebound on load.
+        The stats are started over so the worker's metrics can be merged back """
+        state = self.__dict__.copy()
+        del state["transformation"]
+        if state["stats"] is not None:
+            state["stats"] = _stats()
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.transformation = self.__bind_transformation()
 
-    def __idenity_transform(self, r):
+    def __bind_transformation(self):
+        if self.grouped:
+            transformation = self.__group_transform
+        elif self.combined:
+            transformation = self.__keyed_combine_transform if self.__keyed() else self.__combine_transform
+        else:
+            transformation = self.__idenity_transform
+        return partial(self.__columnar_transform, transformation) if self.batch_size else transformation
+
+    def __idenity_transform(self, r, transform=None, combine=None):
         """ Performs an identity transformation where each row in the CSV will have a
             corresponding JSON record """
-        transform = self.transform
+        transform = transform or self.transform
 
         for fields in r:
             yield transform(fields)
 
-    def __combine_transform(self, r):
+    def __combine_transform(self, r, transform=None, combine=None):
         """ Performs an combine transformation where similar CSV records will be combined
             into a single JSON record """
-        transform = self.transform
-        combine = self.combine
+        transform = transform or self.transform
+        combine = combine or self.combine
 
-        trans = transform(next(r))
+        try:
+            trans = transform(next(r))
+        except StopIteration:
+            return
         for fields in r:
             _next = transform(fields)
             if not combine(trans, _next):                    
@@ -152,6 +252,99 @@ class CsvToJson(metaclass=ABCMeta):
                 trans = _next
         yield trans
 
+    def __keyed_combine_transform(self, r, transform=None, combine=None):
+        """ Performs a combine transformation matching the rows of a person on the key of their
+            raw fields (see row_key) so the rows merged into a record are only partially
+            transformed (see merge_row) """
+        transform = transform or self.transform
+        merge, row_key = combine or self.merge_row, self.row_key
+
+        trans = key = None
+        for fields in r:
+            next_key = row_key(fields)
+            if trans is None or next_key != key or not merge(trans, fields):
+                if trans is not None:
+                    yield trans
+                trans, key = transform(fields), next_key
+        if trans is not None:
+            yield trans
+
+    def __group_transform(self, r, transform=None, combine=None):
+        """ Performs a combine transformation where the records of a person are combined
+            into a single JSON record regardless of their order in the CSV (see grouping.py,
+            the group budget defaults to grouping.GROUP_BUDGET) """
+        from .grouping import GROUP_BUDGET, sort_records
+        transform = transform or self.transform
+        budget = self.group_budget if self.group_budget is not None else GROUP_BUDGET
+        records = sort_records(map(transform, r), person_key, budget, self.group_dir)
+        yield from self.__combine_transform(records, _identity, combine)
+
+    def __columnar_transform(self, transformation, r, transform=None, combine=None):
+        """ Transforms batches of rows column by column (see transform_batch) feeding the
+            records to the transformation (identity, combine or group) """
+        transform_batch, batch_size = self.transform_batch, self.batch_size
+        if self.stats is not None:
+            transform_batch = self.stats.transform_batch(transform_batch)
+        batches = iter(lambda: list(islice(r, batch_size)), [])
+        return transformation(chain.from_iterable(map(transform_batch, batches)), _identity, combine)
+
+    def transform_batch(self, rows: List[List[List[List[str]]]]) -> List[Dict]:
+        """ Transforms a batch of rows, row by row unless a columnar transform is provided """
+        return list(map(self.transform, rows))
+
+    @property
+    def keyed(self) -> bool:
+        """ Whether the rows of a person can be matched on their raw fields when combining
+        (see row_key and merge_row) """
+        return False
+
+    def __keyed(self) -> bool:
+        """ Whether the combine transformation is keyed (grouping and the columnar engine
+        combine the transformed records) """
+        return self.keyed and self.combined and not self.grouped and not self.batch_size
+
+    def row_key(self, fields: List[List[List[str]]]) -> Optional[Hashable]:
+        """ The key of the person of the raw row, equal for the rows combine would merge
+        (None when the rows can't be keyed) """
+        return None
+
+    def merge_row(self, trans: Dict, fields: List[List[List[str]]]) -> bool:
+        """ Merges the raw row of the same person into the record, transforming only what's
+        merged. Returns whether the row was merged (never unless keyed, the row is then
+        transformed and combined) """
+        return False
+
+    def required_fields(self) -> Dict[int, str]:
+        """ The fields (index: name) rows must have when validated """
+        return {}
+
+    @contextmanager
+    def validated(self, r: CsvReader, dest: Optional[str] = None,
+            quarantine: Union[TextIO, Reject, None] = None) -> Iterator[CsvReader]:
+        """ The reader validating the rows when enabled (see validation.py), the rejected
+        rows are quarantined next to the JSON file (dest), to the quarantine file or handed
+        to the quarantine callback (line number, error and line) """
+        if not self.validate:
+            yield r
+            return
+        if dest is None and quarantine is None:
+            raise ValueError("Validating needs the JSON path or a quarantine file for the rejected rows")
+        from .validation import Quarantine, ValidatingReader, quarantine_path
+        if dest is not None or not callable(quarantine):
+            quarantine = Quarantine(quarantine_path(dest) if dest is not None else quarantine)
+        validating = ValidatingReader(r, self.required_fields(), quarantine)
+        try:
+            yield validating
+        finally:
+            if isinstance(quarantine, Quarantine):
+                quarantine.close()
+            if self.stats is not None:
+                self.stats.rows_rejected += validating.rejected
+
+    def memo_info(self) -> Optional[Dict[str, int]]:
+        """ The hits, misses and entries of the memoized conversions (None unless memoized) """
+        return None
+
     @abstractmethod
     def transform(self, fields: List[List[str]]) -> Dict:
         """ Entity / Domain specific transformation """ 
@@ -162,15 +355,151 @@ class CsvToJson(metaclass=ABCMeta):
         """ Entity / Domain specific combine """ 
         return False
 
-    def csv_to_json(self, csv_file: TextIO, json_file: TextIO) -> None:
-        """ Converts the CSV to JSON """
-        write = json_file.write
-        dumps = json.dumps
+    def csv_reader(self, src: Union[str, TextIO], mmap: bool = False) -> CsvReader:
+        """ The reader of the CSV path (decompressed by extension, memory mapped unless
+        compressed when mmap) or file """
+        field_cnt = getattr(self, "__fields__")
+        if isinstance(src, str) and mmap and not compression(src):
+            return mmap_reader(src, field_cnt)
+        return reader(src, field_cnt)
+
+    def iter_records(self, src: Union[str, TextIO], mmap: bool = False,
+            quarantine: Optional[Reject] = None) -> Iterator[Dict]:
+        """ Transforms the CSV path or file yielding the records (combined, grouped, etc.
+        as configured) lazily. A path is closed once read or when the iterator is closed.
+        When validated the rejected rows are skipped (counted by the stats) or handed to
+        the quarantine callback (line number, error and line) """
+        r = self.csv_reader(src, mmap)
+        try:
+            with self.validated(r, quarantine=quarantine or _skip) as validated:
+                yield from self.__transformation(validated)
+        finally:
+            r.close()
+
+    def iter_batches(self, src: Union[str, TextIO], size: int, mmap: bool = False, columnar: bool = False,
+            quarantine: Optional[Reject] = None) -> Iterator[Union[List[Dict], Dict[str, List]]]:
+        """ Transforms the CSV path or file yielding lists of (up to) size records, or their
+        columns (see to_columns) when columnar (validated as iter_records) """
+        records = self.iter_records(src, mmap, quarantine)
+        try:
+            for batch in iter(lambda: list(islice(records, size)), []):
+                yield to_columns(batch) if columnar else batch
+        finally:
+            records.close()
+
+    async def aiter_batches(self, src: Union[str, TextIO], size: int, mmap: bool = False, columnar: bool = False,
+            quarantine: Optional[Reject] = None) -> AsyncIterator[Union[List[Dict], Dict[str, List]]]:
+        """ Async iter_batches, each batch is read and transformed on the event loop's default
+        executor so the loop isn't blocked (the quarantine callback is called there too). On
+        cancellation the next() call keeps running on the executor, the batches are closed on
+        the executor once it returns (the lock) """
+        import asyncio
+        from threading import Lock
+        loop = asyncio.get_running_loop()
+        batches, lock = self.iter_batches(src, size, mmap, columnar, quarantine), Lock()
+
+        def next_batch():
+            with lock:
+                return next(batches, None)
+
+        def close():
+            with lock:
+                batches.close()
+
+        try:
+            while True:
+                batch = await loop.run_in_executor(None, next_batch)
+                if batch is None:
+                    return
+                yield batch
+        finally:
+            await loop.run_in_executor(None, close)
+
+    async def aiter_records(self, src: Union[str, TextIO], mmap: bool = False, batch_size: int = ASYNC_BATCH_SIZE,
+            quarantine: Optional[Reject] = None) -> AsyncIterator[Dict]:
+        """ Async iter_records, the records are transformed in batches (see aiter_batches) """
+        async for batch in self.aiter_batches(src, batch_size, mmap, quarantine=quarantine):
+            for record in batch:
+                yield record
+
+    def csv_to_json(self, csv_file: TextIO, json_file: TextIO, quarantine: Optional[TextIO] = None) -> None:
+        """ Converts the CSV to JSON. When validated the rejected rows are written to the
+        quarantine file (required) """
+        with self.validated(reader(csv_file, getattr(self, "__fields__")), quarantine=quarantine) as r:
+            self.rows_to_json(r, json_file)
+
+    def file_to_json(self, path: str, json_file: TextIO, quarantine: Optional[TextIO] = None) -> int:
+        """ Converts the CSV file to JSON reading it through a memory map. When validated the
+        rejected rows are written to the quarantine file (required) """
+        with self.validated(mmap_reader(path, getattr(self, "__fields__")), quarantine=quarantine) as r:
+            return self.rows_to_json(r, json_file)
+
+    @property
+    def sharded(self) -> bool:
+        """ Whether the JSON is written in shards (see sharding.py) """
+        return self.shard_records > 0 or self.shard_size > 0
+
+    def convert_file(self, src: str, dest: str, mmap: bool = False, level: Optional[int] = None) -> int:
+        """ Converts the CSV file to the JSON file, (de)compressing by extension (ex. .csv.gz,
+        .json.gz). Compressed files are streamed as they can't be memory mapped. When sharded
+        the shards of the JSON file and their index are written instead. Returns the number
+        of records written. Rejected rows are quarantined when validated """
+        with self.validated(self.csv_reader(src, mmap), dest) as r:
+            if self.sharded:
+                from .sharding import write_index
+                return write_index(dest, self.rows_to_shards(r, dest, level))["records"]
+            with open_file(dest, "w", level) as f_json:
+                return self.rows_to_json(r, f_json)
+
+    def rows_to_shards(self, r: Iterator[List[List[List[str]]]], dest: str, level: Optional[int] = None) -> List[Dict]:
+        """ Converts the parsed CSV rows to the JSON shards of the destination returning the
+        shards written (path, records and bytes) """
+        from .sharding import ShardWriter
+        writer = ShardWriter(dest, self.shard_records, self.shard_size, level, self.buffer_size, self.json_backend)
+        if self.stats is not None:
+            self.__stats_rows_to_json(r, writer.tell, writer)
+        else:
+            writer.write(self.__transformation(r))
+        return writer.shards
+
+    def rows_to_json(self, r: Iterator[List[List[List[str]]]], json_file: TextIO, records: int = 0) -> int:
+        """ Converts the parsed CSV rows to JSON. The records already in the JSON file (when
+        appending) are given so the new records are separated from them. Returns the
+        number of records in the JSON file """
+        writer = JsonWriter(json_file, self.buffer_size, self.json_backend)
+        writer.records = records
+        if self.stats is not None:
+            self.__stats_rows_to_json(r, partial(_tell, json_file), writer)
+            return writer.records
+        writer.write(self.__transformation(r))
+        return writer.records
+
+    def __transformation(self, r: Iterator[List[List[List[str]]]]) -> Iterator[Dict]:
+        """ The records of the rows (on the pipeline threads when pipelined), the stages
+        are instrumented when stats are enabled """
+        transformation, stats = self.transformation, self.stats
+        if stats is not None:
+            transformation = partial(transformation, transform=stats.transform(self.transform),
+                combine=stats.combine(self.merge_row if self.__keyed() else self.combine))
+            r = stats.rows(r)
+        return self.__pipeline(r, transformation) if self.pipelined else transformation(r)
+
+    def __pipeline(self, r: Iterator[List[List[List[str]]]], transformation) -> Iterator[Dict]:
+        """ Runs the transformation on the pipeline threads (imported when used) """
+        from .pipeline import pipeline
+        return pipeline(r, transformation)
 
-        r = reader(csv_file, getattr(self, "__fields__"))
-        transform = self.transformation(r)
+    def __stats_rows_to_json(self, r: Iterator[List[List[List[str]]]], tell: Callable[[], int],
+            writer: Union[JsonWriter, "ShardWriter"]) -> None:
+        """ Converts the parsed CSV rows to JSON collecting the stage metrics """
+        stats = self.stats
+        writer.encode = stats.encoder(writer.encode)
+        memo = self.memo_info()
+        start, pos = perf_counter(), tell()
+        writer.write(self.__transformation(r))
 
-        write(dumps(next(transform)))
-        for trans in transform:
-            write("\n")
-            write(dumps(trans))
+        stats.total_time += perf_counter() - start
+        stats.bytes_written += tell() - pos
+        stats.files += 1
+        if memo is not None:
+            stats.memo(memo, self.memo_info())
@@ -0,0 +1,137 @@
+""" Persistent Conversion Service
+
+    Converting many small files with a process each is dominated by the interpreter and
+module start up rather than the transform. The service is started once and converts
+the files as they arrive, reusing the transformers (compiled schemas) built for each
+type on first use:
+
+    - watch: polls the in directory converting the CSV files once their size and mtime
+      are unchanged between two polls (files still being written are left alone)
+    - serve: accepts jobs on a unix socket, a JSON line per connection naming a file of
+      the in directory (and optionally its type), replying with a JSON line once converted
+
+    {"file": "allergy_1.csv", "type": "ALLERGY"}
+    {"file": "allergy_1.csv", "dest": "allergy_1.json", "records": 2, "seconds": 0.0012}
+    {"file": "allergy_1.csv", "error": "..."}
+
+    Jobs are converted one at a time (the transformers aren't thread safe). """
+import json
+import os
+import socket
+import socketserver
+import sys
+import time
+from threading import Event
+from typing import Callable, Dict, Optional, Tuple
+from .compressed import strip_compression
+from .csv_transfomer import CsvToJson
+from .line_index import remove_csv
+from .stats import Stats
+
+class Service:
+    """ Converts the CSV files of the in directory to the out directory with transformers
+    built by the factory (from the type) and kept for the life of the service """
+
+    def __init__(self, factory: Callable[[str], CsvToJson], trans_type: str, in_dir: str, out_dir: str,
+            ext: str = ".json", mmap: bool = False, level: Optional[int] = None, keep: bool = False):
+        self.factory = factory
+        self.trans_type = trans_type
+        self.in_dir = in_dir
+        self.out_dir = out_dir
+        self.ext = ext
+        self.mmap = mmap
+        self.level = level
+        self.keep = keep
+        self.transformers: Dict[str, CsvToJson] = {}
+
+    def transformer(self, trans_type: Optional[str] = None) -> CsvToJson:
+        """ The transformer of the type (the service's by default), built on first use """
+        trans_type = trans_type or self.trans_type
+        transformer = self.transformers.get(trans_type)
+        if transformer is None:
+            transformer = self.transformers[trans_type] = self.factory(trans_type)
+        return transformer
+
+    def convert(self, filename: str, trans_type: Optional[str] = None) -> Dict:
+        """ Converts the CSV file of the in directory returning the job's result """
+        if os.path.basename(filename) != filename or not strip_compression(filename).endswith(".csv"):
+            raise ValueError(f"Invalid csv file name {filename}")
+        transformer = self.transformer(trans_type)
+        src = os.path.join(self.in_dir, filename)
+        dest = "".join([strip_compression(filename)[:-4], self.ext])
+        start = time.perf_counter()
+        records = transformer.convert_file(src, os.path.join(self.out_dir, dest), self.mmap, self.level)
+        if not self.keep:
+            remove_csv(src)
+        return {"file": filename, "dest": dest, "records": records, "seconds": round(time.perf_counter() - start, 6)}
+
+    def stats(self) -> Optional[Stats]:
+        """ The stats of every transformer built (None unless enabled) """
+        stats = [transformer.stats for transformer in self.transformers.values() if transformer.stats is not None]
+        if not stats:
+            return None
+        total = Stats()
+        for s in stats:
+            total.merge(s)
+        return total
+
+    def watch(self, interval: float = 1.0, stop: Optional[Event] = None) -> None:
+        """ Converts the CSV files of the in directory as they arrive until stopped. Failed
+        files are reported and retried once modified """
+        stop = stop or Event()
+        seen: Dict[str, Tuple[int, int]] = {}
+        done: Dict[str, Tuple[int, int]] = {}
+        while not stop.is_set():
+            polled, filenames = {}, sorted(os.listdir(self.in_dir))
+            done = dict((filename, done[filename]) for filename in filenames if filename in done)
+            for filename in filenames:
+                if not strip_compression(filename).endswith(".csv"):
+                    continue
+                try:
+                    st = os.stat(os.path.join(self.in_dir, filename))
+                except FileNotFoundError:
+                    continue
+                sig = (st.st_size, st.st_mtime_ns)
+                if done.get(filename) == sig:
+                    continue
+                if seen.get(filename) != sig:
+                    polled[filename] = sig
+                    continue
+                try:
+                    self.convert(filename)
+                except Exception as e:
+                    print(f"Failed to convert {filename}: {e}", file=sys.stderr)
+                done[filename] = sig
+            seen = polled
+            stop.wait(interval)
+
+    def serve(self, path: str) -> socketserver.UnixStreamServer:
+        """ The unix socket server converting the jobs received (see serve_forever) """
+        service = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                line, job = self.rfile.readline(), None
+                try:
+                    job = json.loads(line)
+                    result = service.convert(job["file"], job.get("type"))
+                except Exception as e:
+                    result = {"file": job.get("file") if isinstance(job, dict) else None, "error": str(e)}
+                self.wfile.write((json.dumps(result) + "\n").encode())
+
+        if os.path.exists(path):
+            os.remove(path)
+        return socketserver.UnixStreamServer(path, Handler)
+
+def submit(path: str, filename: str, trans_type: Optional[str] = None, timeout: Optional[float] = None) -> Dict:
+    """ Submits a job to the service listening on the unix socket, returning its result """
+    job = {"file": filename}
+    if trans_type:
+        job["type"] = trans_type
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(path)
+        with sock.makefile("rwb") as f:
+            f.write((json.dumps(job) + "\n").encode())
+            f.flush()
+            return json.loads(f.readline())
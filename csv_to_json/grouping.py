@@ -0,0 +1,90 @@
+""" Out of Order Grouping
+
+    The combine transform only merges the adjacent records of a person. Grouping sorts
+the records by the person key (external sort) so every record of a person is adjacent
+regardless of the input order. The records are held in memory up to the budget (bytes
+of JSON, estimated from the encoded size of every SAMPLE-th record) and only encoded
+when spilled to temp files as sorted runs which are merged back (fan in limited to
+MAX_RUNS open files, merging in passes when exceeded). The sort is stable so the
+records of a person keep their input order. The output is ordered by the person key. """
+import heapq
+import json
+import os
+from operator import itemgetter
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from .json_writer import json_encoder
+
+GROUP_BUDGET = 256 * 1024 * 1024
+MAX_RUNS = 64
+# Records per encoded size sample (the budget estimate)
+SAMPLE = 64
+
+def _write_run(items: Iterable[Tuple[str, str]], tmp_dir: Optional[str]) -> str:
+    """ Writes the sorted (key, record) items to a run file """
+    import tempfile
+    fd, path = tempfile.mkstemp(prefix="csv_to_json_run", suffix=".txt", dir=tmp_dir)
+    with open(fd, "w", encoding="utf-8") as f:
+        write = f.write
+        for key, data in items:
+            write("".join([key, "\t", data, "\n"]))
+    return path
+
+def _read_run(path: str) -> Iterator[Tuple[str, str]]:
+    """ Reads the (key, record) items of a run file, removing it once read """
+    try:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                key, data = line[:-1].split("\t", 1)
+                yield key, data
+    finally:
+        os.remove(path)
+
+def _merge_runs(runs: List[str], tmp_dir: Optional[str]) -> Iterator[Tuple[str, str]]:
+    """ Merges the runs (stable, ties keep the run order) reducing them in passes
+    when there are too many to open at once """
+    while len(runs) > MAX_RUNS:
+        runs = [_write_run(heapq.merge(*map(_read_run, runs[:MAX_RUNS]), key=itemgetter(0)), tmp_dir)] + \
+            runs[MAX_RUNS:]
+    return heapq.merge(*map(_read_run, runs), key=itemgetter(0))
+
+def _decoded(items: Iterable[Tuple[str, str]]) -> Iterator[Tuple[str, Dict]]:
+    loads = json.loads
+    for key, data in items:
+        yield key, loads(data)
+
+def sort_records(records: Iterable[Dict], key: Callable[[Dict], str], budget: int = GROUP_BUDGET,
+        tmp_dir: Optional[str] = None) -> Iterator[Dict]:
+    """ Yields the records sorted (stable) by key, spilling sorted runs to temp files
+    when the (estimated) encoded size of the records held in memory exceeds the budget """
+    encode = json_encoder()
+    buffer: List[Tuple[str, Dict]] = []
+    append = buffer.append
+    size, sampled, samples, runs = 0, 0, 0, []
+    try:
+        for i, record in enumerate(records):
+            k = key(record)
+            if not i % SAMPLE:
+                sampled += len(encode(record))
+                samples += 1
+            append((k, record))
+            size += sampled // samples + len(k)
+            if size >= budget:
+                buffer.sort(key=itemgetter(0))
+                runs.append(_write_run(((k, encode(record)) for k, record in buffer), tmp_dir))
+                buffer.clear()
+                size = 0
+
+        buffer.sort(key=itemgetter(0))
+        if not runs:
+            for _, record in buffer:
+                yield record
+            return
+
+        # The records left in memory are merged last (ties keep the input order)
+        merged = heapq.merge(_decoded(_merge_runs(runs, tmp_dir)), buffer, key=itemgetter(0))
+        runs = []
+        for _, record in merged:
+            yield record
+    finally:
+        for path in runs:
+            os.remove(path)
@@ -0,0 +1,80 @@
+""" Buffered JSON Writer """
+import json
+from json.encoder import c_make_encoder, encode_basestring_ascii
+from typing import Callable, Dict, Iterable, TextIO
+
+
+BUFFER_SIZE = 4 * 1024 * 1024
+BACKENDS = ("json", "orjson")
+
+def load_orjson():
+    """ The orjson module (None when not installed), imported when first used so the
+    stdlib backend doesn't pay for it on start up """
+    try:
+        import orjson
+    except ImportError:
+        return None
+    return orjson
+
+def json_encoder() -> Callable[[Dict], str]:
+    """ Creates a reusable stdlib encoder producing the same output as json.dumps
+    without setting up a new C encoder on every call """
+    if c_make_encoder is None:
+        return json.JSONEncoder().encode
+
+    encode = c_make_encoder(None, None, encode_basestring_ascii, None, ": ", ", ", False, False, True)
+    join = "".join
+    return lambda obj: join(encode(obj, 0))
+
+def orjson_encoder() -> Callable[[Dict], str]:
+    """ Creates an orjson encoder. orjson doesn't support the stdlib separators / ascii
+    escaping so its output is compact UTF-8 JSON (equivalent though not byte identical) """
+    dumps = load_orjson().dumps
+    return lambda obj: dumps(obj).decode()
+
+def encoder(backend: str = "json") -> Callable[[Dict], str]:
+    """ Gets the record encoder for the backend. The stdlib encoder (the default) is byte
+    identical to json.dumps, orjson is opt-in (different bytes) and must be installed """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unsupported JSON backend: {backend}")
+    if backend == "orjson":
+        if load_orjson() is None:
+            raise ValueError("orjson isn't installed (pip install orjson)")
+        return orjson_encoder()
+    return json_encoder()
+
+class JsonWriter:
+    """ Writes records as newline delimited JSON. The serialized records are buffered
+    and flushed to the file in large writes instead of two writes per record """
+
+    def __init__(self, f: TextIO, buffer_size: int = BUFFER_SIZE, backend: str = "json"):
+        self.f = f
+        self.buffer_size = buffer_size
+        self.encode = encoder(backend)
+        self.records = 0
+
+    def write(self, records: Iterable[Dict]) -> None:
+        """ Writes the records, separated by new lines """
+        encode, write, join = self.encode, self.f.write, "\n".join
+        buffer_size = self.buffer_size
+
+        parts, size, cnt = [], 0, self.records
+        append = parts.append
+        for record in records:
+            data = encode(record)
+            append(data)
+            size += len(data)
+            if size >= buffer_size:
+                if cnt:
+                    write("\n")
+                write(join(parts))
+                cnt += len(parts)
+                parts.clear()
+                size = 0
+
+        if parts:
+            if cnt:
+                write("\n")
+            write(join(parts))
+            cnt += len(parts)
+        self.records = cnt
@@ -0,0 +1,194 @@
+""" Line Index
+
+    A sidecar index (name.csv.index.json, next to the CSV file) for random access to
+the rows of a large CSV file without streaming it from the start. It holds the byte
+offset of every Nth row and, when built with a transformer, the byte ranges of the
+consecutive rows of each person keyed on a hash of the person key (see
+csv_transfomer.person_key). The size and modification time of the CSV file are kept
+so a stale index is ignored (and rebuilt when selecting).
+
+    {
+        "size": 1048576, "mtime_ns": 1700000000000000000, "first_line": 2, "every": 1000,
+        "rows": 2500, "offsets": [13, 419000, 838211],
+        "people": {"9f86d081884c7d65": [[13, 1220], [52011, 52418]], ...}
+    }
+
+    A selection seeks straight to the nearest indexed row (skipping at most every - 1
+lines) or to the ranges of the person. The hash only points to the ranges, the rows
+read are matched on the person key itself so collisions are harmless. The parallel and
+checkpointed conversions split the file on the indexed rows (the person ranges when
+combining) instead of scanning for the boundaries. Compressed files can't be indexed. """
+import json
+import locale
+import os
+from bisect import bisect_left
+from itertools import chain
+from typing import Dict, Iterator, List, Optional, Tuple
+from .compressed import compression, open_file
+from .csv_reader import map_file, parse_row, range_reader
+from .csv_transfomer import CsvToJson, person_key
+
+INDEX_EVERY = 1000
+
+def line_index_path(src: str) -> str:
+    """ The path of the line index of the CSV file """
+    return src + ".index.json"
+
+def remove_csv(src: str) -> None:
+    """ Removes the converted CSV file along with its line index (if any) """
+    os.remove(src)
+    index = line_index_path(src)
+    if os.path.exists(index):
+        os.remove(index)
+
+def key_hash(key: str) -> str:
+    """ The hash of the person key the person ranges are indexed on (hashlib is imported
+    when hashing, removing the converted files doesn't pay for it) """
+    from hashlib import blake2b
+    return blake2b(key.encode("utf-8"), digest_size=8).hexdigest()
+
+class LineIndex:
+    """ The row offsets (every Nth row) and person ranges of a CSV file """
+
+    def __init__(self, size: int, mtime_ns: int, first_line: int, every: int, rows: int, offsets: List[int],
+            people: Optional[Dict[str, List[List[int]]]] = None):
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.first_line = first_line
+        self.every = every
+        self.rows = rows
+        self.offsets = offsets
+        self.people = people
+
+    def fresh(self, src: str) -> bool:
+        """ Whether the index is of the current content of the CSV file """
+        st = os.stat(src)
+        return st.st_size == self.size and st.st_mtime_ns == self.mtime_ns
+
+    def save(self, path: str) -> None:
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.__dict__, f, separators=(",", ":"))
+        os.replace(tmp, path)
+
+    def line_range(self, src: str, first: int, last: int) -> Tuple[int, int]:
+        """ The byte range [start, end) of the (1 based, header included) lines first to last """
+        row, end_row = max(first - self.first_line, 0), min(last - self.first_line + 1, self.rows)
+        if row >= end_row:
+            return self.size, self.size
+        m = map_file(src)
+        try:
+            m.seek(self.offsets[row // self.every])
+            for _ in range(row % self.every):
+                m.readline()
+            start = m.tell()
+            for _ in range(end_row - row):
+                m.readline()
+            return start, m.tell()
+        finally:
+            m.close()
+
+    def person_ranges(self, key: str) -> List[Tuple[int, int]]:
+        """ The byte ranges of the consecutive rows of the person (and any colliding person) """
+        if self.people is None:
+            raise ValueError("The line index doesn't index the people")
+        return [(start, end) for start, end in self.people.get(key_hash(key), [])]
+
+    def bounds(self, combined: bool) -> List[int]:
+        """ The sorted offsets the file can be split on (the person ranges when combining) """
+        if combined:
+            return sorted(start for ranges in self.people.values() for start, _ in ranges)
+        return self.offsets
+
+    def chunk_ranges(self, combined: bool, chunk_size: int) -> List[Tuple[int, int]]:
+        """ Splits the CSV file into byte ranges of roughly the chunk size on the indexed rows
+        (see parallel.chunk_ranges) """
+        offsets, bounds = self.bounds(combined), [0]
+        i = bisect_left(offsets, chunk_size)
+        while i < len(offsets):
+            bounds.append(offsets[i])
+            i = bisect_left(offsets, offsets[i] + chunk_size, i + 1)
+        bounds.append(self.size)
+        return list(zip(bounds[:-1], bounds[1:]))
+
+def build_index(src: str, transformer: Optional[CsvToJson] = None, every: int = INDEX_EVERY) -> LineIndex:
+    """ Indexes the rows of the CSV file and (with a transformer) the ranges of each person """
+    if compression(src):
+        raise ValueError(f"Compressed files can't be indexed: {src}")
+    st = os.stat(src)
+    offsets, rows, first_line = [], 0, 1
+    people: Optional[Dict[str, List[List[int]]]] = {} if transformer is not None else None
+    m = map_file(src)
+    if m is not None:
+        readline, encoding = m.readline, locale.getpreferredencoding(False)
+        if transformer is not None:
+            field_cnt, transform = getattr(transformer, "__fields__"), transformer.transform
+        pos, line = 0, readline()
+        if line.upper().startswith(b"SEQ|"):
+            pos, line, first_line = len(line), readline(), 2
+
+        key, run = None, None
+        while line:
+            if not rows % every:
+                offsets.append(pos)
+            rows += 1
+            if people is not None:
+                next_key = key_hash(person_key(transform(parse_row(line.decode(encoding), field_cnt))))
+                if next_key != key:
+                    key, run = next_key, [pos, pos]
+                    people.setdefault(key, []).append(run)
+                run[1] = pos + len(line)
+            pos += len(line)
+            line = readline()
+        m.close()
+    return LineIndex(st.st_size, st.st_mtime_ns, first_line, every, rows, offsets, people)
+
+def load_index(src: str) -> Optional[LineIndex]:
+    """ The line index of the CSV file (None when missing or stale) """
+    path = line_index_path(src)
+    if compression(src) or not os.path.exists(path):
+        return None
+    with open(path) as f:
+        index = LineIndex(**json.load(f))
+    return index if index.fresh(src) else None
+
+def index_file(src: str, transformer: Optional[CsvToJson] = None, every: int = INDEX_EVERY) -> LineIndex:
+    """ Builds and saves the line index of the CSV file """
+    index = build_index(src, transformer, every)
+    index.save(line_index_path(src))
+    return index
+
+def _index(src: str, transformer: CsvToJson, people: bool) -> LineIndex:
+    """ The saved line index of the CSV file, (re)built when missing | stale | without the people """
+    index = load_index(src)
+    if index is None or (people and index.people is None):
+        index = index_file(src, transformer if people else None, index.every if index is not None else INDEX_EVERY)
+    return index
+
+def select_lines(transformer: CsvToJson, src: str, first: int, last: int) -> Iterator[List[List[List[str]]]]:
+    """ Reads the rows of the (1 based, header included) lines first to last seeking to them """
+    start, end = _index(src, transformer, False).line_range(src, first, last)
+    return range_reader(src, getattr(transformer, "__fields__"), start, end)
+
+def select_people(transformer: CsvToJson, src: str, patients: List[Dict]) -> Iterator[List[List[List[str]]]]:
+    """ Reads the rows of the patients (the patient of a record, ex. {"name": ..., "birth_date": ...,
+    "admin_sex": ...}) seeking to their ranges """
+    index, field_cnt, transform = _index(src, transformer, True), getattr(transformer, "__fields__"), transformer.transform
+    keys = set(person_key({"patient": patient}) for patient in patients)
+    ranges = sorted(set(chain.from_iterable(map(index.person_ranges, keys))))
+    for start, end in ranges:
+        for row in range_reader(src, field_cnt, start, end):
+            if person_key(transform(row)) in keys:
+                yield row
+
+def convert_lines(transformer: CsvToJson, src: str, dest: str, first: int, last: int,
+        level: Optional[int] = None) -> int:
+    """ Converts the lines first to last of the CSV file to the JSON file returning the records written """
+    with open_file(dest, "w", level) as f_json:
+        return transformer.rows_to_json(select_lines(transformer, src, first, last), f_json)
+
+def convert_people(transformer: CsvToJson, src: str, dest: str, patients: List[Dict],
+        level: Optional[int] = None) -> int:
+    """ Converts the rows of the patients of the CSV file to the JSON file returning the records written """
+    with open_file(dest, "w", level) as f_json:
+        return transformer.rows_to_json(select_people(transformer, src, patients), f_json)
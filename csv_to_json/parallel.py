@@ -0,0 +1,159 @@
+""" Parallel CSV Transformation
+
+    Whole files are spread across a process pool. Files larger than the chunk size
+are split into line aligned byte ranges that are transformed in parallel and then
+concatenated in their original order. When sharded (see sharding.py) each range is
+written to its own shards by the worker, the shards are then renumbered in order and
+indexed instead of concatenated. The rows quarantined by each range (when validated)
+are concatenated in order. """
+import locale
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from .compressed import compression, strip_compression, open_file
+from .csv_reader import parse_row, range_reader
+from .csv_transfomer import CsvToJson
+from .line_index import load_index, remove_csv
+from .sharding import remove_shards, shard_path, write_index
+from .stats import Stats
+from .validation import quarantine_path
+
+CHUNK_SIZE = 64 * 1024 * 1024
+
+def same_group(transformer: CsvToJson, line: bytes, next_line: bytes, encoding: str) -> bool:
+    """ Whether the next line would be combined into the record of the line """
+    field_cnt, transform = getattr(transformer, "__fields__"), transformer.transform
+    trans = transform(parse_row(line.decode(encoding), field_cnt))
+    return transformer.combine(trans, transform(parse_row(next_line.decode(encoding), field_cnt)))
+
+def chunk_ranges(transformer: CsvToJson, path: str, chunk_size: int = CHUNK_SIZE) -> List[Tuple[int, int]]:
+    """ Splits the CSV file into line aligned byte ranges of roughly the chunk size.
+
+        When combining, a boundary is moved forward until it no longer splits the
+    rows of a person so each range can be combined on its own. Compressed files
+    can't be split, neither can files grouped by person (each person anywhere in the file).
+    A fresh line index (see line_index.py) is split on its indexed rows | person ranges
+    instead of seeking and scanning for the boundaries. """
+    size = os.path.getsize(path)
+    if compression(path) or transformer.grouped:
+        return [(0, size)]
+    index = load_index(path)
+    if index is not None and (index.people is not None or not transformer.combined):
+        return index.chunk_ranges(transformer.combined, chunk_size)
+    encoding = locale.getpreferredencoding(False)
+    bounds = [0]
+    with open(path, "rb") as f:
+        readline, tell = f.readline, f.tell
+        header = readline()
+        offset = (len(header) if header.upper().startswith(b"SEQ|") else 0) + chunk_size
+        while offset < size:
+            f.seek(offset)
+            readline()
+            if transformer.combined:
+                line = readline()
+                pos, next_line = tell(), readline()
+                while next_line and same_group(transformer, line, next_line, encoding):
+                    line = next_line
+                    pos, next_line = tell(), readline()
+            else:
+                pos = tell()
+
+            if pos >= size:
+                break
+            bounds.append(pos)
+            offset = pos + chunk_size
+    bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+def _convert_file(transformer: CsvToJson, src: str, dest: str, level: Optional[int]) -> Optional[Stats]:
+    """ Worker: converts a whole CSV file returning the stats (if enabled) """
+    transformer.convert_file(src, dest, True, level)
+    return transformer.stats
+
+def _convert_range(transformer: CsvToJson, src: str, dest: str, start: int, end: int) -> Optional[Stats]:
+    """ Worker: converts the byte range of a CSV file returning the stats (if enabled) """
+    with transformer.validated(range_reader(src, getattr(transformer, "__fields__"), start, end), dest) as r, \
+            open(dest, "w") as f_json:
+        transformer.rows_to_json(r, f_json)
+    return transformer.stats
+
+def _shard_range(transformer: CsvToJson, src: str, dest: str, start: int, end: int,
+        level: Optional[int]) -> Tuple[List[Dict], Optional[Stats]]:
+    """ Worker: converts the byte range of a CSV file to shards returning them with the stats (if enabled) """
+    with transformer.validated(range_reader(src, getattr(transformer, "__fields__"), start, end), dest) as r:
+        shards = transformer.rows_to_shards(r, dest, level)
+    return shards, transformer.stats
+
+def _index_shards(ranges: List[List[Dict]], dest: str) -> None:
+    """ Renumbers the shards of the converted ranges in order (replacing the shards of a
+    previous conversion) and indexes them """
+    remove_shards(dest)
+    shards = []
+    for shard in (shard for range_shards in ranges for shard in range_shards):
+        path = shard_path(dest, len(shards) + 1)
+        os.replace(shard["path"], path)
+        shards.append(dict(shard, path=path))
+    write_index(dest, shards)
+
+def _concat_quarantine(parts: List[str], dest: str) -> None:
+    """ Concatenates the quarantined rows of the converted ranges in order, removing the parts """
+    parts = [quarantine_path(part) for part in parts if os.path.exists(quarantine_path(part))]
+    if parts:
+        with open(quarantine_path(dest), "wb") as f_quarantine:
+            for part in parts:
+                with open(part, "rb") as f_part:
+                    shutil.copyfileobj(f_part, f_quarantine)
+                os.remove(part)
+
+def _concat(parts: List[str], dest: str, level: Optional[int]) -> None:
+    """ Concatenates the converted ranges in order (compressing by extension), removing the parts """
+    with open_file(dest, "wb", level) as f_json:
+        wrote = False
+        for part in parts:
+            if os.path.getsize(part):
+                if wrote:
+                    f_json.write(b"\n")
+                with open(part, "rb") as f_part:
+                    shutil.copyfileobj(f_part, f_json)
+                wrote = True
+            os.remove(part)
+
+def convert_files(transformer: CsvToJson, files: List[Tuple[str, str]], workers: int,
+        chunk_size: int = CHUNK_SIZE, remove: bool = True, level: Optional[int] = None) -> None:
+    """ Converts the (src, dest) CSV files to JSON using a pool of worker processes. The files
+    are (de)compressed by extension, level being the output compression level """
+    with ProcessPoolExecutor(workers) as pool:
+        submit, jobs = pool.submit, []
+        for src, dest in files:
+            ranges = chunk_ranges(transformer, src, chunk_size)
+            if len(ranges) == 1:
+                jobs.append((src, dest, [submit(_convert_file, transformer, src, dest, level)], []))
+            elif transformer.sharded:
+                parts = ["".join([strip_compression(dest), ".part", str(i), compression(dest)]) for i in range(len(ranges))]
+                futures = [submit(_shard_range, transformer, src, part, start, end, level)
+                    for part, (start, end) in zip(parts, ranges)]
+                jobs.append((src, dest, futures, parts))
+            else:
+                parts = ["".join([dest, ".part", str(i)]) for i in range(len(ranges))]
+                futures = [submit(_convert_range, transformer, src, part, start, end)
+                    for part, (start, end) in zip(parts, ranges)]
+                jobs.append((src, dest, futures, parts))
+
+        stats = transformer.stats
+        for src, dest, futures, parts in jobs:
+            results = [future.result() for future in futures]
+            if parts and transformer.sharded:
+                _index_shards([shards for shards, _ in results], dest)
+                results = [worker_stats for _, worker_stats in results]
+            elif parts:
+                _concat(parts, dest, level)
+            if parts and transformer.validate:
+                _concat_quarantine(parts, dest)
+            if stats is not None:
+                for worker_stats in results:
+                    stats.merge(worker_stats)
+                # Each range is counted as a file by its worker, the file is counted once
+                stats.files -= len(results) - 1
+            if remove:
+                remove_csv(src)
@@ -0,0 +1,81 @@
+""" Pipelined CSV Transformation
+
+    Reading (line splitting included) and transformation run on their own threads
+connected to the writer (the calling thread) by bounded queues. The rows / records
+are passed in batches to keep the queue overhead per row low while the bounded queues
+give backpressure so memory stays flat. File reads (network file systems, compressed
+inputs) and writes release the GIL allowing the I/O to overlap the CPU work. """
+from itertools import islice
+from queue import Queue, Empty, Full
+from threading import Event, Thread
+from typing import Callable, Iterable, Iterator, List, Dict
+
+BATCH_SIZE = 512
+QUEUE_SIZE = 8
+
+_DONE = object()
+
+class _Failure:
+    """ An exception raised by a stage, re-raised by the consumer """
+
+    def __init__(self, exc: BaseException):
+        self.exc = exc
+
+def _put(q: Queue, item: object, stop: Event) -> bool:
+    """ Puts the item blocking while the queue is full, gives up once stopped """
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except Full:
+            pass
+    return False
+
+def _produce(items: Iterable, q: Queue, stop: Event, batch_size: int) -> None:
+    """ Stage: puts the items in batches followed by the done marker """
+    try:
+        it = iter(items)
+        batch = list(islice(it, batch_size))
+        while batch:
+            if not _put(q, batch, stop):
+                return
+            batch = list(islice(it, batch_size))
+    except BaseException as exc:
+        _put(q, _Failure(exc), stop)
+        return
+    _put(q, _DONE, stop)
+
+def _consume(q: Queue, stop: Event) -> Iterator:
+    """ Yields the items of the batches until done (or stopped), re-raising a stage failure """
+    get = q.get
+    while True:
+        try:
+            batch = get(timeout=0.1)
+        except Empty:
+            if stop.is_set():
+                return
+            continue
+        if batch is _DONE:
+            return
+        if isinstance(batch, _Failure):
+            raise batch.exc
+        yield from batch
+
+def pipeline(r: Iterable[List[List[List[str]]]], transformation: Callable[[Iterator], Iterator[Dict]],
+        batch_size: int = BATCH_SIZE, queue_size: int = QUEUE_SIZE) -> Iterator[Dict]:
+    """ Yields the transformed records with the rows read and transformed on their own threads """
+    stop = Event()
+    rows, records = Queue(queue_size), Queue(queue_size)
+    stages = [
+        Thread(target=_produce, args=(r, rows, stop, batch_size), name="csv_to_json-read", daemon=True),
+        Thread(target=_produce, args=(transformation(_consume(rows, stop)), records, stop, batch_size),
+            name="csv_to_json-transform", daemon=True)
+    ]
+    for stage in stages:
+        stage.start()
+    try:
+        yield from _consume(records, stop)
+    finally:
+        stop.set()
+        for stage in stages:
+            stage.join()
@@ -0,0 +1,406 @@
+""" Declarative CSV to JSON Schemas
+
+    A schema maps the CSV columns of a record type to the JSON output. Each column
+specifies the CSV field index, the converter, the output path and whether the field
+is optional (only set when the converted value isn't empty). Columns marked "required"
+must have a value when the rows are validated (see validation.py).
+
+    {
+        "name": "allergy",
+        "fields": 19,
+        "entries": "allergys",
+        "columns": [
+            {"index": 1, "converter": "ids", "path": "patient.ids"},
+            {"index": 8, "converter": "code", "path": "allergys[].severity", "optional": true},
+            ...
+        ]
+    }
+
+    Columns marked "memo" (ex. the patient, encounter and physician blocks repeated on
+consecutive rows of a person) can be memoized: the converted values are kept in an LRU
+cache keyed on the raw subfields (see memoize). The cached values are copied for each
+record so the records never share containers and can be modified freely.
+
+    Path segments are separated by "." where a segment ending in "[]" is a list holding
+a single dict (the entries combined for a person). Within a dict, required columns must
+precede the optional columns so the key order matches the column order.
+
+    The schema is compiled into a single transform function by generating and exec-ing
+Python source. Column indexes, dict keys and the simple converters are inlined so no
+mapping dicts or lookups are repeated per row.
+
+    For combining, the person key (see compile_key) is compiled from the raw person
+fields and the entry transform (see compile_entry) only builds the entry of a row, so
+the rows merged into a record skip the patient and encounter blocks. Schemas whose
+entries are nearly the whole row combine the records instead (see keyed_pays). """
+import json
+import os
+from functools import lru_cache, partial
+from operator import itemgetter
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple, Union
+
+SCHEMA_DIR = os.path.join(os.path.dirname(__file__), "schemas")
+
+CODE = ("id", "description", "coding_method")
+ID = ("id", "authority", "id_type")
+NAME = ("last", "first", "middle")
+
+class Column(NamedTuple):
+    """ Schema column """
+    index: int
+    converter: str
+    path: str
+    optional: bool = False
+    memo: bool = False
+    required: bool = False
+
+class Schema(NamedTuple):
+    """ Record type schema """
+    name: str
+    fields: int
+    entries: str
+    columns: Tuple[Column, ...]
+
+def physician(data: List[List[str]]) -> Dict:
+    """ Converts the raw csv physician (id, last, first, type, authority) """
+    if not data:
+        return {}
+    d = data[0]
+    n = len(d)
+    if n > 4:
+        phys = {"id": {"id": d[0], "authority": d[4]}}
+    elif n:
+        phys = {"id": {"id": d[0]}}
+    else:
+        return {}
+
+    if n > 2:
+        phys["name"] = {"last": d[1], "first": d[2]}
+    elif n > 1:
+        phys["name"] = {"last": d[1]}
+    if n > 3:
+        phys["phys_type"] = d[3]
+    return phys
+
+def comment(r: List[str]) -> Dict:
+    """ Converts a raw csv comment (text, date, phys id, last, first, authority) """
+    n = len(r)
+    trans = {"text": r[0]}
+    if n > 1:
+        trans["comment_dt_tm"] = r[1]
+    if n > 2:
+        phys = {"id": {"id": r[2], "authority": r[5]} if n > 5 else {"id": r[2]}}
+        if n > 4:
+            phys["name"] = {"last": r[3], "first": r[4]}
+        elif n > 3:
+            phys["name"] = {"last": r[3]}
+        trans["physician"] = phys
+    return trans
+
+def comments(data: List[List[str]]) -> List[Dict]:
+    """ Converts the raw csv comments """
+    return [comment(r) for r in data if r]
+
+def reaction(r: List[str]) -> Dict:
+    """ Converts a raw csv reaction (code id, description, coding method, severity id,
+    description, coding method) """
+    trans = {"code": dict(zip(CODE, r[:3]))}
+    if len(r) > 3:
+        trans["severity"] = dict(zip(CODE, r[3:6]))
+    return trans
+
+def reactions(data: List[List[str]]) -> List[Dict]:
+    """ Converts the raw csv reactions """
+    return [reaction(r) for r in data if r]
+
+# Converters inlined into the compiled transform, {} is the raw field
+INLINE = {
+    "string": "({0}[0][0] if {0} else \"\")",
+    "code": "(dict(zip(CODE, {0}[0])) if {0} else {{}})",
+    "codes": "[dict(zip(CODE, r)) for r in {0} if r]",
+    "ids": "[dict(zip(ID, r)) for r in {0} if r]",
+    "name": "(dict(zip(NAME, {0}[0])) if {0} else {{}})",
+}
+
+# Converters called by the compiled transform
+CONVERTERS: Dict[str, Callable[[List[List[str]]], object]] = {
+    "physician": physician,
+    "comments": comments,
+    "reactions": reactions,
+}
+
+# The person columns (compared by csv_transfomer.is_same_person)
+PERSON = ("patient.name", "patient.birth_date", "patient.admin_sex")
+
+# Share of the columns a merged row skips (outside the entries) below which the key
+# costs about what's saved (see benchmarks/bench_combine.py)
+KEYED_MIN_SKIPPED = 0.2
+
+# Key expressions of the raw fields, equal when the inlined converted values are
+KEYS = {
+    "string": "({0}[0][0] if {0} else \"\")",
+    "code": "(tuple({0}[0][:3]) if {0} else ())",
+    "name": "(tuple({0}[0][:3]) if {0} else ())",
+}
+
+def register_converter(name: str, converter: Callable[[List[List[str]]], object]) -> None:
+    """ Registers a converter that can be referenced by schemas """
+    CONVERTERS[name] = converter
+
+def load_schema(schema: Union[str, Dict]) -> Schema:
+    """ Loads the schema from a dict, the name of a built-in schema or the path of a JSON
+    schema file (a .json file, built-in names are never looked up on the file system) """
+    if isinstance(schema, str):
+        builtin = os.path.join(SCHEMA_DIR, f"{schema.lower()}.json")
+        if os.path.basename(schema) == schema and os.path.isfile(builtin):
+            path = builtin
+        elif schema.lower().endswith(".json") and os.path.isfile(schema):
+            path = schema
+        else:
+            raise ValueError(f"Unknown schema {schema}")
+        with open(path) as f:
+            schema = json.load(f)
+    columns = tuple(Column(c["index"], c["converter"], c["path"], c.get("optional", False), c.get("memo", False),
+        c.get("required", False)) for c in schema["columns"])
+    return Schema(schema["name"], schema["fields"], schema["entries"], columns)
+
+class _Node:
+    """ Output dict being compiled """
+
+    def __init__(self):
+        self.items: Dict[str, Union["_Node", Column]] = {}
+        self.optional = False
+
+def _build_tree(schema: Schema) -> _Node:
+    """ Builds the output dict tree from the column paths """
+    root = _Node()
+    for column in schema.columns:
+        *parents, key = column.path.split(".")
+        node = root
+        for segment in parents:
+            child = node.items.get(segment)
+            if child is None and not node.optional:
+                child = node.items[segment] = _Node()
+            if not isinstance(child, _Node):
+                raise ValueError(f"Invalid path {column.path} in schema {schema.name}")
+            node = child
+        if key in node.items or key.endswith("[]"):
+            raise ValueError(f"Invalid path {column.path} in schema {schema.name}")
+        if column.optional:
+            node.optional = True
+        elif node.optional:
+            raise ValueError(f"Required column {column.path} follows an optional column in schema {schema.name}")
+        node.items[key] = column
+    return root
+
+def copy_value(value: object) -> object:
+    """ A copy of the converted value (nested dicts | lists copied, strs shared) """
+    if isinstance(value, dict):
+        return {k: copy_value(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [copy_value(v) for v in value]
+    return value
+
+# Copies of the converted values of the inlined converters (flat dicts | lists of flat dicts)
+COPIES: Dict[str, Callable[[object], object]] = {
+    "string": lambda value: value,
+    "code": dict,
+    "name": dict,
+    "codes": lambda value: [dict(d) for d in value],
+    "ids": lambda value: [dict(d) for d in value],
+}
+
+def _copied(cache: Callable, copy: Callable[[object], object]) -> Callable:
+    """ Calls the LRU cache returning a copy of the cached value (cache_info kept) """
+    def memo(key):
+        return copy(cache(key))
+    memo.cache_info = cache.cache_info
+    return memo
+
+def memoize(schema: Schema, size: int) -> Dict[Column, Callable]:
+    """ LRU caches (of size entries) of the converters of the schema's memo columns.
+    The caches are called with the raw subfields as tuples (see _KEY) and return a copy
+    of the cached value so the records don't share containers """
+    memos = {}
+    for column in schema.columns:
+        if column.memo and column not in memos:
+            if column.converter in INLINE:
+                converter = eval(f"lambda f: {INLINE[column.converter].format('f')}", dict(CODE=CODE, ID=ID, NAME=NAME))
+            elif column.converter in CONVERTERS:
+                converter = CONVERTERS[column.converter]
+            else:
+                raise ValueError(f"Unknown converter {column.converter}")
+            memos[column] = _copied(lru_cache(maxsize=size)(converter), COPIES.get(column.converter, copy_value))
+    return memos
+
+def memo_info(memos: Dict[Column, Callable]) -> Dict[str, int]:
+    """ The hits, misses and entries of the caches """
+    infos = [memo.cache_info() for memo in memos.values()]
+    return {
+        "hits": sum(info.hits for info in infos),
+        "misses": sum(info.misses for info in infos),
+        "size": sum(info.currsize for info in infos)
+    }
+
+# The key of the raw field (subfields as tuples) memos are called with
+_KEY = "tuple(map(tuple, {0}))"
+
+def _memo_names(memos: Dict[Column, Callable]) -> Dict[Column, str]:
+    return dict((column, f"m{i}") for i, column in enumerate(memos))
+
+def _value(column: Column, memo_names: Optional[Dict[Column, str]] = None) -> str:
+    """ The expression converting the column """
+    field = f"f{column.index}"
+    if memo_names and column in memo_names:
+        return f"{memo_names[column]}({_KEY.format(field)})"
+    if column.converter in INLINE:
+        return INLINE[column.converter].format(field)
+    if column.converter in CONVERTERS:
+        return f"{column.converter}({field})"
+    raise ValueError(f"Unknown converter {column.converter}")
+
+def _compile_node(node: _Node, lines: List[str], names: List[int], value: Callable[[Column], str] = _value,
+        indent: str = "    ") -> str:
+    """ Compiles the dict node returning its expression. Nodes with optional columns
+    are assigned to a variable the optional columns are set on. """
+    items = []
+    for key, item in node.items.items():
+        if isinstance(item, Column):
+            if not item.optional:
+                items.append(f"{key!r}: {value(item)}")
+            continue
+        expr = _compile_node(item, lines, names, value, indent)
+        items.append(f"{key[:-2]!r}: [{expr}]" if key.endswith("[]") else f"{key!r}: {expr}")
+
+    literal = "{" + ", ".join(items) + "}"
+    if not node.optional:
+        return literal
+
+    names.append(len(names))
+    var = f"d{names[-1]}"
+    lines.append(f"{indent}{var} = {literal}")
+    for key, item in node.items.items():
+        if isinstance(item, Column) and item.optional:
+            v = value(item)
+            if not v.isidentifier():
+                lines.append(f"{indent}v = {v}")
+                v = "v"
+            lines.append(f"{indent}if {v}:")
+            lines.append(f"{indent}    {var}[{key!r}] = {v}")
+    return var
+
+def schema_source(schema: Schema, memos: Optional[Dict[Column, Callable]] = None) -> str:
+    """ Generates the source of the schema's transform function """
+    lines = ["def transform(fields):"]
+    lines.extend(f"    f{i} = fields[{i}]" for i in sorted(set(c.index for c in schema.columns)))
+    expr = _compile_node(_build_tree(schema), lines, [], partial(_value, memo_names=_memo_names(memos or {})))
+    lines.append(f"    return {expr}")
+    return "\n".join(lines) + "\n"
+
+def key_source(schema: Schema) -> Optional[str]:
+    """ Generates the source of the schema's person key function (None unless the person
+    columns are required with a keyed converter) """
+    columns = dict((c.path, c) for c in schema.columns)
+    person = [columns.get(path) for path in PERSON]
+    if any(c is None or c.optional or c.converter not in KEYS for c in person):
+        return None
+    keys = ", ".join(KEYS[c.converter].format(f"fields[{c.index}]") for c in person)
+    return f"def person(fields):\n    return ({keys})\n"
+
+def keyed_pays(schema: Schema) -> bool:
+    """ Whether combining keyed on the person pays off, the merged rows skip the columns
+    outside the entries (at least KEYED_MIN_SKIPPED of the columns) """
+    prefix = schema.entries + "[]."
+    skipped = sum(not c.path.startswith(prefix) for c in schema.columns)
+    return skipped >= KEYED_MIN_SKIPPED * len(schema.columns)
+
+def entry_source(schema: Schema, memos: Optional[Dict[Column, Callable]] = None) -> Optional[str]:
+    """ Generates the source of the schema's entry transform function, the single dict
+    of the entries list (None when the entries aren't a list) """
+    node = _build_tree(schema).items.get(schema.entries + "[]")
+    if not isinstance(node, _Node):
+        return None
+    prefix = schema.entries + "[]."
+    lines = ["def transform_entry(fields):"]
+    lines.extend(f"    f{i} = fields[{i}]" for i in sorted(set(c.index for c in schema.columns if c.path.startswith(prefix))))
+    expr = _compile_node(node, lines, [], partial(_value, memo_names=_memo_names(memos or {})))
+    lines.append(f"    return {expr}")
+    return "\n".join(lines) + "\n"
+
+def batch_source(schema: Schema, memos: Optional[Dict[Column, Callable]] = None) -> str:
+    """ Generates the source of the schema's columnar batch transform function. Each
+    column is converted over the whole batch (one list per column) before the columns
+    are zipped into the records """
+    lines = ["def transform_batch(rows):"]
+    columns = dict((column, f"v{i}") for i, column in enumerate(schema.columns))
+    memo_names = _memo_names(memos or {})
+    for column, var in columns.items():
+        values = f"map(itemgetter({column.index}), rows)"
+        if column in memo_names:
+            lines.append(f"    c{var[1:]} = [{memo_names[column]}({_KEY.format('f')}) for f in {values}]")
+        elif column.converter in INLINE:
+            expr = INLINE[column.converter].format("f")
+            lines.append(f"    c{var[1:]} = [{expr} for f in {values}]")
+        elif column.converter in CONVERTERS:
+            lines.append(f"    c{var[1:]} = list(map({column.converter}, {values}))")
+        else:
+            raise ValueError(f"Unknown converter {column.converter}")
+
+    lines.append("    records = []")
+    lines.append("    append = records.append")
+    names = ", ".join(columns.values()) + ("," if len(columns) == 1 else "")
+    lines.append(f"    for {names} in zip({', '.join('c' + v[1:] for v in columns.values())}):")
+    expr = _compile_node(_build_tree(schema), lines, [], columns.__getitem__, "        ")
+    lines.append(f"        append({expr})")
+    lines.append("    return records")
+    return "\n".join(lines) + "\n"
+
+def _exec(source: str, name: str, schema: Schema, memos: Optional[Dict[Column, Callable]] = None) -> Callable:
+    """ Execs the generated source returning the function defined """
+    namespace = dict(CONVERTERS, CODE=CODE, ID=ID, NAME=NAME, itemgetter=itemgetter)
+    if memos:
+        namespace.update((name, memos[column]) for column, name in _memo_names(memos).items())
+    exec(compile(source, f"<schema {schema.name}>", "exec"), namespace)
+    return namespace[name]
+
+@lru_cache(maxsize=None)
+def _compile_schema(schema: Schema) -> Callable[[List[List[List[str]]]], Dict]:
+    return _exec(schema_source(schema), "transform", schema)
+
+@lru_cache(maxsize=None)
+def _compile_batch(schema: Schema) -> Callable[[List[List[List[List[str]]]]], List[Dict]]:
+    return _exec(batch_source(schema), "transform_batch", schema)
+
+@lru_cache(maxsize=None)
+def compile_key(schema: Schema) -> Optional[Callable[[List[List[List[str]]]], Tuple]]:
+    """ Compiles the person key function of the schema (None when it can't be keyed, see
+    key_source). Rows have equal keys when their converted person columns are equal """
+    source = key_source(schema)
+    return _exec(source, "person", schema) if source is not None else None
+
+@lru_cache(maxsize=None)
+def _compile_entry(schema: Schema) -> Optional[Callable[[List[List[List[str]]]], Dict]]:
+    source = entry_source(schema)
+    return _exec(source, "transform_entry", schema) if source is not None else None
+
+def compile_entry(schema: Schema, memos: Optional[Dict[Column, Callable]] = None) -> Optional[Callable[[List[List[List[str]]]], Dict]]:
+    """ Compiles the entry transform function of the schema (memoizing through the caches
+    given, see memoize), None when the entries aren't a list """
+    if memos:
+        source = entry_source(schema, memos)
+        return _exec(source, "transform_entry", schema, memos) if source is not None else None
+    return _compile_entry(schema)
+
+def compile_schema(schema: Schema, memos: Optional[Dict[Column, Callable]] = None) -> Callable[[List[List[List[str]]]], Dict]:
+    """ Compiles the schema into a transform function (memoizing through the caches
+    given, see memoize). Unmemoized transforms are compiled once per schema """
+    if memos:
+        return _exec(schema_source(schema, memos), "transform", schema, memos)
+    return _compile_schema(schema)
+
+def compile_batch(schema: Schema, memos: Optional[Dict[Column, Callable]] = None) -> Callable[[List[List[List[List[str]]]]], List[Dict]]:
+    """ Compiles the schema into a columnar batch transform function (memoizing through
+    the caches given, see memoize) """
+    if memos:
+        return _exec(batch_source(schema, memos), "transform_batch", schema, memos)
+    return _compile_batch(schema)
@@ -0,0 +1,121 @@
+""" Sharded JSON Output
+
+    Large outputs are split into shards rotated by record count and | or size so
+downstream loaders can ingest them in parallel. The shards are numbered before the
+.json extension (name.00001.json, name.00002.json.gz, ...) and listed in an index
+(name.index.json) with the record range and the size on disk of each shard.
+
+    {
+        "records": 2500,
+        "shards": [
+            {"path": "name.00001.json", "start": 0, "records": 1000, "bytes": 1048576},
+            ...
+        ]
+    }
+
+    A shard is rotated once it holds the record count or once its (uncompressed) size
+reaches the size, so a shard can exceed the size by a record. The shards of a previous
+conversion (listed in its index) are removed before writing so no stale shard is left
+next to the new index. """
+import json
+import os
+from itertools import chain
+from typing import Dict, Iterable, Iterator, List, Optional
+from .compressed import compression, strip_compression, open_file
+from .json_writer import BUFFER_SIZE, JsonWriter, encoder
+
+def _base(dest: str) -> str:
+    """ The destination without its compression and .json extensions """
+    base = strip_compression(dest)
+    return base[:-5] if base.endswith(".json") else base
+
+def shard_path(dest: str, n: int) -> str:
+    """ The path of the nth (1 based) shard of the destination """
+    return "".join([_base(dest), f".{n:05d}.json", compression(dest)])
+
+def index_path(dest: str) -> str:
+    """ The path of the shard index of the destination """
+    return _base(dest) + ".index.json"
+
+def write_index(dest: str, shards: List[Dict]) -> Dict:
+    """ Writes the index of the (path, records, bytes) shards assigning their record ranges """
+    start, entries = 0, []
+    for shard in shards:
+        entries.append({"path": os.path.basename(shard["path"]), "start": start, "records": shard["records"],
+            "bytes": shard["bytes"]})
+        start += shard["records"]
+    index = {"records": start, "shards": entries}
+    tmp = index_path(dest) + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(index, f, indent=2)
+    os.replace(tmp, index_path(dest))
+    return index
+
+def remove_shards(dest: str) -> None:
+    """ Removes the index of the destination and the shards it lists (a previous conversion) """
+    path = index_path(dest)
+    try:
+        with open(path) as f:
+            shards = json.load(f)["shards"]
+    except (OSError, ValueError, KeyError):
+        return
+    os.remove(path)
+    d = os.path.dirname(dest)
+    for shard in shards:
+        shard_file = os.path.join(d, shard["path"])
+        if os.path.exists(shard_file):
+            os.remove(shard_file)
+
+class ShardWriter:
+    """ Writes the records as newline delimited JSON across shards of the destination
+    (compressed by extension), see JsonWriter. The shards of a previous conversion of the
+    destination are removed first (see remove_shards) """
+
+    def __init__(self, dest: str, shard_records: int = 0, shard_size: int = 0, level: Optional[int] = None,
+            buffer_size: int = BUFFER_SIZE, backend: str = "json"):
+        if shard_records <= 0 and shard_size <= 0:
+            raise ValueError("Either the shard records or size must be set")
+        self.dest = dest
+        self.shard_records = shard_records
+        self.shard_size = shard_size
+        self.level = level
+        self.buffer_size = buffer_size
+        self.backend = backend
+        self.encode = encoder(backend)
+        self.records = 0
+        self.shards: List[Dict] = []
+        remove_shards(dest)
+
+    def tell(self) -> int:
+        """ The bytes written to the shards """
+        return sum(shard["bytes"] for shard in self.shards)
+
+    def write(self, records: Iterable[Dict]) -> None:
+        """ Writes the records, rotating the shards as they fill up """
+        records = iter(records)
+        for record in records:
+            self.__write_shard(chain((record,), records))
+
+    def __write_shard(self, records: Iterator[Dict]) -> None:
+        path = shard_path(self.dest, len(self.shards) + 1)
+        shard_records, shard_size, encode = self.shard_records, self.shard_size, self.encode
+        size = 0
+
+        def sized(record):
+            nonlocal size
+            data = encode(record)
+            size += len(data) + 1
+            return data
+
+        def shard() -> Iterator[Dict]:
+            for cnt, record in enumerate(records, 1):
+                yield record
+                if cnt == shard_records or (shard_size and size >= shard_size):
+                    return
+
+        with open_file(path, "w", self.level) as f:
+            writer = JsonWriter(f, self.buffer_size, self.backend)
+            writer.encode = sized
+            writer.write(shard())
+        self.records += writer.records
+        self.shards.append({"path": path, "records": writer.records, "bytes": os.path.getsize(path)})
@@ -0,0 +1,158 @@
+""" Transformation Statistics
+
+    Opt-in per stage metrics. The stages are instrumented by wrapping the reader,
+transform, combine and encoder functions so nothing is measured (or paid for) unless
+a transformer is created with stats enabled. The write stage is the time left over
+once the other stages are taken out of the total. """
+from time import perf_counter
+from typing import Callable, Dict, Iterator, List
+
+class Stats:
+    """ Per stage metrics of one or more conversions """
+
+    def __init__(self):
+        self.files = 0
+        self.total_time = 0.0
+        self.rows_read = 0
+        self.bytes_read = 0
+        self.rows_rejected = 0
+        self.fast_lines = 0
+        self.quoted_lines = 0
+        self.read_time = 0.0
+        self.rows_transformed = 0
+        self.transform_time = 0.0
+        self.combines = 0
+        self.merged = 0
+        self.combine_time = 0.0
+        self.records_written = 0
+        self.bytes_written = 0
+        self.largest_record = 0
+        self.memo_hits = 0
+        self.memo_misses = 0
+
+    @property
+    def write_time(self) -> float:
+        """ Time spent encoding / writing (the total less the other stages) """
+        return max(self.total_time - self.read_time - self.transform_time - self.combine_time, 0.0)
+
+    def rows(self, r: Iterator[List[List[List[str]]]]) -> Iterator[List[List[List[str]]]]:
+        """ Times reading the rows, adding the reader's fast | quoted line counts """
+        _next = r.__next__
+        rows, secs = 0, 0.0
+        try:
+            while True:
+                start = perf_counter()
+                try:
+                    fields = _next()
+                except StopIteration:
+                    break
+                finally:
+                    secs += perf_counter() - start
+                rows += 1
+                yield fields
+        finally:
+            self.rows_read += rows
+            self.read_time += secs
+            bytes_read = getattr(r, "bytes_read", None)
+            if bytes_read is not None:
+                self.bytes_read += bytes_read()
+            self.fast_lines += getattr(r, "fast_lines", 0)
+            self.quoted_lines += getattr(r, "quoted_lines", 0)
+
+    def transform(self, transform: Callable[[List[List[List[str]]]], Dict]) -> Callable[[List[List[List[str]]]], Dict]:
+        """ Times the transform """
+        def timed(fields):
+            start = perf_counter()
+            trans = transform(fields)
+            self.transform_time += perf_counter() - start
+            self.rows_transformed += 1
+            return trans
+        return timed
+
+    def transform_batch(self, transform_batch: Callable[[List], List[Dict]]) -> Callable[[List], List[Dict]]:
+        """ Times the batch transform (columnar engine) """
+        def timed(rows):
+            start = perf_counter()
+            records = transform_batch(rows)
+            self.transform_time += perf_counter() - start
+            self.rows_transformed += len(rows)
+            return records
+        return timed
+
+    def combine(self, combine: Callable[[Dict, Dict], bool]) -> Callable[[Dict, Dict], bool]:
+        """ Times the combine counting the merged records """
+        def timed(trans, next_trans):
+            start = perf_counter()
+            merged = combine(trans, next_trans)
+            self.combine_time += perf_counter() - start
+            self.combines += 1
+            if merged:
+                self.merged += 1
+            return merged
+        return timed
+
+    def encoder(self, encode: Callable[[Dict], str]) -> Callable[[Dict], str]:
+        """ Counts the encoded records keeping the size of the largest """
+        def counted(record):
+            data = encode(record)
+            if len(data) > self.largest_record:
+                self.largest_record = len(data)
+            self.records_written += 1
+            return data
+        return counted
+
+    def memo(self, before: Dict[str, int], after: Dict[str, int]) -> None:
+        """ Adds the memo hits | misses of a conversion (the memo info before and after) """
+        self.memo_hits += after["hits"] - before["hits"]
+        self.memo_misses += after["misses"] - before["misses"]
+
+    def merge(self, other: "Stats") -> None:
+        """ Adds the metrics of another conversion (ex. a worker process) """
+        for key, value in other.__dict__.items():
+            if key == "largest_record":
+                self.largest_record = max(self.largest_record, value)
+            else:
+                setattr(self, key, getattr(self, key) + value)
+
+    def to_dict(self) -> Dict:
+        """ The metrics summary """
+        def rate(cnt, secs):
+            return round(cnt / secs, 1) if secs else None
+
+        return {
+            "files": self.files,
+            "total_time": round(self.total_time, 6),
+            "rows_per_sec": rate(self.rows_read, self.total_time),
+            "read": {
+                "rows": self.rows_read,
+                "bytes": self.bytes_read,
+                "rejected": self.rows_rejected,
+                "fast_lines": self.fast_lines,
+                "quoted_lines": self.quoted_lines,
+                "time": round(self.read_time, 6),
+                "rows_per_sec": rate(self.rows_read, self.read_time)
+            },
+            "transform": {
+                "rows": self.rows_transformed,
+                "time": round(self.transform_time, 6),
+                "rows_per_sec": rate(self.rows_transformed, self.transform_time)
+            },
+            "combine": {
+                "calls": self.combines,
+                "merged": self.merged,
+                "time": round(self.combine_time, 6)
+            },
+            "memo": {
+                "hits": self.memo_hits,
+                "misses": self.memo_misses,
+                "hit_rate": round(self.memo_hits / (self.memo_hits + self.memo_misses), 4)
+                    if self.memo_hits + self.memo_misses else None
+            },
+            "write": {
+                "records": self.records_written,
+                "bytes": self.bytes_written,
+                "largest_record": self.largest_record,
+                "time": round(self.write_time, 6),
+                "records_per_sec": rate(self.records_written, self.write_time)
+            }
+        }
@@ -1,105 +1,93 @@
 """ CSV to JSON Transformation """
-from typing import List, Dict
-from .csv_transfomer import (
-    CsvToJson,
-    transform_string,
-    transform_string_optional,
-    transform_code,
-    transform_code_optional,
-    transform_codes_optional,
-    transform_ids,
-    transform_name,
-    transform_physician,
-    transform_reactions,
-    transform_comments,
-    is_same_person
-)
-
-class AllergyToJson(CsvToJson):
-    """ Allergy CSV to Json Transformer """
+from typing import List, Dict, Optional, Union
+from .csv_transfomer import CsvToJson, is_same_person
+from .schema import (Schema, load_schema, compile_entry, compile_key, compile_schema, compile_batch, keyed_pays,
+    memoize, memo_info)
 
-    __fields__ = 19
+class SchemaToJson(CsvToJson):
+    """ CSV to Json Transformer compiled from a declarative schema (see schema.py).
+    The schema is either a dict, the path of a JSON schema file or the name of a
+    built-in schema. With a memo_size the schema's memo columns are memoized (see
+    schema.memoize). Combining is keyed on the raw person fields when the schema's person
+    columns can be keyed (see schema.compile_key) """
 
-    def combine(self, trans: Dict, next_trans: Dict) -> bool:
-        if is_same_person(trans, next_trans):
-            allergies = trans["allergys"]
-            allergies.append(next_trans["allergys"][0])
-            return True
-        return False
+    __schema__: Union[str, Dict, None] = None
 
-    def transform(self, fields: List[List[str]]) -> Dict:
-        trans = {
-            "patient": {
-                "ids": transform_ids(fields[1]),
-                "name": transform_name(fields[2]),
-                "birth_date": transform_string(fields[3]),
-                "admin_sex": transform_code(fields[4])
-            },
-            "encounter": {
-                "ids": transform_ids(fields[5])
-            },
-            "allergys": [{
-                "allergen_type": transform_code(fields[6]),
-                "allergen": transform_code(fields[7]),
-            }]
-        }
-        allergy = trans["allergys"][0]
-        transform_code_optional(fields[8], allergy, "severity")
-        transform_string_optional(fields[9], allergy, "onset")
-        transform_code_optional(fields[10], allergy, "reaction_status")
-        transform_code_optional(fields[11], allergy, "reaction_class")
-        transform_code_optional(fields[12], allergy, "source_of_info")
-        transform_string_optional(fields[13], allergy, "source_of_info_ft")
-        transform_string_optional(fields[14], allergy, "cancel_dt_tm")
-        transform_string_optional(fields[15], allergy, "reviewed_dt_tm")
-        transform_reactions(fields[16], allergy)
-        transform_physician(fields[17], allergy)
-        transform_comments(fields[18], allergy)
-        return trans
-
-class ProblemToJson(CsvToJson):
-    """ Problem CSV to Json Transformer """
+    def __init__(self, schema: Union[str, Dict, Schema, None] = None, **kwargs):
+        schema = schema if schema is not None else getattr(self, "__schema__")
+        self.schema = schema if isinstance(schema, Schema) else load_schema(schema)
+        self.__fields__ = self.schema.fields
+        self.entries = self.schema.entries
+        super().__init__(**kwargs)
+        self.__compile()
 
-    __fields__ = 26
+    def __compile(self):
+        self.memos = memoize(self.schema, self.memo_size) if self.memo_size else None
+        self.__transform = compile_schema(self.schema, self.memos)
+        self.row_key = compile_key(self.schema)
+        self.transform_entry = compile_entry(self.schema, self.memos)
+        # A subclass transform (or transform_batch) is never replaced by the compiled one
+        if self.__compiled():
+            self.transform = self.__transform
+            if self.batch_size and type(self).transform_batch is CsvToJson.transform_batch:
+                self.transform_batch = compile_batch(self.schema, self.memos)
+
+    def __getstate__(self):
+        """ The compiled transforms (and memos) can't be pickled (process pools) so they're
+        recompiled on load """
+        state = super().__getstate__()
+        del state["_SchemaToJson__transform"], state["memos"], state["row_key"], state["transform_entry"]
+        state.pop("transform", None)
+        state.pop("transform_batch", None)
+        return state
+
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        self.__compile()
+
+    def required_fields(self) -> Dict[int, str]:
+        return dict((c.index, c.path) for c in self.schema.columns if c.required)
+
+    def __compiled(self) -> bool:
+        """ Whether the compiled schema transform is used (the transform isn't overridden) """
+        return type(self).transform is SchemaToJson.transform
+
+    @property
+    def keyed(self) -> bool:
+        """ Keyed unless the combine or transform is overridden (the combine may not only
+        compare the person, the transform may not build the entry from the schema) or
+        keying doesn't pay off for the schema (see schema.keyed_pays) """
+        return type(self).combine is SchemaToJson.combine and self.__compiled() and \
+            compile_key(self.schema) is not None and compile_entry(self.schema) is not None and \
+            keyed_pays(self.schema)
+
+    def merge_row(self, trans: Dict, fields: List[List[str]]) -> bool:
+        trans[self.entries].append(self.transform_entry(fields))
+        return True
+
+    def memo_info(self) -> Optional[Dict[str, int]]:
+        return memo_info(self.memos) if self.memos is not None else None
 
     def combine(self, trans: Dict, next_trans: Dict) -> bool:
         if is_same_person(trans, next_trans):
-            problems = trans["problems"]
-            problems.append(next_trans["problems"][0])
+            entries = self.entries
+            trans[entries].append(next_trans[entries][0])
             return True
         return False
 
     def transform(self, fields: List[List[str]]) -> Dict:
-        trans = {
-            "patient": {
-                "ids": transform_ids(fields[1]),
-                "name": transform_name(fields[2]),
-                "birth_date": transform_string(fields[3]),
-                "admin_sex": transform_code(fields[4])
-            },
-            "problems": [{
-                "action_dt_tm": transform_string(fields[5]),
-                "condition": transform_code(fields[6]),
-            }]
-        }
-        problem = trans["problems"][0]
-        transform_codes_optional(fields[7], problem, "management_discipline")
-        transform_code_optional(fields[8], problem, "persistence")
-        transform_code_optional(fields[9], problem, "confirmation_status")
-        transform_code_optional(fields[10], problem, "life_cycle_status")
-        transform_string_optional(fields[11], problem, "status_dt_tm")
-        transform_string_optional(fields[12], problem, "onset_dt_tm")
-        transform_code_optional(fields[13], problem, "ranking")
-        transform_code_optional(fields[14], problem, "certainty")
-        transform_code_optional(fields[15], problem, "individual_awareness")
-        transform_code_optional(fields[16], problem, "prognosis")
-        transform_code_optional(fields[17], problem, "individual_awareness_prognosis")
-        transform_code_optional(fields[18], problem, "family_awareness")
-        transform_code_optional(fields[19], problem, "classification")
-        transform_code_optional(fields[20], problem, "cancel_reason")
-        transform_code_optional(fields[21], problem, "severity")
-        transform_code_optional(fields[22], problem, "severity_class")
-        transform_comments(fields[23], problem)
-        transform_physician(fields[24], problem)
-        transform_string_optional(fields[25], problem, "annotated_display")
-        return trans
+        """ The compiled schema transform (installed on the instance on init unless a
+        subclass overrides it, super().transform still uses it) """
+        return self.__transform(fields)
+
+class AllergyToJson(SchemaToJson):
+    """ Allergy CSV to Json Transformer """
+
+    __schema__ = "allergy"
+    __fields__ = 19
+
+class ProblemToJson(SchemaToJson):
+    """ Problem CSV to Json Transformer """
+
+    __schema__ = "problem"
+    __fields__ = 26
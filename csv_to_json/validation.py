@@ -0,0 +1,91 @@
+""" Row Validation
+
+    Opt-in checks of the CSV rows as they're read: the number of fields, unbalanced
+quotes and the required fields (schema columns marked "required"). Rows failing a
+check are written to a quarantine file instead of being converted, the conversion
+carrying on with the next row. The quarantine file (name.quarantine.json, created on
+the first rejected row) holds a JSON line per row with its line number, the error and
+the line itself.
+
+    {"line": 12, "error": "20 fields, expected 19", "data": "12,1|Hospital MRN|MRN,..."}
+
+    The checks only cost a count of the quotes, a length and an index per required
+field for each row so they're cheap enough to leave on (see the benchmark suite). """
+import json
+from typing import Callable, Dict, List, Optional, TextIO, Union
+from .compressed import strip_compression
+from .csv_reader import CsvReader, parse_row
+
+def quarantine_path(dest: str) -> str:
+    """ The path of the quarantine file of the JSON file """
+    base = strip_compression(dest)
+    return (base[:-5] if base.endswith(".json") else base) + ".quarantine.json"
+
+class Quarantine:
+    """ Writes the rejected rows to the quarantine file, opened on the first row, or to
+    the given (open) file which is left open """
+
+    def __init__(self, path: Union[str, TextIO]):
+        self.path = path if isinstance(path, str) else None
+        self.f: Optional[TextIO] = None if isinstance(path, str) else path
+        self.rows = 0
+
+    def __call__(self, line_no: int, error: str, line: str) -> None:
+        if self.f is None:
+            self.f = open(self.path, "w")
+        self.f.write(json.dumps({"line": line_no, "error": error, "data": line.rstrip("\r\n")}) + "\n")
+        self.rows += 1
+
+    def close(self) -> None:
+        if self.path is not None and self.f is not None:
+            self.f.close()
+
+class ValidatingReader(CsvReader):
+    """ Validates the rows of the reader, rejecting (to the callback) the rows failing
+    a check. The required fields map the field index to its name """
+
+    def __init__(self, r: CsvReader, required: Dict[int, str], reject: Callable[[int, str, str], None]):
+        super().__init__(r.f, r.field_cnt)
+        self.r = r
+        self.required = sorted(required.items())
+        self.reject = reject
+        self.rejected = 0
+        self.line_no = r.first_line() - 1
+        # The reader yields the raw lines, parsed once validated
+        r.parse = str
+
+    def parse(self, line: str) -> List[List[List[str]]]:
+        """ Parses the line (see CsvReader.parse) without padding the row, valid rows have
+        every field """
+        if "\"" in line:
+            self.quoted_lines += 1
+        else:
+            self.fast_lines += 1
+        return parse_row(line, 0)
+
+    def check(self, row: List[List[List[str]]]) -> Optional[str]:
+        """ The error of the row (None when valid) """
+        if len(row) != self.field_cnt:
+            return f"{len(row)} fields, expected {self.field_cnt}"
+        for i, name in self.required:
+            field = row[i]
+            if not field or not field[0][0]:
+                return f"missing {name}"
+        return None
+
+    def __next__(self):
+        for line in self.r:
+            self.line_no += 1
+            if "\"" in line and line.count("\"") % 2:
+                error = "unbalanced quotes"
+            else:
+                row = self.parse(line)
+                error = self.check(row)
+                if error is None:
+                    return row
+            self.rejected += 1
+            self.reject(self.line_no, error, line)
+        raise StopIteration()
+
+    def bytes_read(self) -> int:
+        return self.r.bytes_read()
@@ -1,15 +1,26 @@
 from setuptools import setup, find_packages, Extension
-from Cython.Build import cythonize
 
+try:
+    from Cython.Build import cythonize
+except ImportError:
+    cythonize = None
+
+# The compiled extensions are optional, csv_reader falls back to the pure Python parsing
 ext_modules = cythonize([
+    Extension("csv_to_json._speedups", ["csv_to_json/_speedups.pyx"]),
     Extension("csv_to_json.csv_reader", ["csv_to_json/csv_reader.py"]),
-    Extension("csv_to_json.csv_transfomer", ["csv_to_json/csv_transfomer.py"]),
-    Extension("csv_to_json.transfomers", ["csv_to_json/transformers.py"])],)
+    Extension("csv_to_json.csv_transfomer", ["csv_to_json/csv_transfomer.py"])],
+    compiler_directives={"language_level": "3"}) if cythonize is not None else []
 
 setup(
     name='csv_to_json',
     version='0.0.0',
     description='CSV to JSON transforms',
-    packages=find_packages(),
-    ext_modules=ext_modules
-)
\ No newline at end of file
+    packages=find_packages(exclude=["benchmarks", "benchmarks.*"]),
+    package_data={"csv_to_json": ["schemas/*.json"]},
+    ext_modules=ext_modules,
+    extras_require={
+        "orjson": ["orjson"],
+        "zstd": ["zstandard"]
+    }
+)
@@ -0,0 +1,26 @@
+import io
+
+from testfixtures import TempDirectory
+
+from csv_to_json.csv_transfomer import CsvToJson
+from csv_to_json.transformers import AllergyToJson
+
+def write_allergys(dir: TempDirectory, filename: str = "allergys.csv", people: int = 20, rows: int = 5) -> str:
+    """ Writes allergy rows for a handful of people with 1 - rows rows each """
+    with open("tests/resources/allergy.csv") as f:
+        line = f.readline().rstrip("\n")
+    lines = ["SEQ|PERSON"]
+    for i in range(people):
+        lines.extend(line.replace("ZZLast", f"ZZLast{i}") for _ in range(i % rows + 1))
+    return dir.write(filename, "\n".join(lines) + "\n", encoding="utf-8")
+
+def convert(transformer: CsvToJson, src: str) -> str:
+    """ The JSON of the CSV file converted in memory """
+    f = io.StringIO()
+    with open(src) as f_csv:
+        transformer.csv_to_json(f_csv, f)
+    return f.getvalue()
+
+def expected(src: str, combine: bool) -> str:
+    """ The allergy JSON the conversions are compared to """
+    return convert(AllergyToJson(combine=combine), src)
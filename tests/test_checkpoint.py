@@ -0,0 +1,60 @@
+import gzip
+import os
+import pytest
+
+from typing import Iterator
+from testfixtures import TempDirectory
+
+from csv_to_json.checkpoint import Manifest, convert_checkpointed
+from csv_to_json.parallel import chunk_ranges
+from csv_to_json.transformers import AllergyToJson
+from conftest import expected, write_allergys
+
+@pytest.fixture()
+def dir() -> Iterator[TempDirectory]:
+    with TempDirectory() as dir:
+        yield dir
+
+@pytest.mark.parametrize("combine", [False, True])
+def test_convert_checkpointed(dir: TempDirectory, combine: bool) -> None:
+    src, dest = write_allergys(dir, people=10, rows=3), dir.getpath("allergys.json")
+    manifest = Manifest(dir.getpath("manifest.json"))
+    transformer = AllergyToJson(combine=combine, stats=True)
+    assert convert_checkpointed(transformer, src, dest, manifest, 2000)
+    assert dir.read("allergys.json", encoding="utf-8") == expected(src, combine)
+    # Converted in several segments, counted as a single file
+    assert len(chunk_ranges(transformer, src, 2000)) > 1
+    assert transformer.stats.files == 1
+    assert transformer.stats.rows_read == 19
+    assert transformer.stats.records_written == len(expected(src, combine).split("\n"))
+    assert Manifest(dir.getpath("manifest.json")).get(src)["status"] == "done"
+
+    # Unchanged files are skipped
+    assert not convert_checkpointed(AllergyToJson(combine=combine), src, dest, manifest, 2000)
+
+def test_convert_checkpointed_resume(dir: TempDirectory) -> None:
+    src, dest = write_allergys(dir, people=10, rows=3), dir.getpath("allergys.json.gz")
+    transformer = AllergyToJson(combine=True)
+    rows_to_json, calls = transformer.rows_to_json, []
+
+    def fail(r, f, records=0):
+        calls.append(records)
+        if len(calls) == 3:
+            raise IOError("disk full")
+        return rows_to_json(r, f, records)
+
+    transformer.rows_to_json = fail
+    with pytest.raises(IOError):
+        convert_checkpointed(transformer, src, dest, Manifest(dir.getpath("manifest.json")), 2000)
+    assert not os.path.exists(dest)
+    entry = Manifest(dir.getpath("manifest.json")).get(src)
+    assert entry["status"] == "partial" and entry["offset"] > 0
+
+    resumed = AllergyToJson(combine=True)
+    resumed_rows_to_json, resumed_calls = resumed.rows_to_json, []
+    resumed.rows_to_json = lambda r, f, records=0: resumed_calls.append(records) or resumed_rows_to_json(r, f, records)
+    assert convert_checkpointed(resumed, src, dest, Manifest(dir.getpath("manifest.json")), 2000)
+    assert resumed_calls[0] == entry["records"]
+    with gzip.open(dest, "rt") as f_json:
+        assert f_json.read() == expected(src, True)
+    assert sorted(os.listdir(dir.path)) == ["allergys.csv", "allergys.json.gz", "manifest.json"]
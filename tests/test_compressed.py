@@ -0,0 +1,67 @@
+import bz2
+import gzip
+import pytest
+import types
+
+from typing import Iterator
+from testfixtures import TempDirectory
+
+from csv_to_json import compressed
+from csv_to_json.compressed import compression, strip_compression, open_file
+from csv_to_json.csv_reader import reader
+from csv_to_json.parallel import convert_files
+from csv_to_json.transformers import AllergyToJson
+from conftest import expected
+
+@pytest.fixture()
+def dir() -> Iterator[TempDirectory]:
+    with TempDirectory() as dir:
+        yield dir
+
+def test_compression() -> None:
+    assert compression("a.csv.gz") == ".gz"
+    assert compression("a.csv") == ""
+    assert strip_compression("a.csv.bz2") == "a.csv"
+
+@pytest.mark.parametrize("ext", [".gz", ".bz2", ".zst"])
+def test_open_file(dir: TempDirectory, ext: str) -> None:
+    if ext == ".zst" and compressed.zstd is None:
+        with pytest.raises(ValueError):
+            open_file(dir.getpath("a.csv.zst"), "w")
+        return
+
+    path = dir.getpath("a.csv" + ext)
+    with open_file(path, "w", 1) as f:
+        f.write("SEQ|\nabc\n")
+    with open_file(path) as f:
+        assert f.read() == "SEQ|\nabc\n"
+
+@pytest.mark.parametrize("name", ["zstandard", "compression.zstd"])
+def test_open_zstd_level(monkeypatch, name: str) -> None:
+    """ The level is passed the way each zstd module takes it (both have a ZstdCompressor) """
+    calls = []
+    module = types.ModuleType(name)
+    module.ZstdCompressor = lambda level: ("cctx", level)
+    module.open = lambda path, mode, **kwargs: calls.append(kwargs)
+    monkeypatch.setattr(compressed, "zstd", module)
+    open_file("a.json.zst", "w", 3)
+    expected = {"cctx": ("cctx", 3)} if name == "zstandard" else {"level": 3}
+    assert calls == [dict(expected, encoding="utf-8")]
+
+def test_reader_compressed(dir: TempDirectory) -> None:
+    with open("tests/resources/allergys.csv", "rb") as f_csv:
+        path = dir.write("allergys.csv.gz", gzip.compress(f_csv.read()))
+    with open("tests/resources/allergys.csv") as f_csv:
+        assert list(reader(path, 19)) == list(reader(f_csv, 19))
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_convert_compressed(dir: TempDirectory, workers: int) -> None:
+    with open("tests/resources/allergys.csv", "rb") as f_csv:
+        src = dir.write("allergys.csv.bz2", bz2.compress(f_csv.read()))
+    dest = dir.getpath("allergys.json.gz")
+    if workers > 1:
+        convert_files(AllergyToJson(combine=True), [(src, dest)], workers, level=1)
+    else:
+        AllergyToJson(combine=True).convert_file(src, dest, level=1)
+    with gzip.open(dest, "rt") as f_json:
+        assert f_json.read() == expected("tests/resources/allergys.csv", True)
@@ -1,3 +1,6 @@
+import io
+import os
+
 from csv_to_json.csv_reader import *
 
 def test_strip_quotes_no_quotes():
@@ -30,6 +33,32 @@ def test_parse_fields_encapsulated():
 def test_parse_fields_repeat():
     assert parse_fields("a|b|c~d|e|f") == [["a", "b", "c"], ["d", "e", "f"]]
 
+def test_parse_line():
+    assert parse_line("1,a|b|c~d|e|f,,d") == [[["1"]], [["a", "b", "c"], ["d", "e", "f"]], [], [["d"]]]
+
+def test_parse_line_encapsulated():
+    line = "1,\"a,\"\"\"|b|\",|~\",\"e\"|\"f\"\"\"~\"a~\"|\"b|\"|\"c,\""
+    assert parse_line(line) == [[["1"]], [["a,\"", "b", ",|~"]], [["e", "f\""], ["a~", "b|", "c,"]]]
+
+def test_parse_line_matches_parse_fields():
+    lines = ["", ",", "~", "|", "\"", "a,,b", "~a~~b|", "\"a\"b|c\"", "x\"y,z", "\"\"\"\",a", "a|\"b~c", "~|~"]
+    for name in ["allergy", "problem", "test_csv_reader"]:
+        with open(f"tests/resources/{name}.csv") as csv:
+            lines.extend(line.rstrip("\n") for line in csv)
+    for line in lines:
+        assert parse_line(line) == list(map(parse_fields, split_escaped(line, ","))), line
+
+def test_split_line():
+    for line in ["", ",", "~", "|", "a,,b", "~a~~b|", "1,a|b|c~d|e|f,,d", "~|~"]:
+        assert split_line(line) == parse_line(line), line
+
+def test_reader_fast_path():
+    with open("tests/resources/allergys.csv") as csv:
+        lines = csv.read().splitlines()
+    r = reader(io.StringIO("\n".join([lines[0], lines[1].replace("\"", "")])), 19)
+    assert list(r)[1] == parse_row(lines[1].replace("\"", ""), 19)
+    assert (r.fast_lines, r.quoted_lines) == (1, 1)
+
 def test_csv_to_empty_dict():
     assert csv_to_dict([[]], ["FIELD1", "FIELD2"]) == {}
 
@@ -45,3 +74,36 @@ def test_csv_to_list():
 def test_reader():
     with open("tests/resources/test_csv_reader.csv") as csv:
         assert list(reader(csv, 3)) == [[[["1"]], [["a", "b", "c"], ["d", "e", "f"]], [["d"]], [["e", "f\""], ["a~", "b|", "c,"]]]]
+
+def test_mmap_reader():
+    for name, field_cnt in [("allergys", 19), ("problems", 26), ("test_csv_reader", 3)]:
+        path = f"tests/resources/{name}.csv"
+        with open(path) as csv:
+            assert list(mmap_reader(path, field_cnt)) == list(reader(csv, field_cnt)), name
+
+def test_mmap_reader_empty(tmp_path):
+    path = tmp_path / "empty.csv"
+    path.write_bytes(b"")
+    assert list(mmap_reader(str(path), 3)) == []
+
+def test_range_reader():
+    path = "tests/resources/allergys.csv"
+    with open(path, "rb") as csv:
+        split, size = len(csv.readline()), os.path.getsize(path)
+    with open(path) as csv:
+        rows = list(reader(csv, 19))
+    assert list(range_reader(path, 19, 0, split)) == rows[:1]
+    assert list(range_reader(path, 19, split, size)) == rows[1:]
+
+def test_reader_intern():
+    with open("tests/resources/allergys.csv") as csv:
+        expected = list(reader(csv, 19))
+    with open("tests/resources/allergys.csv") as csv:
+        rows = list(reader(csv, 19).intern())
+    assert rows == expected
+    assert rows[0][1][0][1] is rows[1][1][0][1]
+
+def test_reader_intern_bounded():
+    r = reader(io.StringIO("NPI|SNOMED|RXCUI\nMRN|FIN|CMRN\nNPI|SNOMED|RXCUI"), 1).intern(3)
+    first, second, third = list(r)
+    assert first == third and first[0][0][0] is not third[0][0][0]
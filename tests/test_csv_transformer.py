@@ -1,4 +1,4 @@
-from csv_to_json.csv_transfomer import transform_fields, identity_transform
+from csv_to_json.csv_transfomer import CsvToJson, transform_fields, identity_transform
 
 def test_identity_transform():
     orig, trans = { "FIELD1": "VAL1" }, {}
@@ -14,3 +14,20 @@ def test_transform_fields_empty():
     expected, trans = {}, {}
     transform_fields({}, { "FIELD1": "FIELD2" }, trans, "FIELD3")
     assert trans == expected
+
+def test_keyed_defaults():
+    """ A transformer that can't key its rows combines the transformed records """
+    class Transformer(CsvToJson):
+        __fields__ = 2
+
+        def transform(self, fields):
+            return { "key": fields[1][0][0] }
+
+        def combine(self, trans, next):
+            return trans == next
+
+    rows = [[[""]], [["a"]]], [[[""]], [["a"]]], [[[""]], [["b"]]]
+    transformer = Transformer(combine=True)
+    assert not transformer.keyed
+    assert transformer.row_key(rows[0]) is None and not transformer.merge_row({}, rows[0])
+    assert list(transformer.transformation(iter(rows))) == [{ "key": "a" }, { "key": "b" }]
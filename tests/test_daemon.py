@@ -0,0 +1,78 @@
+import json
+import os
+import threading
+import pytest
+
+from typing import Iterator
+from testfixtures import TempDirectory
+
+from csv_to_json.daemon import Service, submit
+from csv_to_json.transformers import AllergyToJson, ProblemToJson
+
+TRANSFORMERS = {"ALLERGY": AllergyToJson, "PROBLEM": ProblemToJson}
+
+@pytest.fixture()
+def dir() -> Iterator[TempDirectory]:
+    with TempDirectory() as dir:
+        dir.makedir("in")
+        dir.makedir("out")
+        yield dir
+
+def service(dir: TempDirectory, **kwargs) -> Service:
+    return Service(lambda trans_type: TRANSFORMERS[trans_type](), "ALLERGY", dir.getpath("in"), dir.getpath("out"),
+        **kwargs)
+
+def test_service_convert(dir: TempDirectory) -> None:
+    """ The transformers are built once per type and reused """
+    s = service(dir)
+    for i, name in enumerate(["allergys", "problems", "allergys"]):
+        dir.write(f"in/{name}{i}.csv", open(f"tests/resources/{name}.csv").read(), encoding="utf-8")
+        result = s.convert(f"{name}{i}.csv", name[:-1].upper())
+        assert (result["dest"], result["records"]) == (f"{name}{i}.json", 2)
+        assert dir.read(f"out/{name}{i}.json", encoding="utf-8") == open(f"tests/resources/{name}.json").read()
+    assert sorted(s.transformers) == ["ALLERGY", "PROBLEM"]
+    assert os.listdir(dir.getpath("in")) == []
+
+@pytest.mark.parametrize("filename", ["../allergys.csv", "allergys.txt"])
+def test_service_invalid(dir: TempDirectory, filename: str) -> None:
+    with pytest.raises(ValueError):
+        service(dir).convert(filename)
+
+def test_service_watch(dir: TempDirectory) -> None:
+    """ Files are converted once unchanged between polls, failures don't stop the service """
+    s, stop = service(dir, keep=True), threading.Event()
+    dir.write("in/invalid.csv", b"\xff\xfe")
+    dir.write("in/allergys.csv", open("tests/resources/allergys.csv").read(), encoding="utf-8")
+    converted = threading.Event()
+    convert = s.convert
+    def counted(filename, trans_type=None):
+        try:
+            return convert(filename, trans_type)
+        finally:
+            if filename == "allergys.csv":
+                converted.set()
+    s.convert = counted
+    thread = threading.Thread(target=s.watch, args=(0.01, stop))
+    thread.start()
+    try:
+        assert converted.wait(5)
+    finally:
+        stop.set()
+        thread.join()
+    assert dir.read("out/allergys.json", encoding="utf-8") == open("tests/resources/allergys.json").read()
+
+def test_service_serve(dir: TempDirectory) -> None:
+    s = service(dir)
+    dir.write("in/allergys.csv", open("tests/resources/allergys.csv").read(), encoding="utf-8")
+    path = dir.getpath("csv_to_json.sock")
+    with s.serve(path) as server:
+        thread = threading.Thread(target=server.serve_forever, args=(0.01,))
+        thread.start()
+        try:
+            assert submit(path, "allergys.csv", timeout=5)["records"] == 2
+            assert "error" in submit(path, "missing.csv", timeout=5)
+            assert "error" in submit(path, "allergys.csv", "UNKNOWN", timeout=5)
+        finally:
+            server.shutdown()
+            thread.join()
+    assert json.loads(dir.read("out/allergys.json", encoding="utf-8").split("\n")[0])["patient"]
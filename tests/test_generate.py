@@ -0,0 +1,25 @@
+import io
+import pytest
+
+from typing import Iterator
+from testfixtures import TempDirectory
+
+from benchmarks.generate import generate
+from csv_to_json.transformers import AllergyToJson, ProblemToJson
+
+@pytest.fixture()
+def dir() -> Iterator[TempDirectory]:
+    with TempDirectory() as dir:
+        yield dir
+
+@pytest.mark.parametrize("transformer, name", [(AllergyToJson, "allergy"), (ProblemToJson, "problem")])
+def test_generate(dir: TempDirectory, transformer, name: str) -> None:
+    """ The generated rows are combined by patient cluster """
+    path = dir.getpath(f"{name}.csv")
+    rows = generate(path, name, 20000, quotes=0.2, repeats=3, cluster=4)
+    assert rows > 4
+
+    f = io.StringIO()
+    with open(path) as f_csv:
+        transformer(combine=True).csv_to_json(f_csv, f)
+    assert len(f.getvalue().split("\n")) == (rows + 3) // 4
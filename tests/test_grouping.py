@@ -0,0 +1,54 @@
+import io
+import json
+import os
+import pytest
+
+from typing import Iterator
+from testfixtures import TempDirectory
+
+from csv_to_json import grouping
+from csv_to_json.grouping import sort_records
+from csv_to_json.transformers import AllergyToJson
+
+@pytest.fixture()
+def dir() -> Iterator[TempDirectory]:
+    with TempDirectory() as dir:
+        yield dir
+
+def records(cnt: int):
+    return [{"key": str(i % 7), "seq": i} for i in range(cnt)]
+
+@pytest.mark.parametrize("budget", [1, 100, 1024 * 1024])
+def test_sort_records(dir: TempDirectory, budget: int) -> None:
+    """ Stable sort by key spilling runs (removed once merged) """
+    expected = sorted(records(50), key=lambda r: r["key"])
+    assert list(sort_records(records(50), lambda r: r["key"], budget, dir.path)) == expected
+    assert os.listdir(dir.path) == []
+
+def test_sort_records_in_memory(dir: TempDirectory) -> None:
+    """ The records aren't encoded | decoded unless spilled """
+    items = records(50)
+    assert {id(r) for r in sort_records(items, lambda r: r["key"], 1024 * 1024, dir.path)} == set(map(id, items))
+    spilled = list(sort_records(items, lambda r: r["key"], 300, dir.path))
+    assert spilled == sorted(items, key=lambda r: r["key"])
+    assert 0 < sum(any(r is item for item in items) for r in spilled) < len(items)
+
+def test_sort_records_merge_passes(dir: TempDirectory, monkeypatch) -> None:
+    monkeypatch.setattr(grouping, "MAX_RUNS", 3)
+    expected = sorted(records(50), key=lambda r: r["key"])
+    assert list(sort_records(records(50), lambda r: r["key"], 1, dir.path)) == expected
+    assert os.listdir(dir.path) == []
+
+@pytest.mark.parametrize("budget", [1, 1024 * 1024])
+def test_group_transform(dir: TempDirectory, budget: int) -> None:
+    """ The records of a person are combined when they aren't adjacent """
+    with open("tests/resources/allergy.csv") as f:
+        line = f.readline().rstrip("\n")
+    lines = [line.replace("ZZLast", f"ZZLast{i % 3}").replace("20180724", str(i)) for i in range(9)]
+    f = io.StringIO()
+    AllergyToJson(group=True, group_budget=budget, group_dir=dir.path).csv_to_json(io.StringIO("\n".join(lines)), f)
+
+    records = [json.loads(line) for line in f.getvalue().split("\n")]
+    assert [r["patient"]["name"]["last"] for r in records] == ["ZZLast0", "ZZLast1", "ZZLast2"]
+    assert [a["onset"] for a in records[1]["allergys"]] == ["1", "4", "7"]
+    assert os.listdir(dir.path) == []
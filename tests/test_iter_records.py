@@ -0,0 +1,116 @@
+import asyncio
+import gzip
+import io
+import json
+import pytest
+import threading
+
+from typing import Iterator, List
+from testfixtures import TempDirectory
+
+from csv_to_json.csv_transfomer import to_columns
+from csv_to_json.transformers import AllergyToJson, ProblemToJson
+
+@pytest.fixture()
+def dir() -> Iterator[TempDirectory]:
+    with TempDirectory() as dir:
+        yield dir
+
+def expected(name: str) -> List[dict]:
+    with open(f"tests/resources/{name}.json") as f:
+        return [json.loads(line) for line in f]
+
+@pytest.mark.parametrize("transformer, name", [(AllergyToJson, "allergys"), (ProblemToJson, "problems")])
+@pytest.mark.parametrize("combine", [False, True])
+@pytest.mark.parametrize("mmap", [False, True])
+def test_iter_records(transformer, name: str, combine: bool, mmap: bool) -> None:
+    records = transformer(combine=combine).iter_records(f"tests/resources/{name}.csv", mmap)
+    assert not isinstance(records, list)
+    assert list(records) == expected(f"{name}_combined" if combine else name)
+
+def test_iter_records_file(dir: TempDirectory) -> None:
+    with open("tests/resources/allergys.csv") as f:
+        assert list(AllergyToJson().iter_records(f)) == expected("allergys")
+        assert not f.closed
+    src = dir.getpath("allergys.csv.gz")
+    with gzip.open(src, "wt") as f, open("tests/resources/allergys.csv") as f_csv:
+        f.write(f_csv.read())
+    assert list(AllergyToJson().iter_records(src)) == expected("allergys")
+
+def test_iter_records_lazy() -> None:
+    """ The rows are read as the records are consumed """
+    f = io.StringIO(open("tests/resources/allergys.csv").read())
+    records = AllergyToJson().iter_records(f)
+    assert next(records) == expected("allergys")[0]
+    assert f.tell() < len(f.getvalue())
+    records.close()
+
+def test_iter_records_stats() -> None:
+    transformer = AllergyToJson(combine=True, stats=True)
+    assert len(list(transformer.iter_records("tests/resources/allergys.csv"))) == 1
+    assert (transformer.stats.rows_read, transformer.stats.merged) == (2, 1)
+
+def test_iter_batches() -> None:
+    transformer = AllergyToJson()
+    assert list(transformer.iter_batches("tests/resources/allergys.csv", 1)) == [[r] for r in expected("allergys")]
+    assert list(transformer.iter_batches("tests/resources/allergys.csv", 5)) == [expected("allergys")]
+    columns = list(transformer.iter_batches("tests/resources/allergys.csv", 5, columnar=True))
+    assert columns == [to_columns(expected("allergys"))]
+    assert list(columns[0]) == ["patient", "encounter", "allergys"]
+
+def test_to_columns() -> None:
+    assert to_columns([{"a": 1, "b": 2}, {"b": 3, "c": 4}]) == {"a": [1, None], "b": [2, 3], "c": [None, 4]}
+    assert to_columns([]) == {}
+
+def test_aiter_records() -> None:
+    async def collect(transformer: AllergyToJson) -> tuple:
+        records = [record async for record in transformer.aiter_records("tests/resources/allergys.csv", batch_size=1)]
+        batches = [batch async for batch in transformer.aiter_batches("tests/resources/allergys.csv", 1)]
+        return records, batches
+
+    records, batches = asyncio.run(collect(AllergyToJson()))
+    assert records == expected("allergys")
+    assert batches == [[r] for r in expected("allergys")]
+
+class BlockingFile(io.StringIO):
+    """ Blocks reading the lines after the first until released """
+
+    def __init__(self, text: str):
+        super().__init__(text)
+        self.reading, self.release = threading.Event(), threading.Event()
+
+    def readline(self, *args) -> str:
+        if self.tell():
+            self.reading.set()
+            self.release.wait(5)
+        return super().readline(*args)
+
+def test_aiter_records_cancel() -> None:
+    """ Cancelling while a batch is read on the executor raises CancelledError, the
+    batches are closed once the read returns """
+    f = BlockingFile(open("tests/resources/allergys.csv").read())
+
+    async def cancel() -> None:
+        task = asyncio.create_task(AllergyToJson().aiter_records(f, batch_size=2).__anext__())
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, f.reading.wait, 5)
+        task.cancel()
+        loop.call_later(0.05, f.release.set)
+        await task
+
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(cancel())
+    assert f.release.is_set()
+
+@pytest.mark.parametrize("memo_size", [0, 16])
+def test_iter_records_mutation(memo_size: int) -> None:
+    """ Modifying a yielded record doesn't change the next records (memoized values included) """
+    with open("tests/resources/allergy.csv") as f:
+        line = f.readline()
+    records = AllergyToJson(memo_size=memo_size).iter_records(io.StringIO(line * 3))
+    first = next(records)
+    first["patient"]["name"]["last"] = "Changed"
+    first["patient"]["ids"].clear()
+    first["encounter"]["ids"][0]["id"] = "0"
+    first["allergys"][0]["physician"]["name"]["first"] = "Changed"
+    assert list(records) == expected("allergy") * 2
@@ -0,0 +1,68 @@
+import io
+import json
+import pytest
+
+from csv_to_json.compressed import open_file
+from csv_to_json.json_writer import JsonWriter, encoder
+from csv_to_json.transformers import AllergyToJson, ProblemToJson
+
+RECORDS = [{ "a": "b", "c": [{ "d": "e\"f" }] }, { "g": "é" }, {}]
+
+def test_json_encoder():
+    encode = encoder("json")
+    for record in RECORDS:
+        assert encode(record) == json.dumps(record)
+
+def test_encoder_invalid():
+    with pytest.raises(ValueError):
+        encoder("yaml")
+
+@pytest.mark.parametrize("backend", ["json", "orjson"])
+def test_encoder_backends(backend: str):
+    if backend == "orjson":
+        pytest.importorskip("orjson")
+    encode = encoder(backend)
+    assert [json.loads(encode(record)) for record in RECORDS] == RECORDS
+
+def test_encoder_orjson_missing(mocker):
+    """ orjson is never silently replaced (its bytes differ) """
+    mocker.patch("csv_to_json.json_writer.load_orjson", return_value=None)
+    with pytest.raises(ValueError):
+        encoder("orjson")
+    with pytest.raises(ValueError):
+        encoder("auto")
+
+def test_orjson_utf8(tmp_path, mocker):
+    """ The JSON files are written as UTF-8 whatever the locale """
+    pytest.importorskip("orjson")
+    dest = str(tmp_path / "a.json")
+    with open_file(dest, "w") as f:
+        assert f.encoding == "utf-8"
+        JsonWriter(f, backend="orjson").write(iter(RECORDS))
+    with open(dest, encoding="utf-8") as f:
+        assert [json.loads(line) for line in f] == RECORDS
+
+@pytest.mark.parametrize("buffer_size", [1, 20, 4096])
+def test_json_writer(buffer_size: int):
+    f = io.StringIO()
+    writer = JsonWriter(f, buffer_size)
+    writer.write(iter(RECORDS[:2]))
+    writer.write(iter(RECORDS[2:]))
+    assert f.getvalue() == "\n".join(map(json.dumps, RECORDS))
+    assert writer.records == 3
+
+def test_json_writer_empty():
+    f = io.StringIO()
+    JsonWriter(f).write(iter([]))
+    assert f.getvalue() == ""
+
+@pytest.mark.parametrize("transformer,name", [
+    (AllergyToJson(), "allergy"), (AllergyToJson(), "allergys"), (AllergyToJson(combine=True), "allergys"),
+    (ProblemToJson(), "problem"), (ProblemToJson(), "problems"), (ProblemToJson(combine=True), "problems")])
+def test_csv_to_json_output(transformer, name: str):
+    """ The output is byte identical to the original json.dumps writer """
+    f = io.StringIO()
+    with open(f"tests/resources/{name}.csv") as f_csv:
+        transformer.csv_to_json(f_csv, f)
+    with open(f"tests/resources/{name}{'_combined' if transformer.combined else ''}.json") as f_json:
+        assert f.getvalue() == f_json.read()
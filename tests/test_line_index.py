@@ -0,0 +1,115 @@
+import argparse
+import json
+import os
+import pytest
+
+from typing import Iterator, List
+from testfixtures import TempDirectory
+
+from benchmarks.generate import generate
+from csv_to_json.csv_reader import mmap_reader
+from csv_to_json.line_index import (build_index, convert_lines, convert_people, index_file, line_index_path,
+    load_index, remove_csv, select_lines)
+from csv_to_json.parallel import chunk_ranges, convert_files
+from csv_to_json.transformers import AllergyToJson
+from transform import person
+
+@pytest.fixture()
+def dir() -> Iterator[TempDirectory]:
+    with TempDirectory() as dir:
+        yield dir
+
+@pytest.fixture()
+def src(dir: TempDirectory) -> str:
+    """ 3 consecutive rows per patient """
+    path = dir.getpath("allergy.csv")
+    generate(path, "allergy", 64 * 1024, 0.1, 2, 3)
+    return path
+
+def records(path: str) -> List[dict]:
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+def all_records(src: str) -> List[dict]:
+    transformer = AllergyToJson()
+    return list(map(transformer.transform, mmap_reader(src, 19)))
+
+@pytest.mark.parametrize("every", [1, 7, 1000])
+def test_select_lines(dir: TempDirectory, src: str, every: int) -> None:
+    index_file(src, every=every)
+    expected = all_records(src)
+    dest = dir.getpath("allergy.json")
+    # Line 1 is the header
+    assert convert_lines(AllergyToJson(), src, dest, 10, 25) == 16
+    assert records(dest) == expected[8:24]
+    assert list(select_lines(AllergyToJson(), src, 1, 2)) == list(mmap_reader(src, 19))[:1]
+    assert list(select_lines(AllergyToJson(), src, len(expected) + 2, len(expected) + 10)) == []
+
+def test_select_lines_no_header(dir: TempDirectory) -> None:
+    with open("tests/resources/allergys.csv") as f:
+        lines = f.readlines()
+    src = dir.write("allergys.csv", "".join(lines * 3), encoding="utf-8")
+    assert list(select_lines(AllergyToJson(), src, 4, 4)) == list(mmap_reader(src, 19))[3:4]
+
+def test_convert_people(dir: TempDirectory, src: str) -> None:
+    expected = all_records(src)
+    patients = [expected[3]["patient"], expected[40]["patient"]]
+    dest = dir.getpath("allergy.json")
+    assert convert_people(AllergyToJson(), src, dest, patients) == 6
+    assert records(dest) == expected[3:6] + expected[39:42]
+    assert os.path.exists(line_index_path(src))
+
+def test_convert_people_missing(dir: TempDirectory, src: str) -> None:
+    patient = dict(all_records(src)[0]["patient"], birth_date="18000101")
+    assert convert_people(AllergyToJson(), src, dir.getpath("allergy.json"), [patient]) == 0
+
+def test_person_argument() -> None:
+    """ --person is a JSON patient with the fields of the person key """
+    patient = {"name": {"last": "ZZLast"}, "birth_date": "1950", "admin_sex": {"id": "F"}}
+    assert person(json.dumps(patient)) == patient
+    for value in ["{", "[]", json.dumps({"name": {"last": "ZZLast"}})]:
+        with pytest.raises(argparse.ArgumentTypeError):
+            person(value)
+
+def test_remove_csv(dir: TempDirectory, src: str) -> None:
+    """ The line index is removed along with the converted CSV file """
+    index_file(src)
+    other = dir.write("other.csv", "1,2,Last\n", encoding="utf-8")
+    remove_csv(src)
+    remove_csv(other)
+    assert os.listdir(dir.path) == []
+
+def test_stale_index(dir: TempDirectory, src: str) -> None:
+    index_file(src)
+    assert load_index(src) is not None
+    with open(src, "a") as f:
+        f.write(open(src).readlines()[-1])
+    assert load_index(src) is None
+    # Rebuilt when selecting
+    rows = list(select_lines(AllergyToJson(), src, 2, 1000000))
+    assert len(rows) == load_index(src).rows
+
+def test_compressed_index(dir: TempDirectory) -> None:
+    with pytest.raises(ValueError):
+        build_index(dir.write("a.csv.gz", b""))
+
+def test_index_people(src: str) -> None:
+    index = build_index(src, AllergyToJson(), 5)
+    assert index.first_line == 2 and index.offsets[0] == len("SEQ|ALLERGY\n")
+    assert len(index.offsets) == (index.rows + 4) // 5
+    runs = sorted(run for ranges in index.people.values() for run in ranges)
+    assert len(runs) == (index.rows + 2) // 3
+    assert runs[0][0] == index.offsets[0] and runs[-1][1] == index.size
+
+@pytest.mark.parametrize("combine", [False, True])
+def test_chunk_ranges_index(dir: TempDirectory, src: str, combine: bool) -> None:
+    transformer = AllergyToJson(combine=combine)
+    index_file(src, transformer, 5)
+    ranges = chunk_ranges(transformer, src, 8 * 1024)
+    assert len(ranges) > 4 and ranges[0][0] == 0 and ranges[-1][1] == os.path.getsize(src)
+    assert all(end == next_start for (_, end), (next_start, _) in zip(ranges, ranges[1:]))
+
+    with open(src) as f_csv, open(dir.getpath("expected.json"), "w") as f_json:
+        AllergyToJson(combine=combine).csv_to_json(f_csv, f_json)
+    convert_files(transformer, [(src, dir.getpath("allergy.json"))], 2, 8 * 1024, False)
+    assert dir.read("allergy.json", encoding="utf-8") == dir.read("expected.json", encoding="utf-8")
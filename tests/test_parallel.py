@@ -0,0 +1,37 @@
+import os
+import pytest
+
+from typing import Iterator
+from testfixtures import TempDirectory
+
+from csv_to_json.transformers import AllergyToJson
+from csv_to_json.parallel import chunk_ranges, convert_files
+from conftest import expected, write_allergys
+
+@pytest.fixture()
+def dir() -> Iterator[TempDirectory]:
+    with TempDirectory() as dir:
+        yield dir
+
+def test_chunk_ranges() -> None:
+    ranges = chunk_ranges(AllergyToJson(), "tests/resources/allergys.csv", 10)
+    assert len(ranges) == 2
+    assert ranges[0][0] == 0 and ranges[0][1] == ranges[1][0]
+
+def test_chunk_ranges_combine() -> None:
+    """ Both allergys are for the same person so the file can't be split """
+    assert len(chunk_ranges(AllergyToJson(combine=True), "tests/resources/allergys.csv", 10)) == 1
+
+@pytest.mark.parametrize("combine", [False, True])
+def test_convert_files(dir: TempDirectory, combine: bool) -> None:
+    src = write_allergys(dir)
+    other = dir.write("allergy.csv", open("tests/resources/allergy.csv").read(), encoding="utf-8")
+    json = expected(src, combine)
+    assert len(chunk_ranges(AllergyToJson(combine=combine), src, 2000)) > 1
+
+    convert_files(AllergyToJson(combine=combine), [(src, dir.getpath("allergys.json")),
+        (other, dir.getpath("allergy.json"))], 2, 2000)
+    with open(dir.getpath("allergys.json")) as f_json:
+        assert f_json.read() == json
+    assert dir.read("allergy.json", encoding="utf-8") == expected("tests/resources/allergy.csv", combine)
+    assert sorted(os.listdir(dir.path)) == ["allergy.json", "allergys.json"]
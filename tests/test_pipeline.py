@@ -0,0 +1,31 @@
+import pytest
+
+from csv_to_json.pipeline import pipeline
+from csv_to_json.transformers import AllergyToJson, ProblemToJson
+from conftest import convert
+
+@pytest.mark.parametrize("combine", [False, True])
+@pytest.mark.parametrize("stats", [False, True])
+def test_pipeline_transform(combine: bool, stats: bool) -> None:
+    for transformer, path in [(AllergyToJson, "tests/resources/allergys.csv"), (ProblemToJson, "tests/resources/problems.csv")]:
+        assert convert(transformer(combine=combine, stats=stats, pipeline=True), path) == \
+            convert(transformer(combine=combine), path)
+
+@pytest.mark.parametrize("batch_size, queue_size", [(1, 1), (2, 1), (512, 8)])
+def test_pipeline(batch_size: int, queue_size: int) -> None:
+    records = pipeline(iter(range(100)), lambda r: (i * 2 for i in r), batch_size, queue_size)
+    assert list(records) == [i * 2 for i in range(100)]
+
+def test_pipeline_failure() -> None:
+    def rows():
+        yield 1
+        raise ValueError("bad row")
+
+    with pytest.raises(ValueError):
+        list(pipeline(rows(), lambda r: r, 1, 1))
+
+def test_pipeline_close() -> None:
+    """ The stages stop when the writer stops consuming """
+    records = pipeline(iter(range(10000)), lambda r: r, 1, 1)
+    assert next(records) == 0
+    records.close()
@@ -0,0 +1,216 @@
+import io
+import json
+import os
+import pickle
+import pytest
+import subprocess
+import sys
+
+from csv_to_json.csv_reader import parse_row
+from benchmarks.generate import Generator
+from csv_to_json.schema import load_schema, compile_key, compile_schema, keyed_pays, schema_source, register_converter
+from csv_to_json.transformers import SchemaToJson, AllergyToJson, ProblemToJson
+
+SCHEMA = {
+    "name": "visit",
+    "fields": 6,
+    "entries": "visits",
+    "columns": [
+        {"index": 1, "converter": "name", "path": "patient.name"},
+        {"index": 2, "converter": "string", "path": "patient.birth_date"},
+        {"index": 3, "converter": "code", "path": "patient.admin_sex"},
+        {"index": 4, "converter": "code", "path": "visits[].type"},
+        {"index": 5, "converter": "physician", "path": "visits[].physician", "optional": True}
+    ]
+}
+
+@pytest.mark.parametrize("transformer, name", [(AllergyToJson, "allergys"), (ProblemToJson, "problems")])
+def test_schema_transform(transformer, name: str) -> None:
+    """ The compiled schemas produce the expected JSON """
+    f = io.StringIO()
+    with open(f"tests/resources/{name}.csv") as f_csv:
+        transformer().csv_to_json(f_csv, f)
+    with open(f"tests/resources/{name}.json") as f_json:
+        assert [json.loads(line) for line in f.getvalue().split("\n")] == [json.loads(line) for line in f_json]
+
+def test_schema_dict() -> None:
+    transformer = SchemaToJson(SCHEMA, combine=True)
+    rows = [parse_row("1,Last|First,1950,F,Inpatient,1|Doc|Phys", 6), parse_row("2,Last|First,1950,F,Outpatient,", 6)]
+    assert list(transformer.transformation(iter(rows))) == [{
+        "patient": {"name": {"last": "Last", "first": "First"}, "birth_date": "1950", "admin_sex": {"id": "F"}},
+        "visits": [
+            {"type": {"id": "Inpatient"}, "physician": {"id": {"id": "1"}, "name": {"last": "Doc", "first": "Phys"}}},
+            {"type": {"id": "Outpatient"}}
+        ]
+    }]
+
+def test_schema_builtin_name(tmp_path, monkeypatch) -> None:
+    """ Built-in names aren't looked up on the file system (ex. an allergy input directory) """
+    root = os.getcwd()
+    (tmp_path / "allergy").mkdir()
+    (tmp_path / "allergy" / "allergys.csv").write_text(open("tests/resources/allergys.csv").read())
+    (tmp_path / "out").mkdir()
+    monkeypatch.chdir(tmp_path)
+    assert AllergyToJson().schema.name == "allergy"
+    subprocess.run([sys.executable, os.path.join(root, "transform.py"), "ALLERGY", "allergy", "out", "--keep"],
+        check=True, env=dict(os.environ, PYTHONPATH=root))
+    with open("out/allergys.json") as f, open(os.path.join(root, "tests/resources/allergys.json")) as f_expected:
+        assert f.read() == f_expected.read()
+
+def test_schema_path(tmp_path) -> None:
+    path = tmp_path / "visit.json"
+    path.write_text(json.dumps(SCHEMA))
+    assert load_schema(str(path)).name == "visit"
+    with pytest.raises(ValueError):
+        load_schema("visit")
+    with pytest.raises(ValueError):
+        load_schema(str(tmp_path))
+
+def test_schema_source() -> None:
+    """ Indexes and keys are inlined, only the optional columns are set on the dict """
+    source = schema_source(load_schema(SCHEMA))
+    assert "f4 = fields[4]" in source
+    assert "'physician'] = v" in source
+    assert "'type'] = " not in source
+
+def test_schema_register_converter() -> None:
+    register_converter("upper", lambda data: data[0][0].upper() if data else "")
+    schema = dict(SCHEMA, columns=[{"index": 1, "converter": "upper", "path": "last"}])
+    assert compile_schema(load_schema(schema))(parse_row("1,last", 6)) == {"last": "LAST"}
+
+@pytest.mark.parametrize("columns", [
+    [{"index": 1, "converter": "unknown", "path": "a"}],
+    [{"index": 1, "converter": "string", "path": "a"}, {"index": 2, "converter": "string", "path": "a.b"}],
+    [{"index": 1, "converter": "string", "path": "a", "optional": True}, {"index": 2, "converter": "string", "path": "b"}]
+])
+def test_schema_invalid(columns) -> None:
+    with pytest.raises(ValueError):
+        compile_schema(load_schema(dict(SCHEMA, columns=columns)))
+
+def test_schema_pickle() -> None:
+    transformer = pickle.loads(pickle.dumps(AllergyToJson(combine=True)))
+    assert transformer.combined and transformer.entries == "allergys"
+    assert transformer.transform(parse_row("1,2,Last", 19))["patient"]["name"] == {"last": "Last"}
+
+@pytest.mark.parametrize("combine", [False, True])
+@pytest.mark.parametrize("batch_size", [1, 3, 512])
+def test_columnar_transform(combine: bool, batch_size: int) -> None:
+    """ The columnar engine produces the same JSON as the row by row transform """
+    with open("tests/resources/allergy.csv") as f:
+        line = f.readline().rstrip("\n")
+    lines = [line.replace("ZZLast", f"ZZLast{i // 2}") for i in range(7)] + ["1,2,Last|First,,,,Drug"]
+    for transformer in [AllergyToJson, ProblemToJson]:
+        f, expected = io.StringIO(), io.StringIO()
+        transformer(combine=combine).csv_to_json(io.StringIO("\n".join(lines)), expected)
+        columnar = transformer(combine=combine, batch_size=batch_size, stats=True)
+        columnar.csv_to_json(io.StringIO("\n".join(lines)), f)
+        assert f.getvalue() == expected.getvalue()
+        assert columnar.stats.rows_transformed == len(lines)
+
+def test_columnar_pickle() -> None:
+    transformer = pickle.loads(pickle.dumps(AllergyToJson(batch_size=2)))
+    assert transformer.transform_batch([parse_row("1,2,Last", 19)])[0]["patient"]["name"] == {"last": "Last"}
+
+@pytest.mark.parametrize("combine", [False, True])
+@pytest.mark.parametrize("batch_size", [0, 3])
+def test_memo_transform(combine: bool, batch_size: int) -> None:
+    """ The memoized transform produces the same JSON as the unmemoized transform """
+    with open("tests/resources/allergy.csv") as f:
+        line = f.readline().rstrip("\n")
+    lines = [line.replace("ZZLast", f"ZZLast{i // 3}") for i in range(7)] + ["1,2,Last|First,,,,Drug"]
+    f, expected = io.StringIO(), io.StringIO()
+    AllergyToJson(combine=combine).csv_to_json(io.StringIO("\n".join(lines)), expected)
+    transformer = AllergyToJson(combine=combine, batch_size=batch_size, memo_size=2, stats=True)
+    transformer.csv_to_json(io.StringIO("\n".join(lines)), f)
+    assert f.getvalue() == expected.getvalue()
+
+    info = transformer.memo_info()
+    assert info["hits"] > 0 and info["size"] <= 2 * len(transformer.memos)
+    assert (transformer.stats.memo_hits, transformer.stats.memo_misses) == (info["hits"], info["misses"])
+
+def test_memo_aliasing() -> None:
+    """ Memoized values are copied for each record, no container is shared """
+    transformer = SchemaToJson(dict(SCHEMA, columns=[dict(c, memo=True) for c in SCHEMA["columns"]]),
+        combine=True, memo_size=16)
+    rows = [parse_row("1,Last|First,1950,F,Inpatient,1|Doc", 6) for _ in range(3)]
+    first, second = transformer.transform(rows[0]), transformer.transform(rows[1])
+    assert first["patient"]["name"] == second["patient"]["name"]
+    assert first["patient"]["name"] is not second["patient"]["name"]
+    assert first["visits"][0]["physician"]["id"] is not second["visits"][0]["physician"]["id"]
+    assert first["patient"] is not second["patient"] and first["visits"] is not second["visits"]
+    assert first["visits"][0] is not second["visits"][0]
+
+    records = list(transformer.transformation(iter(rows)))
+    assert len(records[0]["visits"]) == 3
+    assert transformer.transform(rows[0])["visits"] == [{"type": {"id": "Inpatient"},
+        "physician": {"id": {"id": "1"}, "name": {"last": "Doc"}}}]
+
+def test_memo_disabled() -> None:
+    assert AllergyToJson().memo_info() is None
+    assert "tuple(map(tuple" not in schema_source(load_schema("allergy"))
+
+def test_memo_pickle() -> None:
+    transformer = AllergyToJson(memo_size=4)
+    transformer.transform(parse_row("1,2,Last", 19))
+    transformer = pickle.loads(pickle.dumps(transformer))
+    assert transformer.memo_info()["misses"] == 0
+    assert transformer.transform(parse_row("1,2,Last", 19))["patient"]["name"] == {"last": "Last"}
+
+class UnkeyedAllergyToJson(AllergyToJson):
+    """ Combines the transformed records (the combine is overridden) """
+
+    def combine(self, trans, next_trans) -> bool:
+        return super().combine(trans, next_trans)
+
+@pytest.mark.parametrize("cluster", [1, 3, 10])
+@pytest.mark.parametrize("memo_size", [0, 8])
+def test_keyed_combine(cluster: int, memo_size: int) -> None:
+    """ Combining keyed on the raw person fields produces the same JSON as combining the records """
+    line = Generator("allergy", 0.2, 2, cluster, 1).line
+    lines = [line(i) for i in range(1, 50)]
+    # Equal converted person fields (the extra name subfield is dropped) | an empty name
+    lines += [lines[-1].replace("|Marie", "|Marie|X", 1), "1,2,,,,,Drug", "1,2,,,,,Drug", "1,2,|,,,,Drug"]
+    transformer = AllergyToJson(combine=True, memo_size=memo_size)
+    assert transformer.keyed and not UnkeyedAllergyToJson(combine=True).keyed
+    f, expected = io.StringIO(), io.StringIO()
+    UnkeyedAllergyToJson(combine=True).csv_to_json(io.StringIO("\n".join(lines)), expected)
+    transformer.csv_to_json(io.StringIO("\n".join(lines)), f)
+    assert f.getvalue() == expected.getvalue()
+
+def test_keyed_combine_unkeyable() -> None:
+    """ Schemas without (keyable) person columns combine the records """
+    columns = [dict(c, converter="physician") if c["path"] == "patient.name" else c for c in SCHEMA["columns"]]
+    assert compile_key(load_schema(dict(SCHEMA, columns=columns))) is None
+    assert compile_key(load_schema(dict(SCHEMA, columns=SCHEMA["columns"][1:]))) is None
+    assert not SchemaToJson(dict(SCHEMA, columns=columns), combine=True).keyed
+    assert compile_key(load_schema(SCHEMA))(parse_row("1,Last|First,1950,F", 6)) == (("Last", "First"), "1950", ("F",))
+
+def test_keyed_pays() -> None:
+    """ Problems (nearly all entry) combine the records, keying doesn't pay off """
+    assert keyed_pays(load_schema("allergy")) and not keyed_pays(load_schema("problem"))
+    assert AllergyToJson(combine=True).keyed and not ProblemToJson(combine=True).keyed
+
+def test_keyed_pickle() -> None:
+    transformer = pickle.loads(pickle.dumps(ProblemToJson(combine=True)))
+    rows = [parse_row("1,2,Last,1950,,,A", 26), parse_row("1,2,Last,1950,,,B", 26)]
+    assert [len(record["problems"]) for record in transformer.transformation(iter(rows))] == [2]
+
+class TaggedAllergyToJson(AllergyToJson):
+    """ Tags each record (the transform is overridden) """
+
+    def transform(self, fields):
+        return dict(super().transform(fields), tagged=True)
+
+@pytest.mark.parametrize("combine", [False, True])
+@pytest.mark.parametrize("batch_size", [0, 3])
+@pytest.mark.parametrize("memo_size", [0, 8])
+def test_transform_override(combine: bool, batch_size: int, memo_size: int) -> None:
+    """ A subclass transform isn't replaced by the compiled transform (keyed or columnar) """
+    with open("tests/resources/allergys.csv") as f:
+        text = f.read()
+    transformer = TaggedAllergyToJson(combine=combine, batch_size=batch_size, memo_size=memo_size)
+    assert not transformer.keyed
+    records = list(transformer.iter_records(io.StringIO(text)))
+    assert records and all(record["tagged"] for record in records)
+    transformer = pickle.loads(pickle.dumps(transformer))
+    assert all(record["tagged"] for record in transformer.iter_records(io.StringIO(text)))
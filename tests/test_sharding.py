@@ -0,0 +1,103 @@
+import gzip
+import json
+import os
+import pytest
+
+from typing import Iterator
+from testfixtures import TempDirectory
+
+from benchmarks.generate import generate
+from csv_to_json.parallel import convert_files
+from csv_to_json.sharding import ShardWriter, shard_path, index_path
+from csv_to_json.transformers import AllergyToJson
+
+@pytest.fixture()
+def dir() -> Iterator[TempDirectory]:
+    with TempDirectory() as dir:
+        yield dir
+
+def read_shards(dest: str) -> list:
+    """ The records of the indexed shards checking the index """
+    with open(index_path(dest)) as f:
+        index = json.load(f)
+    records, d = [], os.path.dirname(dest)
+    for shard in index["shards"]:
+        path = os.path.join(d, shard["path"])
+        assert shard["start"] == len(records) and shard["bytes"] == os.path.getsize(path)
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rt") as f:
+            lines = f.read().split("\n")
+        assert len(lines) == shard["records"]
+        records.extend(map(json.loads, lines))
+    assert index["records"] == len(records)
+    return records
+
+def test_shard_path() -> None:
+    assert shard_path("out/a.json", 1) == "out/a.00001.json"
+    assert shard_path("out/a.json.gz", 12) == "out/a.00012.json.gz"
+    assert index_path("out/a.json.gz") == "out/a.index.json"
+
+def test_shard_writer_invalid(dir: TempDirectory) -> None:
+    with pytest.raises(ValueError):
+        ShardWriter(dir.getpath("a.json"))
+
+@pytest.mark.parametrize("ext", ["", ".gz"])
+def test_shard_records(dir: TempDirectory, ext: str) -> None:
+    dest = dir.getpath("allergys.json" + ext)
+    assert AllergyToJson(shard_records=1).convert_file("tests/resources/allergys.csv", dest) == 2
+    with open("tests/resources/allergys.json") as f:
+        assert read_shards(dest) == [json.loads(line) for line in f]
+    assert sorted(os.listdir(dir.path)) == [f"allergys.00001.json{ext}", f"allergys.00002.json{ext}", "allergys.index.json"]
+
+def test_shard_size(dir: TempDirectory) -> None:
+    src = dir.getpath("allergy.csv")
+    rows = generate(src, "allergy", 64 * 1024, 0.1, 2, 1)
+    dest = dir.getpath("allergy.json")
+    transformer = AllergyToJson(shard_size=8 * 1024, stats=True)
+    transformer.convert_file(src, dest)
+
+    records = read_shards(dest)
+    assert len(records) == rows == transformer.stats.records_written
+    with open(index_path(dest)) as f:
+        shards = json.load(f)["shards"]
+    assert len(shards) > 4
+    assert all(shard["bytes"] <= 8 * 1024 + transformer.stats.largest_record + 1 for shard in shards)
+    assert transformer.stats.bytes_written == sum(shard["bytes"] for shard in shards)
+
+def test_shard_empty(dir: TempDirectory) -> None:
+    src = dir.write("empty.csv", "", encoding="utf-8")
+    dest = dir.getpath("empty.json")
+    assert AllergyToJson(shard_records=10).convert_file(src, dest) == 0
+    assert read_shards(dest) == []
+
+@pytest.mark.parametrize("combine", [False, True])
+def test_shard_parallel(dir: TempDirectory, combine: bool) -> None:
+    """ The shards of the ranges converted in parallel are renumbered in order """
+    src = dir.getpath("allergy.csv")
+    generate(src, "allergy", 64 * 1024, 0.1, 2, 3)
+    expected = dir.getpath("expected.json")
+    AllergyToJson(combine=combine).convert_file(src, expected)
+
+    dest = dir.getpath("allergy.json")
+    convert_files(AllergyToJson(combine=combine, shard_records=10), [(src, dest)], 2, 16 * 1024, False)
+    with open(expected) as f:
+        assert read_shards(dest) == [json.loads(line) for line in f]
+    assert not [name for name in os.listdir(dir.path) if ".part" in name]
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_shard_rerun(dir: TempDirectory, workers: int) -> None:
+    """ Converting again with fewer records leaves no shard of the previous run (the
+    second file is split into ranges with workers) """
+    src, small = dir.getpath("allergy.csv"), dir.getpath("small.csv")
+    generate(src, "allergy", 64 * 1024, 0.1, 2, 1)
+    rows = generate(small, "allergy", 24 * 1024, 0.1, 2, 1)
+    dest = dir.getpath("allergy.json")
+    AllergyToJson(shard_records=10).convert_file(src, dest)
+    assert len(os.listdir(dir.path)) > 10
+
+    convert_files(AllergyToJson(shard_records=rows // 2 + 1), [(small, dest)], workers, 16 * 1024, False)
+    assert len(read_shards(dest)) == rows
+    with open(index_path(dest)) as f:
+        shards = [shard["path"] for shard in json.load(f)["shards"]]
+    assert len(shards) < 5
+    assert sorted(os.listdir(dir.path)) == sorted(shards + ["allergy.csv", "allergy.index.json", "small.csv"])
@@ -0,0 +1,50 @@
+import random
+import pytest
+
+from csv_to_json import csv_reader
+from csv_to_json.csv_reader import PURE, parse_fields, split_escaped
+
+try:
+    from csv_to_json import _speedups
+except ImportError:
+    _speedups = None
+
+IMPLEMENTATIONS = [
+    pytest.param(PURE, id="pure"),
+    pytest.param(_speedups.__dict__ if _speedups else None, id="compiled",
+        marks=pytest.mark.skipif(_speedups is None, reason="compiled parsing isn't built")),
+]
+
+LINES = [
+    "", ",", "~", "|", "\"", "\"\"", "a", "1,a|b|c~d|e|f,,d", "a~~b,|,~|~", "a,,,", ",a|",
+    "1,\"a,\"\"\"|b|\",|~\",e|\"f\"\"\"~\"a~\"|\"b|\"|\"c,\"", "\"unterminated,a|b", "a\"b,c\"d|e",
+    "é,ü|ß~日本,\"ñ,ö\"", "line\r\n", "line\n\r", "line\n", "line\r", "line\n\n", "line\r\r",
+]
+
+def random_line(rng: random.Random) -> str:
+    return "".join(rng.choice("ab,|~\"é") for _ in range(rng.randrange(12)))
+
+@pytest.mark.parametrize("impl", IMPLEMENTATIONS)
+def test_parse_line(impl) -> None:
+    for line in LINES + [random_line(random.Random(i)) for i in range(2000)]:
+        assert impl["parse_line"](line) == list(map(parse_fields, split_escaped(line, ","))), line
+
+@pytest.mark.parametrize("impl", IMPLEMENTATIONS)
+def test_split_line(impl) -> None:
+    for line in LINES + [random_line(random.Random(i)).replace("\"", "") for i in range(2000)]:
+        if "\"" not in line:
+            assert impl["split_line"](line) == PURE["parse_line"](line), line
+
+@pytest.mark.parametrize("impl", IMPLEMENTATIONS)
+@pytest.mark.parametrize("field_cnt", [0, 3, 19])
+def test_parse_row(impl, field_cnt: int) -> None:
+    with open("tests/resources/allergys.csv") as f:
+        lines = f.readlines()
+    for line in LINES + lines + [random_line(random.Random(i)) + "\n" for i in range(500)]:
+        assert impl["parse_row"](line, field_cnt) == PURE["parse_row"](line, field_cnt), line
+
+def test_compiled() -> None:
+    """ The compiled parsing is used when built """
+    assert csv_reader.COMPILED == (_speedups is not None)
+    if _speedups is not None:
+        assert csv_reader.parse_row is _speedups.parse_row
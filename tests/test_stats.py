@@ -0,0 +1,72 @@
+import io
+import os
+import pickle
+import pytest
+
+from typing import Iterator
+from testfixtures import TempDirectory
+
+from csv_to_json.parallel import chunk_ranges, convert_files
+from csv_to_json.stats import Stats
+from csv_to_json.transformers import AllergyToJson, ProblemToJson
+
+@pytest.fixture()
+def dir() -> Iterator[TempDirectory]:
+    with TempDirectory() as dir:
+        yield dir
+
+def test_stats_disabled() -> None:
+    assert AllergyToJson().stats is None
+
+@pytest.mark.parametrize("combine", [False, True])
+def test_stats(combine: bool) -> None:
+    transformer = ProblemToJson(combine=combine, stats=True)
+    f = io.StringIO()
+    with open("tests/resources/problems.csv") as f_csv:
+        transformer.csv_to_json(f_csv, f)
+
+    stats = transformer.stats.to_dict()
+    assert stats["files"] == 1
+    assert stats["read"]["rows"] == 2
+    # Keyed, the merged rows of a person only have their entry transformed (timed as combine)
+    assert stats["transform"]["rows"] == (1 if combine and transformer.keyed else 2)
+    assert stats["read"]["bytes"] == os.path.getsize("tests/resources/problems.csv")
+    assert stats["combine"]["merged"] == (1 if combine else 0)
+    assert stats["write"]["records"] == (1 if combine else 2)
+    assert stats["write"]["bytes"] == len(f.getvalue())
+    assert stats["write"]["largest_record"] == max(map(len, f.getvalue().split("\n")))
+
+def test_stats_lines() -> None:
+    """ The lines split without | with the quote handling are reported """
+    transformer = AllergyToJson(stats=True)
+    with open("tests/resources/allergy.csv") as f:
+        text = f.readline() + "1,2,Last\n1,2,Last|First\n"
+    transformer.csv_to_json(io.StringIO(text), io.StringIO())
+    assert transformer.stats.to_dict()["read"]["fast_lines"] == 2
+    assert transformer.stats.to_dict()["read"]["quoted_lines"] == 1
+
+def test_stats_merge() -> None:
+    stats, other = Stats(), Stats()
+    stats.rows_read, stats.largest_record = 2, 10
+    other.rows_read, other.largest_record = 3, 5
+    stats.merge(other)
+    assert (stats.rows_read, stats.largest_record) == (5, 10)
+
+def test_stats_pickle() -> None:
+    transformer = AllergyToJson(stats=True)
+    transformer.stats.rows_read = 1
+    assert pickle.loads(pickle.dumps(transformer)).stats.rows_read == 0
+
+def test_stats_parallel(dir: TempDirectory) -> None:
+    src = dir.write("allergys.csv", open("tests/resources/allergys.csv").read(), encoding="utf-8")
+    transformer = AllergyToJson(combine=True, stats=True)
+    convert_files(transformer, [(src, dir.getpath("allergys.json"))], 2)
+    assert (transformer.stats.files, transformer.stats.rows_read, transformer.stats.merged) == (1, 2, 1)
+
+def test_stats_parallel_ranges(dir: TempDirectory) -> None:
+    """ A file split into ranges is counted once """
+    src = dir.write("allergys.csv", open("tests/resources/allergys.csv").read() * 20, encoding="utf-8")
+    transformer = AllergyToJson(stats=True)
+    assert len(chunk_ranges(transformer, src, 2000)) > 1
+    convert_files(transformer, [(src, dir.getpath("allergys.json"))], 2, 2000)
+    assert (transformer.stats.files, transformer.stats.rows_read) == (1, 40)
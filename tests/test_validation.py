@@ -0,0 +1,156 @@
+import asyncio
+import io
+import json
+import os
+import pytest
+
+from typing import Iterator, List
+from testfixtures import TempDirectory
+
+from csv_to_json.csv_reader import mmap_reader, parse_row, range_reader
+from csv_to_json.parallel import chunk_ranges, convert_files
+from csv_to_json.transformers import AllergyToJson
+from csv_to_json.validation import ValidatingReader, quarantine_path
+
+@pytest.fixture()
+def dir() -> Iterator[TempDirectory]:
+    with TempDirectory() as dir:
+        yield dir
+
+def allergy_line() -> str:
+    with open("tests/resources/allergy.csv") as f:
+        return f.readline().rstrip("\n")
+
+def replace_field(line: str, i: int, value: str) -> str:
+    fields = line.split(",")
+    fields[i] = value
+    return ",".join(fields)
+
+def invalid_lines() -> List[str]:
+    """ A valid line followed by each invalid line with its error and a last valid line """
+    line = allergy_line()
+    return [line, line + ",extra", ",".join(line.split(",")[:5]), replace_field(line, 6, "\"Drug"),
+        replace_field(line, 3, ""), replace_field(line, 7, "|Amoxicillin|RXCUI"), line]
+
+ERRORS = ["20 fields, expected 19", "5 fields, expected 19", "unbalanced quotes", "missing patient.birth_date",
+    "missing allergys[].allergen"]
+
+def read_quarantine(path: str) -> List[dict]:
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+def test_quarantine_path() -> None:
+    assert quarantine_path("out/a.json") == "out/a.quarantine.json"
+    assert quarantine_path("out/a.json.gz") == "out/a.quarantine.json"
+
+@pytest.mark.parametrize("header", [False, True])
+def test_validate(dir: TempDirectory, header: bool) -> None:
+    lines = invalid_lines()
+    src = dir.write("allergy.csv", "\n".join((["SEQ|ALLERGY"] if header else []) + lines) + "\n", encoding="utf-8")
+    dest = dir.getpath("allergy.json")
+    transformer = AllergyToJson(validate=True, stats=True)
+    assert transformer.convert_file(src, dest) == 2
+
+    expected = [AllergyToJson().transform(parse_row(lines[0], 19))] * 2
+    with open(dest) as f:
+        assert [json.loads(line) for line in f] == expected
+    first = 2 if header else 1
+    assert read_quarantine(dir.getpath("allergy.quarantine.json")) == [
+        {"line": first + i, "error": error, "data": data} for i, (error, data) in enumerate(zip(ERRORS, lines[1:]), 1)]
+    assert transformer.stats.rows_rejected == len(ERRORS)
+    assert transformer.stats.rows_read == 2
+
+@pytest.mark.parametrize("mmap", [False, True])
+def test_validate_csv_to_json(dir: TempDirectory, mmap: bool) -> None:
+    """ The file conversions validate to the quarantine file """
+    lines = invalid_lines()
+    src = dir.write("allergy.csv", "\n".join(lines) + "\n", encoding="utf-8")
+    transformer = AllergyToJson(validate=True, stats=True)
+    f, quarantine = io.StringIO(), io.StringIO()
+    if mmap:
+        transformer.file_to_json(src, f, quarantine)
+    else:
+        with open(src) as f_csv:
+            transformer.csv_to_json(f_csv, f, quarantine)
+    assert len(f.getvalue().split("\n")) == 2
+    assert [json.loads(line)["error"] for line in quarantine.getvalue().splitlines()] == ERRORS
+    assert not quarantine.closed and transformer.stats.rows_rejected == len(ERRORS)
+
+def test_validate_csv_to_json_short_row() -> None:
+    """ A short row isn't converted, validating without a quarantine file is an error """
+    transformer, f, quarantine = AllergyToJson(validate=True, stats=True), io.StringIO(), io.StringIO()
+    transformer.csv_to_json(io.StringIO("1,2,3\n"), f, quarantine)
+    assert f.getvalue() == "" and transformer.stats.to_dict()["read"]["rejected"] == 1
+    with pytest.raises(ValueError):
+        transformer.csv_to_json(io.StringIO("1,2,3\n"), f)
+
+def test_validate_iter_records() -> None:
+    """ The rejected rows are skipped (counted) or handed to the quarantine callback """
+    lines = invalid_lines()
+    expected = [AllergyToJson().transform(parse_row(lines[0], 19))] * 2
+    transformer = AllergyToJson(validate=True, stats=True)
+    assert list(transformer.iter_records(io.StringIO("\n".join(lines)))) == expected
+    assert transformer.stats.rows_rejected == len(ERRORS)
+    assert list(AllergyToJson(validate=True).iter_records(io.StringIO("1,2,3\n"))) == []
+
+    rejected = []
+    batches = AllergyToJson(validate=True).iter_batches(io.StringIO("\n".join(lines)), 5,
+        quarantine=lambda *row: rejected.append(row))
+    assert list(batches) == [expected]
+    assert [(line_no, error) for line_no, error, _ in rejected] == list(zip(range(2, 7), ERRORS))
+
+def test_validate_aiter_records() -> None:
+    async def collect(quarantine) -> List[dict]:
+        records = AllergyToJson(validate=True).aiter_records(io.StringIO("\n".join(lines)), batch_size=1,
+            quarantine=quarantine)
+        return [record async for record in records]
+
+    lines, rejected = invalid_lines(), []
+    expected = [AllergyToJson().transform(parse_row(lines[0], 19))] * 2
+    assert asyncio.run(collect(None)) == expected
+    assert asyncio.run(collect(lambda *row: rejected.append(row))) == expected
+    assert [error for _, error, _ in rejected] == ERRORS
+
+def test_validate_valid(dir: TempDirectory) -> None:
+    """ The quarantine file is only created for rejected rows """
+    dest = dir.getpath("allergys.json")
+    AllergyToJson(validate=True).convert_file("tests/resources/allergys.csv", dest)
+    with open(dest) as f, open("tests/resources/allergys.json") as f_expected:
+        assert f.read() == f_expected.read()
+    assert os.listdir(dir.path) == ["allergys.json"]
+
+def test_validate_disabled(dir: TempDirectory) -> None:
+    src = dir.write("allergy.csv", "\n".join(invalid_lines()) + "\n", encoding="utf-8")
+    AllergyToJson().convert_file(src, dir.getpath("allergy.json"))
+    assert os.listdir(dir.path) == ["allergy.csv", "allergy.json"]
+
+def test_first_line(dir: TempDirectory) -> None:
+    line = allergy_line()
+    src = dir.write("allergy.csv", "\n".join(["SEQ|ALLERGY"] + [line] * 4) + "\n", encoding="utf-8")
+    assert mmap_reader(src, 19).first_line() == 2
+    start = len("SEQ|ALLERGY\n") + 2 * (len(line) + 1)
+    assert range_reader(src, 19, start, os.path.getsize(src)).first_line() == 4
+    assert range_reader(src, 19, 0, start).first_line() == 2
+
+def test_validating_reader(dir: TempDirectory) -> None:
+    lines = invalid_lines()
+    src = dir.write("allergy.csv", "\n".join(lines) + "\n", encoding="utf-8")
+    rejected = []
+    rows = list(ValidatingReader(mmap_reader(src, 19), {3: "birth_date"}, lambda *row: rejected.append(row)))
+    assert len(rows) == 3 and all(len(row) == 19 for row in rows)
+    assert [line_no for line_no, _, _ in rejected] == [2, 3, 4, 5]
+
+def test_validate_parallel(dir: TempDirectory) -> None:
+    lines = invalid_lines()
+    src = dir.write("allergy.csv", "\n".join(["SEQ|ALLERGY"] + lines * 10) + "\n", encoding="utf-8")
+    transformer = AllergyToJson(validate=True, stats=True)
+    assert len(chunk_ranges(transformer, src, 2000)) > 1
+
+    convert_files(transformer, [(src, dir.getpath("allergy.json"))], 2, 2000)
+    with open(dir.getpath("allergy.json")) as f:
+        assert len(f.read().split("\n")) == 20
+    quarantined = read_quarantine(dir.getpath("allergy.quarantine.json"))
+    assert [row["line"] for row in quarantined] == [2 + i * len(lines) + j for i in range(10) for j in range(1, 6)]
+    assert [row["error"] for row in quarantined] == ERRORS * 10
+    assert transformer.stats.rows_rejected == 50
+    assert sorted(os.listdir(dir.path)) == ["allergy.json", "allergy.quarantine.json"]
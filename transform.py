@@ -1,31 +1,191 @@
 """ Transformation script """
+import argparse
+import json
 import sys
 import os
-import csv_to_json.transformers as transformers
+import time
+from csv_to_json.compressed import compression, strip_compression
+
+# Transformer class of each built-in type, only the requested type is built
+TRANSFORMERS = {"ALLERGY": "AllergyToJson", "PROBLEM": "ProblemToJson"}
+
+def build_transformer(trans_type: str, options: dict):
+    """ Builds the transformer of the type (built-in type or JSON schema path) """
+    import csv_to_json.transformers as transformers
+    if trans_type.upper() in TRANSFORMERS:
+        return getattr(transformers, TRANSFORMERS[trans_type.upper()])(**options)
+    if trans_type.upper().endswith(".JSON") and os.path.isfile(trans_type):
+        return transformers.SchemaToJson(trans_type, **options)
+    raise ValueError(f"Invalid transformation type {trans_type}")
+
+# Patient fields the person key of --person is built from (see csv_transfomer.person_key)
+PERSON = ("name", "birth_date", "admin_sex")
+
+def person(value: str) -> dict:
+    """ The JSON patient of --person """
+    try:
+        patient = json.loads(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid patient {value} (JSON)")
+    if not isinstance(patient, dict) or any(key not in patient for key in PERSON):
+        raise argparse.ArgumentTypeError(f"invalid patient {value} (a JSON object with {', '.join(PERSON)})")
+    return patient
+
+def line_range(value: str) -> tuple:
+    """ The FIRST:LAST (inclusive) line numbers of --lines """
+    try:
+        first, last = map(int, value.split(":"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid line range {value} (FIRST:LAST)")
+    return first, last
 
 def main():
-    if len(sys.argv) < 4:
-        print("Usage: python transform.py type in_dir out_dir option")
+    parser = argparse.ArgumentParser(description="CSV to JSON transform")
+    parser.add_argument("type", help="transformation type (ALLERGY, PROBLEM) or the path of a JSON schema file")
+    parser.add_argument("in_dir", help="directory to scan for csv files")
+    parser.add_argument("out_dir", help="directory to write the json files to")
+    parser.add_argument("-C", "-c", dest="combine", action="store_true", help="combine records for a person")
+    parser.add_argument("--group", action="store_true",
+        help="combine all the records of a person regardless of their order (external sort)")
+    parser.add_argument("--group-budget", type=int, default=256,
+        help="memory (MB) used to group records before spilling sorted runs to temp files")
+    parser.add_argument("--batch-size", type=int, default=0,
+        help="transform batches of rows column by column (columnar engine, 0 transforms row by row)")
+    parser.add_argument("--memo-size", type=int, default=0,
+        help="memoize the conversions of repeated patient | encounter | physician fields (LRU entries, 0 disables)")
+    parser.add_argument("--workers", type=int, default=1, help="number of worker processes")
+    parser.add_argument("--chunk-size", type=int, default=64, help="size (MB) of the ranges (checkpoint segments) large files are split into")
+    parser.add_argument("--json-backend", choices=["json", "orjson"], default="json",
+        help="JSON encoder (json is byte identical to json.dumps, orjson writes compact UTF-8 JSON)")
+    parser.add_argument("--stats", metavar="PATH", help="write a JSON summary of the stage metrics to the path")
+    parser.add_argument("--pipeline", action="store_true",
+        help="read, transform and write on separate threads connected by bounded queues")
+    parser.add_argument("--compress", choices=[".gz", ".bz2", ".zst"],
+        help="compress the json files (csv files are decompressed by extension, ex. .csv.gz)")
+    parser.add_argument("--compress-level", type=int, help="compression level (codec default when omitted)")
+    parser.add_argument("--checkpoint", action="store_true",
+        help="checkpoint the conversions (manifest in out_dir) resuming failed runs, skipping converted files")
+    parser.add_argument("--shard-records", type=int, default=0,
+        help="split the json files into shards (name.00001.json, ...) of the number of records, indexed in name.index.json")
+    parser.add_argument("--shard-size", type=int, default=0, help="split the json files into shards of the size (MB)")
+    parser.add_argument("--validate", action="store_true",
+        help="validate the rows (field count, quotes, required fields) writing rejected rows to name.quarantine.json")
+    parser.add_argument("--keep", action="store_true", help="keep the csv files once converted")
+    parser.add_argument("--index", action="store_true",
+        help="build the line index (name.csv.index.json) of each csv file in in_dir instead of converting")
+    parser.add_argument("--index-every", type=int, default=1000, help="rows between the offsets of the line index")
+    select = parser.add_mutually_exclusive_group()
+    select.add_argument("--lines", type=line_range, metavar="FIRST:LAST",
+        help="only convert the lines FIRST to LAST (file line numbers, inclusive) seeking through the line index")
+    select.add_argument("--person", type=person, action="append", metavar="PATIENT",
+        help="only convert the rows of the patient (JSON patient of a record), repeatable")
+    parser.add_argument("--mmap", action="store_true", help="read the csv files through a memory map")
+    parser.add_argument("--watch", action="store_true",
+        help="keep running, converting the csv files as they arrive in in_dir")
+    parser.add_argument("--interval", type=float, default=1.0, help="seconds between polls of in_dir when watching")
+    parser.add_argument("--serve", metavar="SOCKET",
+        help="keep running, converting the csv files of in_dir named by the jobs sent to the unix socket")
+    args = parser.parse_args()
+    if args.checkpoint and args.workers > 1:
+        parser.error("--checkpoint isn't supported with --workers")
+    if args.checkpoint and (args.shard_records or args.shard_size):
+        parser.error("--checkpoint isn't supported with --shard-records / --shard-size")
+    if args.checkpoint and args.validate:
+        parser.error("--checkpoint isn't supported with --validate")
+    if (args.watch or args.serve) and (args.workers > 1 or args.checkpoint):
+        parser.error("--watch / --serve aren't supported with --workers or --checkpoint")
+    if (args.lines or args.person) and (args.workers > 1 or args.checkpoint or args.shard_records or
+            args.shard_size or args.validate or args.watch or args.serve):
+        parser.error("--lines / --person aren't supported with --workers, --checkpoint, --shard-*, --validate,"
+            " --watch or --serve")
+
+    options = dict(combine=args.combine, json_backend=args.json_backend, stats=args.stats is not None,
+        pipeline=args.pipeline, group=args.group, group_budget=args.group_budget * 1024 * 1024,
+        batch_size=args.batch_size, memo_size=args.memo_size, shard_records=args.shard_records,
+        shard_size=args.shard_size * 1024 * 1024, validate=args.validate)
+    try:
+        transformer = build_transformer(args.type, options)
+    except ValueError:
+        print("Invalid transformation type.\n\nSupported Types:\nALLERGY, PROBLEM, <schema>.json")
         sys.exit(1)
 
-    combine = "-C" == sys.argv[4].upper() if len(sys.argv) == 5 else False
-    dispatch = { 
-        "ALLERGY": transformers.AllergyToJson(combine=combine),
-        "PROBLEM": transformers.ProblemToJson(combine=combine)
-    }
+    src_dir, dest_dir = args.in_dir, args.out_dir
+    join = os.path.join
+    ext = "".join([".json", args.compress]) if args.compress else ".json"
+    if args.watch or args.serve:
+        serve(args, transformer, options, ext)
+        return
 
-    trans_type = sys.argv[1].upper()
-    if not trans_type in dispatch:
-        print("Invalid transformation type.\n\nSupported Types:\nALLERGY, PROBLEM")
-        sys.exit(1)
+    files = [(join(src_dir, filename), join(dest_dir, "".join([strip_compression(filename)[:-4], ext])))
+        for filename in os.listdir(src_dir) if strip_compression(filename).endswith(".csv")]
+
+    start = time.perf_counter()
+    if args.index:
+        from csv_to_json.line_index import index_file
+        for src, _ in files:
+            if not compression(src):
+                index_file(src, transformer, args.index_every)
+        return
+    if args.lines or args.person:
+        # The selected rows are converted, the csv files are kept
+        from csv_to_json.line_index import convert_lines, convert_people
+        for src, dest in files:
+            if args.lines:
+                convert_lines(transformer, src, dest, *args.lines, args.compress_level)
+            else:
+                convert_people(transformer, src, dest, args.person, args.compress_level)
+    elif args.workers > 1:
+        from csv_to_json.parallel import convert_files
+        convert_files(transformer, files, args.workers, args.chunk_size * 1024 * 1024, not args.keep,
+            args.compress_level)
+    elif args.checkpoint:
+        from csv_to_json.checkpoint import MANIFEST, Manifest, convert_checkpointed
+        manifest = Manifest(join(dest_dir, MANIFEST))
+        for src, dest in files:
+            convert_checkpointed(transformer, src, dest, manifest, args.chunk_size * 1024 * 1024, args.compress_level)
+            if not args.keep:
+                remove_csv(src)
+    else:
+        for src, dest in files:
+            transformer.convert_file(src, dest, args.mmap, args.compress_level)
+            if not args.keep:
+                remove_csv(src)
+
+    if args.stats:
+        summary = dict(transformer.stats.to_dict(), wall_time=round(time.perf_counter() - start, 6),
+            workers=args.workers)
+        with open(args.stats, "w") as f_stats:
+            json.dump(summary, f_stats, indent=2)
+
+def remove_csv(src: str) -> None:
+    """ Removes the converted csv file and its line index (imported when removing) """
+    from csv_to_json.line_index import remove_csv
+    remove_csv(src)
+
+def serve(args: argparse.Namespace, transformer, options: dict, ext: str) -> None:
+    """ Runs the persistent service (see csv_to_json/daemon.py) until interrupted """
+    import signal
+    from csv_to_json.daemon import Service
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    service = Service(lambda trans_type: build_transformer(trans_type, options), args.type, args.in_dir,
+        args.out_dir, ext, args.mmap, args.compress_level, args.keep)
+    service.transformers[args.type] = transformer
+    try:
+        if args.serve:
+            with service.serve(args.serve) as server:
+                try:
+                    server.serve_forever()
+                finally:
+                    os.remove(args.serve)
+        else:
+            service.watch(args.interval)
+    except KeyboardInterrupt:
+        pass
 
-    src_dir, dest_dir = sys.argv[2], sys.argv[3]
-    join, remove, transformer = os.path.join, os.remove, dispatch[trans_type]
-    for filename in list(filter(lambda f: f.endswith(".csv"), os.listdir(src_dir))):
-        src, dest = join(src_dir, filename), join(dest_dir, "".join([filename[:-3], "json"]))
-        with open(src) as f_csv, open(dest, "w") as f_json:
-            transformer.csv_to_json(f_csv, f_json)
-        remove(src)
+    stats = service.stats()
+    if args.stats and stats is not None:
+        with open(args.stats, "w") as f_stats:
+            json.dump(stats.to_dict(), f_stats, indent=2)
 
 if __name__ == "__main__":
     main()